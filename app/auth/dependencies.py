@@ -1,44 +1,175 @@
+import os
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Dict, Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from app.cache import LRUCache
 from app.config import settings
-from app.database import get_db
+from app.database import get_async_db
 from app.models import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+# Authenticated users kept per process, keyed by (user id, token iat). The TTL
+# bounds how long another process's change to a user can go unnoticed here.
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+
+# (user id, iat) -> User column values
+principal_cache = LRUCache(PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+# Bumped by every invalidation; a lookup that started before one does not cache what it read
+_principal_generation = 0
+
+# Session.info key of the user ids a transaction changed (ALL_USERS after a bulk UPDATE/DELETE)
+_CHANGED_USERS = "changed_user_ids"
+ALL_USERS = "*"
+
+
+@dataclass(frozen=True)
+class TokenClaims:
+    user_id: int
+    issued_at: Optional[int]  # None for tokens issued before iat was added
+    expires_at: Optional[int] = None
+
+
+# Token string -> claims of a token whose signature was verified
+claims_cache = LRUCache(PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create JWT access token."""
     to_encode = data.copy()
+    if "sub" in to_encode:
+        to_encode["sub"] = str(to_encode["sub"])  # RFC 7519: the subject is a string
+    now = datetime.utcnow()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=settings.JWT_EXPIRATION_MINUTES)
-    to_encode.update({"exp": expire})
+        expire = now + timedelta(minutes=settings.JWT_EXPIRATION_MINUTES)
+    to_encode.update({"exp": expire, "iat": now})
     encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
     return encoded_jwt
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
-    """Dependency to get current authenticated user from JWT token."""
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
-        user_id: int = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+
+
+def decode_access_token(token: str) -> TokenClaims:
+    """
+    Verify the token's signature and expiry and read its claims; raises 401.
+    A token verified before is only checked for expiry again.
+    """
+    claims = claims_cache.get(token)
+    if claims is None:
+        try:
+            payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
+            claims = TokenClaims(int(payload["sub"]), payload.get("iat"), payload.get("exp"))
+        except (JWTError, KeyError, TypeError, ValueError):
+            raise _credentials_exception()
+        claims_cache.put(token, claims)
+    elif claims.expires_at is not None and claims.expires_at <= time.time():
+        claims_cache.pop(token)
+        raise _credentials_exception()
+    return claims
+
+
+async def get_token_claims(token: str = Depends(oauth2_scheme)) -> TokenClaims:
+    """Claims-only dependency: no database access, so a deleted user's token stays valid until it expires."""
+    return decode_access_token(token)
+
+
+async def get_current_user_id(claims: TokenClaims = Depends(get_token_claims)) -> int:
+    """For routes that only scope their queries by user id (a deleted user simply owns nothing)."""
+    return claims.user_id
+
+
+def _detached_user(values: Dict[str, Any]) -> User:
+    """A fresh detached User per request, so requests never share (or mutate) one instance."""
+    user = User(**values)
+    make_transient_to_detached(user)
+    return user
+
+
+async def get_current_user(
+    claims: TokenClaims = Depends(get_token_claims), db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """
+    Dependency to get current authenticated user from JWT token. The user
+    is read from :data:`principal_cache` when this process resolved the
+    same token recently; the returned User is detached from ``db``.
+    """
+    key = (claims.user_id, claims.issued_at)
+    values = principal_cache.get(key)
+    if values is None:
+        generation = _principal_generation
+        user = (await db.execute(select(User).where(User.id == claims.user_id))).scalar_one_or_none()
+        if user is None:
+            raise _credentials_exception()
+        values = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+        if generation == _principal_generation:  # no user change committed while reading
+            principal_cache.put(key, values)
+    return _detached_user(values)
+
+
+def invalidate_principal(user_id: Optional[int] = None) -> int:
+    """Forget every cached token of a user (of every user with None). Returns the number of entries dropped."""
+    global _principal_generation
+    _principal_generation += 1
+    if user_id is None:
+        dropped = len(principal_cache)
+        principal_cache.clear()
+        return dropped
+    return principal_cache.pop_where(lambda key: key[0] == user_id)
+
+
+# Users changed through the ORM in this process are forgotten once the change
+# commits: invalidating at flush would let a concurrent request cache the old
+# row again before the commit. Other processes catch up within
+# PRINCIPAL_CACHE_TTL, as do changes made with Core statements outside a Session.
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _remember_changed_user(mapper, connection, target: User) -> None:
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_CHANGED_USERS, set()).add(target.id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _remember_bulk_user_change(orm_execute_state) -> None:
+    # session.query(User).update(...) and update(User) / delete(User) skip the mapper events
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, "table", None)
+    if table is User.__table__ or any(mapper.class_ is User for mapper in orm_execute_state.all_mappers):
+        orm_execute_state.session.info.setdefault(_CHANGED_USERS, set()).add(ALL_USERS)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session: Session) -> None:
+    changed = session.info.pop(_CHANGED_USERS, None)
+    if not changed:
+        return
+    if ALL_USERS in changed:
+        invalidate_principal()
+        return
+    for user_id in changed:
+        invalidate_principal(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_users(session: Session) -> None:
+    session.info.pop(_CHANGED_USERS, None)
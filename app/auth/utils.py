@@ -1,6 +1,61 @@
+"""
+Password hashing.
+
+New hashes use the first scheme of ``PASSWORD_SCHEMES`` (default
+``bcrypt``; ``argon2,bcrypt`` needs the ``argon2-cffi`` package). Hashes of
+the other schemes, or bcrypt hashes below ``BCRYPT_ROUNDS``, still verify
+and are replaced on the next successful login (:func:`verify_and_update`).
+
+Hashing is deliberately slow (bcrypt at cost 12 is about 250 ms of CPU).
+Request handlers run it on :data:`password_pool`: ``PASSWORD_HASH_WORKERS``
+threads (bcrypt releases the GIL) or, with ``PASSWORD_HASH_POOL=process``,
+processes, admitting at most ``PASSWORD_HASH_MAX_PENDING`` calls at a time.
+A login burst beyond that fails fast with :class:`PasswordPoolBusy` instead
+of queueing behind seconds of work and starving FastAPI's threadpool.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+try:
+    import argon2  # noqa: F401  (passlib's argon2 backend)
+
+    ARGON2_AVAILABLE = True
+except ImportError:  # optional dependency
+    ARGON2_AVAILABLE = False
+
+PASSWORD_POOL_KINDS = ["thread", "process"]
+
+PASSWORD_SCHEMES = [name.strip() for name in os.getenv("PASSWORD_SCHEMES", "bcrypt").split(",") if name.strip()]
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+PASSWORD_HASH_POOL = os.getenv("PASSWORD_HASH_POOL", "thread")
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+# Hashes running or queued at once; more are refused (HTTP 503)
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(4 * PASSWORD_HASH_WORKERS)))
+
+
+def build_context(schemes: Optional[List[str]] = None, bcrypt_rounds: int = BCRYPT_ROUNDS) -> CryptContext:
+    """CryptContext hashing with ``schemes[0]``; the rest (and weaker bcrypt costs) need an update."""
+    schemes = schemes or PASSWORD_SCHEMES
+    if "argon2" in schemes and not ARGON2_AVAILABLE:
+        raise RuntimeError("PASSWORD_SCHEMES=argon2 requires the argon2-cffi package")
+    return CryptContext(
+        schemes=schemes,
+        deprecated="auto",
+        bcrypt__default_rounds=bcrypt_rounds,
+        bcrypt__min_rounds=bcrypt_rounds,
+    )
+
+
+pwd_context = build_context()
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -10,4 +65,64 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     """Hash a plain password."""
-    return pwd_context.hash(password)
\ No newline at end of file
+    return pwd_context.hash(password)
+
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password; on success also return a new hash when the stored one uses an outdated scheme or cost."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordPoolBusy(RuntimeError):
+    """PASSWORD_HASH_MAX_PENDING hashes are already running or queued."""
+
+
+class PasswordHashPool:
+    """Bounded executor for password hashing, shared by every event loop of the process."""
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_pending: int = PASSWORD_HASH_MAX_PENDING,
+        kind: str = PASSWORD_HASH_POOL,
+    ):
+        if kind not in PASSWORD_POOL_KINDS:
+            raise ValueError(f"Unknown PASSWORD_HASH_POOL {kind!r} (expected one of {', '.join(PASSWORD_POOL_KINDS)})")
+        self.workers = max(workers, 1)
+        self.max_pending = max(max_pending, 1)
+        self.kind = kind
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run ``fn(*args)`` on the pool; raises PasswordPoolBusy when the pool is full."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordPoolBusy(f"{self.pending} password hashes pending")
+            self.pending += 1
+            executor = self._get_executor()
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+password_pool = PasswordHashPool()
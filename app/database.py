@@ -1,5 +1,8 @@
 import os
-from sqlalchemy import create_engine
+from typing import Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
@@ -7,13 +10,113 @@ from app.config import settings
 # Ensure data directory exists
 os.makedirs("data", exist_ok=True)
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {},
-)
+# Optional read replica for the read-only insights endpoints (see get_read_db)
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+
+# Async driver per sync URL scheme, used by the async session layer
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+# Connection pool (PostgreSQL and other server databases)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds; stay under server/proxy idle timeouts
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# SQLite profile: WAL lets dashboard reads proceed during an ingestion write,
+# and busy_timeout makes writers wait for each other instead of failing
+# with "database is locked".
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+SQLITE_CACHE_SIZE_KIB = int(os.getenv("SQLITE_CACHE_SIZE_KIB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 2**20)))
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # durable at checkpoints; safe with WAL
+    "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+    "cache_size": -SQLITE_CACHE_SIZE_KIB,  # negative: KiB rather than pages
+    "mmap_size": SQLITE_MMAP_SIZE,
+    "temp_store": "MEMORY",
+}
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def create_db_engine(url: str, **kwargs) -> Engine:
+    """
+    Engine for ``url`` with the profile of its backend: connect-time pragmas
+    for SQLite, a sized and recycled connection pool with pre-ping otherwise.
+    Keyword arguments override the defaults.
+    """
+    if url.startswith("sqlite"):
+        options = {"connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+        options.update(kwargs)
+        sqlite_engine = create_engine(url, **options)
+        event.listen(sqlite_engine, "connect", _set_sqlite_pragmas)
+        return sqlite_engine
+
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    options.update(kwargs)
+    return create_engine(url, **options)
+
+
+def async_database_url(url: str) -> str:
+    """``url`` with the backend's async driver, e.g. sqlite+aiosqlite:// for sqlite://."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend} databases")
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+def create_async_db_engine(url: str, **kwargs) -> AsyncEngine:
+    """Async counterpart of :func:`create_db_engine` (same pragmas and pool settings)."""
+    url = async_database_url(url)
+    if url.startswith("sqlite"):
+        options = {"connect_args": {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+        options.update(kwargs)
+        sqlite_engine = create_async_engine(url, **options)
+        event.listen(sqlite_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        return sqlite_engine
+
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    options.update(kwargs)
+    return create_async_engine(url, **options)
+
+
+engine = create_db_engine(settings.DATABASE_URL)
+
+read_engine: Optional[Engine] = create_db_engine(READ_DATABASE_URL) if READ_DATABASE_URL else None
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine or engine)
+
+async_engine = create_async_db_engine(settings.DATABASE_URL)
+
+async_read_engine: Optional[AsyncEngine] = create_async_db_engine(READ_DATABASE_URL) if READ_DATABASE_URL else None
+
+# expire_on_commit=False: attributes cannot be lazy loaded after a commit in async code
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine or async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 
@@ -26,7 +129,35 @@ def get_db():
         db.close()
 
 
+def get_read_db():
+    """
+    Dependency to get a DB session for read-only endpoints: on the replica
+    when READ_DATABASE_URL is set (reads may lag behind writes), otherwise
+    on the primary.
+    """
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """
+    Dependency to get an async DB session. Routes using it run on the event
+    loop instead of FastAPI's threadpool, so slow queries do not hold a thread.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_async_read_db():
+    """Async counterpart of :func:`get_read_db`."""
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
 def init_db():
-    """Create all tables."""
-    from app.models import User, FacebookAccount, MetricSnapshot  # noqa
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    """Bring the schema up to date by applying pending migrations (see app/migrations)."""
+    from app.migrations import upgrade
+    upgrade(engine)
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""
+Per action type breakdowns of insight rows.
+
+Every Graph API row's ``actions`` and ``action_values`` arrays are stored as
+``metric_actions`` rows (one per action type) next to the snapshot, so
+funnel and pixel event totals are indexed SQL instead of JSON scans. Which
+action types count as the snapshot's ``conversions`` / ``revenue`` is
+configurable per account; changing it recomputes both from the stored
+breakdowns.
+"""
+import json
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Integer, cast, delete, func, select, update
+from sqlalchemy.orm import Session
+
+from app.facebook.rollups import rebuild_rollups
+from app.models import FacebookAccount, MetricAction, MetricSnapshot
+from app.response_cache import bump_data_version
+
+CONVERSION_ACTION_TYPES = ["purchase", "offsite_conversion.fb_pixel_purchase"]
+
+# action_type -> (count, value)
+ActionBreakdown = Dict[str, Tuple[float, float]]
+
+
+def parse_actions(insight: Dict[str, Any]) -> ActionBreakdown:
+    """Merge an insight's ``actions`` and ``action_values`` arrays by action type."""
+    counts: Dict[str, float] = {}
+    values: Dict[str, float] = {}
+    for target, key in ((counts, "actions"), (values, "action_values")):
+        for action in insight.get(key) or []:
+            action_type = action.get("action_type")
+            if action_type:
+                target[action_type] = target.get(action_type, 0.0) + float(action.get("value", 0))
+    return {name: (counts.get(name, 0.0), values.get(name, 0.0)) for name in sorted(counts.keys() | values.keys())}
+
+
+def conversion_totals(actions: ActionBreakdown, conversion_types: Iterable[str]) -> Tuple[int, float]:
+    """``(conversions, revenue)`` of a breakdown for the given conversion action types."""
+    conversions, revenue = 0, 0.0
+    for name in conversion_types:
+        count, value = actions.get(name, (0.0, 0.0))
+        conversions += int(count)
+        revenue += value
+    return conversions, revenue
+
+
+def account_conversion_types(db: Session, facebook_account_id: int) -> List[str]:
+    """The account's configured conversion action types, or the defaults."""
+    configured = db.execute(
+        select(FacebookAccount.conversion_action_types).where(FacebookAccount.id == facebook_account_id)
+    ).scalar()
+    return json.loads(configured) if configured else list(CONVERSION_ACTION_TYPES)
+
+
+def existing_actions(db: Session, snapshot_ids: Iterable[int]) -> Dict[int, ActionBreakdown]:
+    """Stored breakdowns of ``snapshot_ids`` (snapshots without actions are omitted)."""
+    snapshot_ids = list(snapshot_ids)
+    if not snapshot_ids:
+        return {}
+    a = MetricAction.__table__.c
+    stored: Dict[int, ActionBreakdown] = {}
+    stmt = select(a.snapshot_id, a.action_type, a.count, a.value).where(a.snapshot_id.in_(snapshot_ids))
+    for snapshot_id, action_type, count, value in db.execute(stmt):
+        stored.setdefault(snapshot_id, {})[action_type] = (count, value)
+    return stored
+
+
+def replace_actions(db: Session, breakdowns: Dict[int, ActionBreakdown]) -> None:
+    """Replace the stored breakdowns of the given snapshots (no commit)."""
+    if not breakdowns:
+        return
+    table = MetricAction.__table__
+    db.execute(delete(table).where(table.c.snapshot_id.in_(list(breakdowns))))
+    rows = [
+        {"snapshot_id": snapshot_id, "action_type": name, "count": count, "value": value}
+        for snapshot_id, actions in breakdowns.items()
+        for name, (count, value) in actions.items()
+    ]
+    if rows:
+        db.execute(table.insert(), rows)
+
+
+def set_conversion_action_types(db: Session, account: FacebookAccount, action_types: List[str]) -> int:
+    """
+    Store the account's conversion action types and recompute ``conversions``
+    and ``revenue`` of its snapshots that have a stored breakdown, then the
+    rollups. Returns the number of snapshots recomputed.
+    """
+    s = MetricSnapshot.__table__.c
+    a = MetricAction.__table__.c
+
+    def total(column):
+        return (
+            select(func.coalesce(func.sum(column), 0))
+            .where(a.snapshot_id == s.id, a.action_type.in_(action_types))
+            .scalar_subquery()
+        )
+
+    has_actions = select(a.snapshot_id).where(a.snapshot_id == s.id).exists()
+    try:
+        account.conversion_action_types = json.dumps(action_types)
+        result = db.execute(
+            update(MetricSnapshot.__table__)
+            .where(s.facebook_account_id == account.id, has_actions)
+            .values(conversions=cast(total(a.count), Integer), revenue=total(a.value))
+        )
+        bump_data_version(db, account.id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    rebuild_rollups(db, account.id)
+    return result.rowcount
+
+
+def action_totals(
+    db: Session,
+    facebook_account_id: int,
+    level: str,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    action_types: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """Count and value per action type over the account's snapshots of one level, largest count first."""
+    s = MetricSnapshot.__table__.c
+    a = MetricAction.__table__.c
+    stmt = (
+        select(
+            a.action_type,
+            func.sum(a.count).label("count"),
+            func.sum(a.value).label("value"),
+            func.count(func.distinct(s.entity_id)).label("entities"),
+        )
+        .join_from(MetricAction.__table__, MetricSnapshot.__table__, a.snapshot_id == s.id)
+        .where(s.facebook_account_id == facebook_account_id, s.level == level)
+        .group_by(a.action_type)
+        .order_by(func.sum(a.count).desc(), a.action_type)
+    )
+    if since:
+        stmt = stmt.where(s.ts >= since)
+    if until:
+        stmt = stmt.where(s.ts <= until)
+    if action_types:
+        stmt = stmt.where(a.action_type.in_(action_types))
+    return [dict(row) for row in db.execute(stmt).mappings()]
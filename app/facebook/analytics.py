@@ -0,0 +1,89 @@
+"""
+Column-oriented reads of metric snapshots for analytics clients.
+
+Rows are selected with a Core ``SELECT`` of only the requested columns (no
+ORM hydration, no per-row Pydantic model) and CTR/ROAS are part of the SQL
+projection. The result is transposed into one list per field.
+"""
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import MetricSnapshot
+from app.utils import ctr_expression, roas_expression
+
+_columns = MetricSnapshot.__table__.c
+
+# Field name -> SQL expression it is read from
+ANALYTICS_FIELDS = {
+    "id": _columns.id,
+    "ts": _columns.ts,
+    "level": _columns.level,
+    "entity_id": _columns.entity_id,
+    "impressions": _columns.impressions,
+    "clicks": _columns.clicks,
+    "spend": _columns.spend,
+    "conversions": _columns.conversions,
+    "revenue": _columns.revenue,
+    "ctr": ctr_expression(_columns.clicks, _columns.impressions),
+    "roas": roas_expression(_columns.revenue, _columns.spend),
+}
+
+DEFAULT_FIELDS = ["ts", "entity_id", "impressions", "clicks", "spend", "conversions", "revenue", "ctr", "roas"]
+
+# Upper bound on rows returned by one analytics request
+MAX_ANALYTICS_ROWS = 1_000_000
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """
+    Parse a comma separated ``fields=`` projection.
+
+    Raises ValueError for unknown or duplicate fields.
+    """
+    if not fields:
+        return list(DEFAULT_FIELDS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in ANALYTICS_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(ANALYTICS_FIELDS)}")
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate fields in projection")
+    if not names:
+        raise ValueError("fields must name at least one column")
+    return names
+
+
+def fetch_columns(
+    db: Session,
+    facebook_account_id: int,
+    fields: List[str],
+    level: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    limit: int = MAX_ANALYTICS_ROWS,
+) -> Dict[str, List[Any]]:
+    """
+    Read snapshots ordered by (ts, id) as ``{field: [values...]}``.
+
+    Dates are returned as ISO strings so the result can be JSON encoded
+    directly.
+    """
+    stmt = select(*[ANALYTICS_FIELDS[name].label(name) for name in fields]).where(
+        _columns.facebook_account_id == facebook_account_id
+    )
+    if level:
+        stmt = stmt.where(_columns.level == level)
+    if since:
+        stmt = stmt.where(_columns.ts >= since)
+    if until:
+        stmt = stmt.where(_columns.ts <= until)
+    stmt = stmt.order_by(_columns.ts, _columns.id).limit(limit)
+
+    rows = db.execute(stmt).all()
+    columns = {name: list(values) for name, values in zip(fields, zip(*rows))} if rows else {name: [] for name in fields}
+    if "ts" in columns:
+        columns["ts"] = [ts.isoformat() for ts in columns["ts"]]
+    return columns
@@ -1,32 +1,115 @@
-import time
-import requests
-from typing import Dict, List, Optional, Any
+import asyncio
+import httpx
+from typing import AsyncIterator, Dict, List, Optional, Any
 from datetime import datetime, timedelta
 from app.config import settings
+from app.facebook.throttle import UsageThrottler, is_rate_limited, keys_for_url, throttler as shared_throttler
 
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
 
-class FacebookGraphAPIClient:
-    """Client for interacting with Facebook Graph API."""
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Ranges at least this many days long are pulled through an async report job
+# (report_run_id) instead of the synchronous insights GET, per level.
+ASYNC_REPORT_MIN_DAYS = {
+    "account": 366,
+    "campaign": 93,
+    "adset": 31,
+    "ad": 14,
+}
+
+REPORT_TERMINAL_FAILURES = ("Job Failed", "Job Skipped")
+
+
+class ReportJobError(Exception):
+    """An async insights report job failed, was skipped, or timed out."""
+
+
+def should_use_async_report(level: str, days: int) -> bool:
+    """Size heuristic for choosing an async report job over a direct GET."""
+    return days >= ASYNC_REPORT_MIN_DAYS.get(level, ASYNC_REPORT_MIN_DAYS["ad"])
+
+
+def _json_or_none(response) -> Optional[Any]:
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+class AsyncFacebookGraphAPIClient:
+    """
+    Async client for the Facebook Graph API.
+
+    All requests share one keep-alive connection pool (HTTP/2 when the ``h2``
+    package is installed), and retry backoff uses ``asyncio.sleep`` so no
+    worker thread is blocked while waiting.
+    """
 
     BASE_URL = settings.FB_GRAPH_BASE_URL
 
-    def __init__(self):
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 30.0,
+        http2: bool = True,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        throttler: Optional[UsageThrottler] = None,
+    ):
         self.app_id = settings.FB_APP_ID
         self.app_secret = settings.FB_APP_SECRET
+        self.throttler = throttler or shared_throttler
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared connection pool, created on first use."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+                transport=self.transport,
+            )
+        return self._client
 
-    def _request_with_retry(
+    async def aclose(self) -> None:
+        """Close the shared connection pool."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request_with_retry(
         self, method: str, url: str, max_retries: int = 3, backoff_factor: float = 2.0, **kwargs
-    ) -> requests.Response:
-        """Make HTTP request with retry logic for transient errors."""
+    ) -> httpx.Response:
+        """Make HTTP request with throttling and full-jitter retries for transient errors."""
+        keys = keys_for_url(url)
         for attempt in range(max_retries):
             try:
-                response = requests.request(method, url, timeout=30, **kwargs)
+                await self.throttler.acquire_async(keys)
+                response = await self.client.request(method, url, **kwargs)
+                self.throttler.observe(keys, response.headers)
 
-                # Check for rate limit (429) or server errors (5xx)
-                if response.status_code == 429 or response.status_code >= 500:
+                # Check for rate limit (429 or throttling error codes) or server errors (5xx)
+                rate_limited = is_rate_limited(response.status_code, _json_or_none(response))
+                if rate_limited or response.status_code >= 500:
+                    if rate_limited:
+                        self.throttler.record_rate_limited()
                     if attempt < max_retries - 1:
-                        wait_time = backoff_factor ** attempt
-                        time.sleep(wait_time)
+                        await asyncio.sleep(self.throttler.retry_delay(keys, attempt, backoff_factor))
                         continue
                     else:
                         response.raise_for_status()
@@ -34,16 +117,15 @@ class FacebookGraphAPIClient:
                 response.raise_for_status()
                 return response
 
-            except requests.exceptions.RequestException as e:
+            except httpx.TransportError as e:
                 if attempt < max_retries - 1:
-                    wait_time = backoff_factor ** attempt
-                    time.sleep(wait_time)
+                    await asyncio.sleep(self.throttler.retry_delay(keys, attempt, backoff_factor))
                 else:
                     raise e
 
         raise Exception("Max retries exceeded")
 
-    def exchange_code_for_token(self, code: str, redirect_uri: str) -> Dict[str, Any]:
+    async def exchange_code_for_token(self, code: str, redirect_uri: str) -> Dict[str, Any]:
         """Exchange authorization code for short-lived access token."""
         url = f"{self.BASE_URL}/oauth/access_token"
         params = {
@@ -53,10 +135,10 @@ class FacebookGraphAPIClient:
             "code": code,
         }
 
-        response = self._request_with_retry("GET", url, params=params)
+        response = await self._request_with_retry("GET", url, params=params)
         return response.json()
 
-    def extend_token(self, short_lived_token: str) -> Dict[str, Any]:
+    async def extend_token(self, short_lived_token: str) -> Dict[str, Any]:
         """Exchange short-lived token for long-lived token (60 days)."""
         url = f"{self.BASE_URL}/oauth/access_token"
         params = {
@@ -66,17 +148,24 @@ class FacebookGraphAPIClient:
             "fb_exchange_token": short_lived_token,
         }
 
-        response = self._request_with_retry("GET", url, params=params)
+        response = await self._request_with_retry("GET", url, params=params)
         data = response.json()
 
         # Calculate expires_at (default 60 days for long-lived tokens)
         expires_in = data.get("expires_in", 60 * 24 * 60 * 60)  # Default 60 days
-        expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
-        data["expires_at"] = expires_at
+        data["expires_at"] = datetime.utcnow() + timedelta(seconds=expires_in)
 
         return data
 
-    def get_insights(
+    async def get_ad_accounts(self, access_token: str) -> List[Dict[str, Any]]:
+        """List the ad accounts reachable with ``access_token``."""
+        url = f"{self.BASE_URL}/me/adaccounts"
+        params = {"access_token": access_token, "fields": "id,name,account_id"}
+
+        response = await self._request_with_retry("GET", url, params=params)
+        return response.json().get("data", [])
+
+    async def get_insights(
         self,
         ad_account_id: str,
         since: str,
@@ -87,7 +176,7 @@ class FacebookGraphAPIClient:
         after_cursor: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
-        Fetch insights from Facebook Marketing API.
+        Fetch one page of insights from the Facebook Marketing API.
 
         Args:
             ad_account_id: Ad account ID (e.g., act_123456789)
@@ -106,6 +195,7 @@ class FacebookGraphAPIClient:
             "access_token": access_token,
             "level": level,
             "time_range": f'{{"since":"{since}","until":"{until}"}}',
+            "time_increment": 1,  # one row per day; without it Graph returns one total for the range
             "fields": ",".join(fields),
             "limit": 100,  # Max per page
         }
@@ -113,10 +203,10 @@ class FacebookGraphAPIClient:
         if after_cursor:
             params["after"] = after_cursor
 
-        response = self._request_with_retry("GET", url, params=params)
+        response = await self._request_with_retry("GET", url, params=params)
         return response.json()
 
-    def get_all_insights_pages(
+    async def iter_insights_pages(
         self,
         ad_account_id: str,
         since: str,
@@ -124,18 +214,12 @@ class FacebookGraphAPIClient:
         level: str,
         fields: List[str],
         access_token: str,
-    ) -> List[Dict[str, Any]]:
-        """
-        Fetch all pages of insights data.
-
-        Returns:
-            List of all insight records across all pages
-        """
-        all_data = []
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield insights one page at a time as each cursor resolves."""
         after_cursor = None
 
         while True:
-            result = self.get_insights(
+            result = await self.get_insights(
                 ad_account_id=ad_account_id,
                 since=since,
                 until=until,
@@ -145,8 +229,7 @@ class FacebookGraphAPIClient:
                 after_cursor=after_cursor,
             )
 
-            data = result.get("data", [])
-            all_data.extend(data)
+            yield result.get("data", [])
 
             # Check for next page
             paging = result.get("paging", {})
@@ -156,4 +239,126 @@ class FacebookGraphAPIClient:
             if not after_cursor:
                 break  # No more pages
 
-        return all_data
\ No newline at end of file
+    async def start_insights_report(
+        self,
+        ad_account_id: str,
+        since: str,
+        until: str,
+        level: str,
+        fields: List[str],
+        access_token: str,
+    ) -> str:
+        """Create an async insights report run and return its report_run_id."""
+        url = f"{self.BASE_URL}/{ad_account_id}/insights"
+        params = {
+            "access_token": access_token,
+            "level": level,
+            "time_range": f'{{"since":"{since}","until":"{until}"}}',
+            "time_increment": 1,
+            "fields": ",".join(fields),
+        }
+
+        response = await self._request_with_retry("POST", url, params=params)
+        return response.json()["report_run_id"]
+
+    async def wait_for_report(
+        self,
+        report_run_id: str,
+        access_token: str,
+        poll_interval: float = 2.0,
+        max_poll_interval: float = 30.0,
+        timeout: float = 3600.0,
+    ) -> Dict[str, Any]:
+        """
+        Poll a report run until it completes.
+
+        The poll interval grows by 1.5x up to ``max_poll_interval``. Raises
+        ReportJobError if the job fails, is skipped, or exceeds ``timeout``.
+        """
+        url = f"{self.BASE_URL}/{report_run_id}"
+        params = {"access_token": access_token, "fields": "async_status,async_percent_completion"}
+        waited = 0.0
+
+        while True:
+            response = await self._request_with_retry("GET", url, params=params)
+            job = response.json()
+            job_status = job.get("async_status")
+
+            if job_status == "Job Completed":
+                return job
+            if job_status in REPORT_TERMINAL_FAILURES:
+                raise ReportJobError(f"Report {report_run_id} ended with status {job_status!r}")
+            if waited >= timeout:
+                raise ReportJobError(f"Report {report_run_id} did not complete within {timeout:.0f}s")
+
+            await asyncio.sleep(poll_interval)
+            waited += poll_interval
+            poll_interval = min(poll_interval * 1.5, max_poll_interval)
+
+    async def iter_report_pages(
+        self, report_run_id: str, access_token: str, page_size: int = 500
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield the result pages of a completed report run."""
+        url = f"{self.BASE_URL}/{report_run_id}/insights"
+        after_cursor = None
+
+        while True:
+            params = {"access_token": access_token, "limit": page_size}
+            if after_cursor:
+                params["after"] = after_cursor
+
+            response = await self._request_with_retry("GET", url, params=params)
+            result = response.json()
+
+            yield result.get("data", [])
+
+            after_cursor = result.get("paging", {}).get("cursors", {}).get("after")
+            if not after_cursor:
+                break
+
+    async def iter_entity_pages(
+        self, ad_account_id: str, edge: str, fields: List[str], access_token: str, page_size: int = 500
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield the campaigns, adsets or ads (``edge``) of an ad account one page at a time."""
+        url = f"{self.BASE_URL}/{ad_account_id}/{edge}"
+        after_cursor = None
+
+        while True:
+            params = {"access_token": access_token, "fields": ",".join(fields), "limit": page_size}
+            if after_cursor:
+                params["after"] = after_cursor
+
+            response = await self._request_with_retry("GET", url, params=params)
+            result = response.json()
+
+            yield result.get("data", [])
+
+            after_cursor = result.get("paging", {}).get("cursors", {}).get("after")
+            if not after_cursor:
+                break
+
+    async def iter_insights_report_pages(
+        self,
+        ad_account_id: str,
+        since: str,
+        until: str,
+        level: str,
+        fields: List[str],
+        access_token: str,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Pull insights through an async report job: create the run, wait for
+        it to complete, then page through its results.
+        """
+        report_run_id = await self.start_insights_report(
+            ad_account_id=ad_account_id,
+            since=since,
+            until=until,
+            level=level,
+            fields=fields,
+            access_token=access_token,
+        )
+        await self.wait_for_report(report_run_id, access_token)
+
+        async for page in self.iter_report_pages(report_run_id, access_token):
+            yield page
@@ -0,0 +1,230 @@
+"""
+Ingestion of Meta Ads Manager CSV exports.
+
+The file is read as a stream through ``csv.reader`` and written in chunks
+with the same ``upsert_metric_rows`` path as Graph API pages, so memory is
+bounded by the chunk size rather than the file size. Columns are matched by
+their Ads Manager headers (English exports) or by this API's own field
+names, so files produced by the export endpoint can be loaded back.
+
+Snapshots are daily: when the date comes from ``Reporting starts`` (no
+``Day`` column), ``Reporting ends`` must be the same day, otherwise the row
+holds the totals of a longer range and the file is rejected.
+
+Dates in ``YYYY-MM-DD`` or ``YYYY/MM/DD`` are read as is. Slash dates with
+the year last (``01/02/2024``) are ambiguous between US and European
+exports, so they are only read with an explicit ``date_order``.
+"""
+import csv
+import io
+import json
+import os
+import re
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.facebook.ingest import INGEST_CHUNK_SIZE, LEVEL_ID_FIELDS, IngestResult, upsert_metric_rows
+
+# Called as on_progress(chunks_done, result_so_far, fraction_of_file_read)
+CsvProgressCallback = Callable[[int, IngestResult, float], None]
+
+# Snapshot field -> accepted headers (compared case-insensitively)
+CSV_COLUMN_ALIASES = {
+    "ts": ["Day", "Date", "Reporting starts", "ts", "date_start"],
+    "impressions": ["Impressions", "impressions"],
+    "clicks": ["Clicks (all)", "Clicks", "Link clicks", "clicks"],
+    "conversions": ["Purchases", "Website purchases", "conversions"],
+    "revenue": [
+        "Purchases conversion value",
+        "Website purchases conversion value",
+        "Purchase conversion value",
+        "revenue",
+    ],
+    "spend": ["Amount spent", "spend"],  # "Amount spent (USD)" etc. match by prefix
+}
+
+# Level -> accepted entity ID headers, most specific level first
+CSV_ENTITY_COLUMNS = {
+    "ad": ["Ad ID", "ad_id"],
+    "adset": ["Ad set ID", "adset_id"],
+    "campaign": ["Campaign ID", "campaign_id"],
+    "account": ["Account ID", "account_id"],
+}
+
+_DATE_FORMATS = ["%Y-%m-%d", "%Y/%m/%d"]
+
+# date_order -> format of slash dates with the year last
+DATE_ORDERS = {"mdy": "%m/%d/%Y", "dmy": "%d/%m/%Y"}
+
+_YEAR_LAST_DATE = re.compile(r"\d{1,2}/\d{1,2}/\d{4}$")
+
+
+class CsvFormatError(ValueError):
+    """The upload is not a CSV this importer can map onto snapshots."""
+
+
+def _find_column(header: List[str], aliases: List[str], prefix: bool = False) -> Optional[int]:
+    normalized = [name.strip().lower() for name in header]
+    for alias in aliases:
+        alias = alias.lower()
+        for index, name in enumerate(normalized):
+            if name == alias or (prefix and name.startswith(alias)):
+                return index
+    return None
+
+
+def resolve_columns(header: List[str], level: Optional[str] = None) -> Tuple[str, Dict[str, int]]:
+    """
+    Map snapshot fields to column indexes for ``header``.
+
+    The level is the most specific one with an ID column unless ``level`` is
+    given (own exports carry ``level`` and ``entity_id`` columns instead).
+    Raises CsvFormatError when no date or entity ID column is found.
+    """
+    columns: Dict[str, int] = {}
+    for field, aliases in CSV_COLUMN_ALIASES.items():
+        index = _find_column(header, aliases, prefix=field == "spend")
+        if index is not None:
+            columns[field] = index
+    if "ts" not in columns:
+        raise CsvFormatError("No date column found (expected Day, Date or Reporting starts)")
+    if header[columns["ts"]].strip().lower() == "reporting starts":
+        end_index = _find_column(header, ["Reporting ends"])
+        if end_index is not None:
+            columns["ts_end"] = end_index
+
+    entity_index = _find_column(header, ["entity_id"])
+    if entity_index is not None:
+        level_index = _find_column(header, ["level"])
+        if level is None and level_index is None:
+            raise CsvFormatError("CSV has an entity_id column but no level column; pass level")
+        if level_index is not None:
+            columns["level"] = level_index
+        columns["entity_id"] = entity_index
+        return level or "", columns
+
+    for candidate, aliases in CSV_ENTITY_COLUMNS.items():
+        if level is not None and candidate != level:
+            continue
+        index = _find_column(header, aliases)
+        if index is not None:
+            columns["entity_id"] = index
+            return candidate, columns
+
+    expected = ", ".join(CSV_ENTITY_COLUMNS[level]) if level else "Ad ID, Ad set ID, Campaign ID or Account ID"
+    raise CsvFormatError(f"No entity ID column found (expected {expected})")
+
+
+def _number(value: str, cast):
+    value = value.strip().replace(",", "")
+    if not value or value == "-":
+        return cast(0)
+    return cast(float(value)) if cast is int else cast(value)
+
+
+def _parse_date(value: str, date_order: Optional[str] = None) -> Optional[date]:
+    value = value.strip()
+    formats = _DATE_FORMATS + ([DATE_ORDERS[date_order]] if date_order else [])
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    if date_order is None and _YEAR_LAST_DATE.match(value):
+        raise CsvFormatError(f"Date {value!r} is ambiguous; pass date_order (mdy or dmy)")
+    return None
+
+
+def parse_csv_row(
+    record: List[str], header: List[str], level: str, columns: Dict[str, int], date_order: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Convert one CSV record into a MetricSnapshot row dict, or None if it cannot be keyed.
+    Raises CsvFormatError for a day/month date without ``date_order`` and
+    for a row covering more than one day.
+    """
+    if len(record) < len(header):
+        record = record + [""] * (len(header) - len(record))
+
+    ts = _parse_date(record[columns["ts"]], date_order)
+    entity_id = record[columns["entity_id"]].strip()
+    row_level = record[columns["level"]].strip() if "level" in columns else level
+    if ts is None or not entity_id or row_level not in LEVEL_ID_FIELDS:
+        return None  # e.g. the totals row Ads Manager appends
+    if "ts_end" in columns:
+        ts_end = _parse_date(record[columns["ts_end"]], date_order)
+        if ts_end != ts:
+            raise CsvFormatError(
+                f"Row covers {ts} to {ts_end}; export with a daily breakdown (Breakdown: By time > Day)"
+            )
+
+    def metric(field: str, cast):
+        return _number(record[columns[field]], cast) if field in columns else cast(0)
+
+    return {
+        "ts": ts,
+        "level": row_level,
+        "entity_id": entity_id,
+        "impressions": metric("impressions", int),
+        "clicks": metric("clicks", int),
+        "spend": metric("spend", float),
+        "conversions": metric("conversions", int),
+        "revenue": metric("revenue", float),
+        "raw": json.dumps(dict(zip(header, record))),
+    }
+
+
+def ingest_csv(
+    db: Session,
+    facebook_account_id: int,
+    path: str,
+    level: Optional[str] = None,
+    chunk_size: int = INGEST_CHUNK_SIZE,
+    on_progress: Optional[CsvProgressCallback] = None,
+    date_order: Optional[str] = None,
+) -> IngestResult:
+    """
+    Stream the CSV at ``path`` into MetricSnapshot, one transaction per chunk.
+
+    ``on_progress`` is called after every chunk and may raise to abort.
+    Raises CsvFormatError when the header cannot be mapped or a date is
+    ambiguous (see ``DATE_ORDERS``).
+    """
+    result = IngestResult()
+    size = os.path.getsize(path) or 1
+    chunks_done = 0
+
+    with open(path, "rb") as raw_file:
+        # utf-8-sig drops the BOM Ads Manager puts in front of the header
+        text = io.TextIOWrapper(raw_file, encoding="utf-8-sig", newline="")
+        reader = csv.reader(text)
+        header = next(reader, None)
+        if not header:
+            raise CsvFormatError("The file is empty")
+        file_level, columns = resolve_columns(header, level)
+
+        chunk: List[Dict[str, Any]] = []
+        for record in reader:
+            if not any(value.strip() for value in record):
+                continue
+            row = parse_csv_row(record, header, file_level, columns, date_order)
+            if row is None:
+                result.skipped += 1
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                result.add(upsert_metric_rows(db, facebook_account_id, chunk))
+                chunk = []
+                chunks_done += 1
+                if on_progress is not None:
+                    on_progress(chunks_done, result, min(raw_file.tell() / size, 1.0))
+
+        if chunk:
+            result.add(upsert_metric_rows(db, facebook_account_id, chunk))
+            chunks_done += 1
+        if on_progress is not None:
+            on_progress(chunks_done, result, 1.0)
+
+    return result
@@ -0,0 +1,248 @@
+"""
+Campaign, adset and ad dimensions: names and the ad -> adset -> campaign
+hierarchy.
+
+Insight rows carry the ids and names of their entity and its parents
+(``insight_fields`` requests them). ``upsert_metric_rows`` collects them per
+chunk and upserts them into ``entities`` in the same transaction, keyed
+like the snapshots' ``entity_id``, so names and rollups up the hierarchy
+are indexed joins instead of ``raw`` JSON parsing. An in-process LRU cache
+of what each process last wrote lets unchanged entities skip the write.
+Other processes write the same rows, so the cache is only trusted for
+``ENTITY_CACHE_TTL`` seconds: a value another worker wrote in between is
+overwritten by the next pull after that, not when the entry is evicted.
+
+Insights have no delivery status; :func:`refresh_entities` reads it (and
+every entity, including ones without insights yet) from the campaigns,
+adsets and ads edges.
+"""
+import asyncio
+import os
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.cache import LRUCache
+from app.models import Entity, FacebookAccount
+
+ENTITY_LEVELS = ["campaign", "adset", "ad"]
+
+PARENT_LEVELS = {"ad": "adset", "adset": "campaign"}
+
+# Graph API edge listing each level's entities
+ENTITY_EDGES = {"campaign": "campaigns", "adset": "adsets", "ad": "ads"}
+
+# Descriptive columns; a NULL in an upsert keeps the stored value
+ENTITY_ATTRIBUTES = ["name", "parent_id", "campaign_id", "status"]
+
+# Entities remembered per process (about 200 bytes each)
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "50000"))
+
+# Seconds a remembered entity skips the write; bounds how long another process's write can stand
+ENTITY_CACHE_TTL = float(os.getenv("ENTITY_CACHE_TTL", "900"))
+
+# (facebook_account_id, level, entity_id) -> attributes and last_seen as last written
+entity_cache = LRUCache(ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL)
+
+EntityKey = Tuple[str, str]  # (level, entity_id)
+
+
+def entities_from_insight(insight: Dict[str, Any]) -> Dict[EntityKey, Dict[str, Optional[str]]]:
+    """The campaign, adset and ad an insight row names, with their parents."""
+    found = {}
+    for level in ENTITY_LEVELS:
+        entity_id = insight.get(f"{level}_id")
+        if not entity_id:
+            continue
+        parent = PARENT_LEVELS.get(level)
+        found[(level, entity_id)] = {
+            "name": insight.get(f"{level}_name"),
+            "parent_id": insight.get(f"{parent}_id") if parent else None,
+            "campaign_id": insight.get("campaign_id") if level != "campaign" else None,
+            "status": None,
+        }
+    return found
+
+
+def merge_entities(
+    target: Dict[EntityKey, Dict[str, Any]], found: Dict[EntityKey, Dict[str, Any]], ts: Optional[date]
+) -> None:
+    """Fold the entities of one row seen on ``ts`` into ``target``; later rows win."""
+    for key, attributes in found.items():
+        current = target.get(key)
+        if current is None:
+            target[key] = {**attributes, "last_seen": ts}
+            continue
+        newer = ts is None or current["last_seen"] is None or ts >= current["last_seen"]
+        for name, value in attributes.items():
+            if value is not None and (newer or current[name] is None):
+                current[name] = value
+        if ts is not None and (current["last_seen"] is None or ts > current["last_seen"]):
+            current["last_seen"] = ts
+
+
+def changed_entities(
+    facebook_account_id: int, entities: Dict[EntityKey, Dict[str, Any]]
+) -> Dict[EntityKey, Dict[str, Any]]:
+    """Drop the entities this process already wrote with the same values and a later or equal last_seen."""
+    changed = {}
+    for key, values in entities.items():
+        cached = entity_cache.get((facebook_account_id, *key))
+        if cached is not None:
+            same = all(values[name] is None or values[name] == cached[name] for name in ENTITY_ATTRIBUTES)
+            seen = values["last_seen"] is None or (
+                cached["last_seen"] is not None and values["last_seen"] <= cached["last_seen"]
+            )
+            if same and seen:
+                continue
+        changed[key] = values
+    return changed
+
+
+def remember_entities(facebook_account_id: int, entities: Dict[EntityKey, Dict[str, Any]]) -> None:
+    """Record written entities in the cache, merged the way the upsert merges them (call after the commit)."""
+    for key, values in entities.items():
+        cache_key = (facebook_account_id, *key)
+        cached = entity_cache.get(cache_key)
+        merged = dict(values)
+        if cached is not None:
+            for name in ENTITY_ATTRIBUTES:
+                if merged[name] is None:
+                    merged[name] = cached[name]
+            last_seen = cached["last_seen"]
+            if last_seen is not None and (merged["last_seen"] is None or last_seen > merged["last_seen"]):
+                merged["last_seen"] = last_seen
+        entity_cache.put(cache_key, merged)
+
+
+def _upsert_statement(dialect_name: str):
+    """``INSERT ... ON CONFLICT DO UPDATE`` keeping stored values where the new ones are NULL."""
+    table = Entity.__table__
+    if dialect_name == "postgresql":
+        stmt = postgresql_insert(table)
+    elif dialect_name == "sqlite":
+        stmt = sqlite_insert(table)
+    else:
+        return None
+
+    excluded, c = stmt.excluded, table.c
+    last_seen = case(
+        (c.last_seen.is_(None), excluded.last_seen),
+        (excluded.last_seen > c.last_seen, excluded.last_seen),
+        else_=c.last_seen,
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["facebook_account_id", "level", "entity_id"],
+        set_={
+            **{name: func.coalesce(excluded[name], c[name]) for name in ENTITY_ATTRIBUTES},
+            "last_seen": last_seen,
+            "updated_at": excluded.updated_at,
+        },
+    )
+
+
+def _write_generic(db: Session, facebook_account_id: int, rows: List[Dict[str, Any]]) -> None:
+    """Fallback for dialects without ON CONFLICT support."""
+    c = Entity.__table__.c
+    stored = {
+        (row.level, row.entity_id): row
+        for row in db.execute(
+            select(Entity.__table__).where(
+                c.facebook_account_id == facebook_account_id,
+                c.entity_id.in_([row["entity_id"] for row in rows]),
+            )
+        )
+    }
+    for row in rows:
+        current = stored.get((row["level"], row["entity_id"]))
+        if current is None:
+            db.execute(Entity.__table__.insert().values(row))
+            continue
+        values = {name: row[name] for name in ENTITY_ATTRIBUTES if row[name] is not None}
+        if row["last_seen"] is not None and (current.last_seen is None or row["last_seen"] > current.last_seen):
+            values["last_seen"] = row["last_seen"]
+        db.execute(Entity.__table__.update().where(c.id == current.id).values(updated_at=row["updated_at"], **values))
+
+
+def upsert_entities(db: Session, facebook_account_id: int, entities: Dict[EntityKey, Dict[str, Any]]) -> None:
+    """Upsert entities in bulk (no commit)."""
+    if not entities:
+        return
+    now = datetime.utcnow()
+    rows = [
+        {
+            "facebook_account_id": facebook_account_id,
+            "level": level,
+            "entity_id": entity_id,
+            **{name: values[name] for name in ENTITY_ATTRIBUTES},
+            "last_seen": values["last_seen"],
+            "updated_at": now,
+        }
+        for (level, entity_id), values in entities.items()
+    ]
+    stmt = _upsert_statement(db.get_bind().dialect.name)
+    if stmt is not None:
+        db.execute(stmt, rows)
+    else:
+        _write_generic(db, facebook_account_id, rows)
+
+
+def list_entities(
+    db: Session,
+    facebook_account_id: int,
+    level: str,
+    parent_id: Optional[str] = None,
+    limit: int = 100,
+) -> List[Entity]:
+    """Entities of one level, optionally only the children of ``parent_id``, by id."""
+    c = Entity.__table__.c
+    stmt = select(Entity).where(c.facebook_account_id == facebook_account_id, c.level == level)
+    if parent_id is not None:
+        stmt = stmt.where(c.parent_id == parent_id)
+    return list(db.execute(stmt.order_by(c.entity_id).limit(limit)).scalars())
+
+
+def _write_entities(db: Session, facebook_account_id: int, entities: Dict[EntityKey, Dict[str, Any]]) -> None:
+    """Upsert ``entities`` and commit, then remember them."""
+    try:
+        upsert_entities(db, facebook_account_id, entities)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    remember_entities(facebook_account_id, entities)
+
+
+async def refresh_entities(db: Session, fb_client, fb_account: FacebookAccount) -> Dict[str, int]:
+    """
+    Read every campaign, adset and ad of the account with its name, parents
+    and effective status from the Graph API and upsert them, one commit per
+    level (written from a worker thread, like ingestion). Returns the number
+    of entities read per level.
+    """
+    counts = {}
+    for level in ENTITY_LEVELS:
+        parent = PARENT_LEVELS.get(level)
+        parent_fields = ["campaign_id"] + (["adset_id"] if level == "ad" else []) if parent else []
+        found: Dict[EntityKey, Dict[str, Any]] = {}
+        async for page in fb_client.iter_entity_pages(
+            ad_account_id=fb_account.ad_account_id,
+            edge=ENTITY_EDGES[level],
+            fields=["id", "name", "effective_status"] + parent_fields,
+            access_token=fb_account.access_token,
+        ):
+            for item in page:
+                found[(level, item["id"])] = {
+                    "name": item.get("name"),
+                    "parent_id": item.get(f"{parent}_id") if parent else None,
+                    "campaign_id": item.get("campaign_id") if parent else None,
+                    "status": item.get("effective_status"),
+                    "last_seen": None,
+                }
+        await asyncio.to_thread(_write_entities, db, fb_account.id, found)
+        counts[level] = len(found)
+    return counts
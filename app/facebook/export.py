@@ -0,0 +1,143 @@
+"""
+Streaming export of stored metric snapshots as NDJSON or CSV.
+
+Rows are read through a server-side cursor (``yield_per``) on a session of
+the generator's own, serialized batch by batch and optionally gzip
+compressed on the fly, so memory stays flat regardless of export size.
+With ``include_archived`` the rows of archived months (see
+app/facebook/retention.py) are read back from their archive files first.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date
+from itertools import chain, islice
+from typing import Iterator, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.facebook.analytics import ANALYTICS_FIELDS
+from app.facebook.raw_storage import decode_raw
+from app.facebook.retention import iter_archived_rows
+from app.models import MetricSnapshot
+from app.utils import calculate_ctr, calculate_roas
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+EXPORT_FIELDS = [
+    "id", "ts", "level", "entity_id", "impressions", "clicks", "spend", "conversions", "revenue", "ctr", "roas"
+]
+
+# Rows fetched from the cursor and serialized per chunk
+EXPORT_BATCH_SIZE = 5000
+
+
+def _ndjson_lines(fields: List[str], rows, include_raw: bool) -> str:
+    lines = []
+    for row in rows:
+        values = dict(zip(fields, row))
+        values["ts"] = values["ts"].isoformat()
+        line = json.dumps(values, separators=(",", ":"))
+        if include_raw:
+            # raw is stored as a JSON document; embed it without re-parsing
+            line = f'{line[:-1]},"raw":{decode_raw(row[-2], row[-1]) or "null"}}}'
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def _csv_lines(fields: List[str], rows, include_raw: bool, header: bool) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(fields + (["raw"] if include_raw else []))
+    if include_raw:
+        rows = (tuple(row[:-2]) + (decode_raw(row[-2], row[-1]),) for row in rows)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def _archived_batches(
+    session: Session,
+    facebook_account_id: int,
+    level: Optional[str],
+    since: Optional[date],
+    until: Optional[date],
+    include_raw: bool,
+    batch_size: int,
+) -> Iterator[list]:
+    """Archived rows shaped like the database rows of the export query."""
+    records = iter_archived_rows(session, facebook_account_id, level, since, until)
+    while True:
+        batch = []
+        for record in islice(records, batch_size):
+            row = tuple(record[name] for name in EXPORT_FIELDS[:-2]) + (
+                calculate_ctr(record["clicks"], record["impressions"]),
+                calculate_roas(record["revenue"], record["spend"]),
+            )
+            if include_raw:
+                raw = record.get("raw")
+                row += (json.dumps(raw, separators=(",", ":")) if raw is not None else None, None)
+            batch.append(row)
+        if not batch:
+            return
+        yield batch
+
+
+def iter_export(
+    bind: Engine,
+    facebook_account_id: int,
+    fmt: str = "ndjson",
+    level: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    include_raw: bool = False,
+    compress: bool = False,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    include_archived: bool = False,
+) -> Iterator[bytes]:
+    """
+    Yield the export body in chunks, oldest snapshot first (archived rows,
+    when included, ahead of the database rows).
+
+    Opens (and closes) its own session on ``bind``: a streaming response
+    outlives the request-scoped session.
+    """
+    c = MetricSnapshot.__table__.c
+    columns = [ANALYTICS_FIELDS[name] for name in EXPORT_FIELDS] + ([c.raw, c.raw_blob] if include_raw else [])
+    stmt = select(*columns).where(c.facebook_account_id == facebook_account_id)
+    if level:
+        stmt = stmt.where(c.level == level)
+    if since:
+        stmt = stmt.where(c.ts >= since)
+    if until:
+        stmt = stmt.where(c.ts <= until)
+    stmt = stmt.order_by(c.ts, c.id).execution_options(yield_per=batch_size)
+
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip container
+
+    def encode(text: str) -> bytes:
+        data = text.encode()
+        return compressor.compress(data) if compressor else data
+
+    with Session(bind=bind) as session:
+        header = True
+        batches = session.execute(stmt).partitions()
+        if include_archived:
+            archived = _archived_batches(session, facebook_account_id, level, since, until, include_raw, batch_size)
+            batches = chain(archived, batches)
+        for rows in batches:
+            if fmt == "csv":
+                chunk = encode(_csv_lines(EXPORT_FIELDS, rows, include_raw, header))
+            else:
+                chunk = encode(_ndjson_lines(EXPORT_FIELDS, rows, include_raw))
+            header = False
+            if chunk:
+                yield chunk
+        if fmt == "csv" and header:  # no rows: still send the header
+            yield encode(_csv_lines(EXPORT_FIELDS, [], include_raw, header=True))
+
+    if compressor:
+        yield compressor.flush()
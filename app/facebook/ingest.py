@@ -0,0 +1,510 @@
+"""
+Batched ingestion of Graph API insight rows into MetricSnapshot.
+
+Rows are parsed into plain dicts and written in chunks with a dialect-aware
+``INSERT ... ON CONFLICT (facebook_account_id, ts, entity_id, level) DO UPDATE``,
+one transaction per chunk. The metric rollups are updated with each chunk's
+deltas in the same transaction.
+
+With ``level="all"`` the insights are ad-level rows (carrying their
+``adset_id``, ``campaign_id`` and ``account_id``) and the adset, campaign and
+account rows of each day are derived from them by :class:`LevelAggregator`
+instead of being fetched separately.
+"""
+import asyncio
+import json
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, AsyncIterable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.facebook.actions import (
+    CONVERSION_ACTION_TYPES,
+    account_conversion_types,
+    conversion_totals,
+    existing_actions,
+    parse_actions,
+    replace_actions,
+)
+from app.facebook.entities import (
+    changed_entities,
+    entities_from_insight,
+    merge_entities,
+    remember_entities,
+    upsert_entities,
+)
+from app.facebook.raw_storage import encode_raw
+from app.facebook.retention import archived_months
+from app.facebook.rollups import apply_rollup_deltas, period_start, rollup_deltas
+from app.models import MetricSnapshot
+from app.response_cache import bump_data_version
+
+# Rows written per transaction. Keeps the bound parameter count of a single
+# statement well under SQLite's limit while amortizing the commit.
+INGEST_CHUNK_SIZE = 500
+
+# Pages buffered between the Graph API download task and the DB writer.
+PREFETCH_PAGES = 4
+
+METRIC_COLUMNS = ["impressions", "clicks", "spend", "conversions", "revenue"]
+
+# Columns holding the raw JSON, written as encode_raw() returns them
+RAW_COLUMNS = ["raw", "raw_blob"]
+
+LEVEL_ID_FIELDS = {
+    "campaign": "campaign_id",
+    "adset": "adset_id",
+    "ad": "ad_id",
+    "account": "account_id",
+}
+
+# Pseudo level: fetch ad rows once and derive the other levels from them
+ALL_LEVELS = "all"
+
+DERIVED_LEVELS = ["adset", "campaign", "account"]
+
+# Decimal places kept on derived float sums, so deriving the same day from
+# pages in another order gives values equal to the stored ones
+DERIVED_PRECISION = 6
+
+
+# Called as on_progress(pages_done, result_so_far) after every page
+ProgressCallback = Callable[[int, "IngestResult"], None]
+
+_DONE = object()
+
+
+@dataclass
+class IngestResult:
+    """Counts reported back by an ingestion run."""
+
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    skipped: int = 0
+
+    @property
+    def written(self) -> int:
+        return self.inserted + self.updated
+
+    def add(self, other: "IngestResult") -> None:
+        self.inserted += other.inserted
+        self.updated += other.updated
+        self.unchanged += other.unchanged
+        self.skipped += other.skipped
+
+
+def _entity_id(insight: Dict[str, Any], level: str, ad_account_id: str) -> str:
+    if level == "account":
+        return insight.get("account_id", ad_account_id)
+    if level in LEVEL_ID_FIELDS:
+        return insight.get(LEVEL_ID_FIELDS[level], "unknown")
+    return "unknown"
+
+
+def parse_insight(
+    insight: Dict[str, Any],
+    level: str,
+    ad_account_id: str,
+    conversion_types: Iterable[str] = CONVERSION_ACTION_TYPES,
+) -> Optional[Dict[str, Any]]:
+    """
+    Convert one Graph API insight record into a MetricSnapshot row dict.
+
+    ``actions`` holds the per action type breakdown written to
+    ``metric_actions``; ``conversions`` and ``revenue`` sum the breakdown over
+    ``conversion_types``. Returns None when the record has no ``date_start``
+    and cannot be keyed.
+    """
+    date_start = insight.get("date_start")
+    if not date_start:
+        return None
+
+    actions = parse_actions(insight)
+    conversions, revenue = conversion_totals(actions, conversion_types)
+
+    return {
+        "ts": datetime.strptime(date_start, "%Y-%m-%d").date(),
+        "level": level,
+        "entity_id": _entity_id(insight, level, ad_account_id),
+        "impressions": int(insight.get("impressions", 0)),
+        "clicks": int(insight.get("clicks", 0)),
+        "spend": float(insight.get("spend", 0.0)),
+        "conversions": conversions,
+        "revenue": revenue,
+        "raw": json.dumps(insight),
+        "actions": actions,
+        "entities": entities_from_insight(insight),
+    }
+
+
+class DerivedRows(list):
+    """Parsed rows of the derived levels, queued to the writer alongside insight pages."""
+
+
+class LevelAggregator:
+    """
+    Sums ad-level insights into daily adset, campaign and account rows.
+
+    Every metric stored is additive, so the sums equal the rows the Graph API
+    returns for those levels. A day is only complete once all of its ad rows
+    were added; feed one aggregator per fetched date range and discard it if
+    the fetch fails. Derived rows carry no raw JSON.
+    """
+
+    def __init__(self, ad_account_id: str, conversion_types: Iterable[str] = CONVERSION_ACTION_TYPES):
+        self.ad_account_id = ad_account_id
+        self.conversion_types = list(conversion_types)
+        # (ts, entity_id, level) -> [impressions, clicks, spend, action breakdown]
+        self._totals: Dict[Tuple, list] = {}
+
+    def add(self, insight: Dict[str, Any]) -> None:
+        date_start = insight.get("date_start")
+        if not date_start:
+            return
+        ts = datetime.strptime(date_start, "%Y-%m-%d").date()
+        impressions = int(insight.get("impressions", 0))
+        clicks = int(insight.get("clicks", 0))
+        spend = float(insight.get("spend", 0.0))
+        actions = parse_actions(insight)
+        for level in DERIVED_LEVELS:
+            key = (ts, _entity_id(insight, level, self.ad_account_id), level)
+            total = self._totals.setdefault(key, [0, 0, 0.0, {}])
+            total[0] += impressions
+            total[1] += clicks
+            total[2] += spend
+            for name, (count, value) in actions.items():
+                stored_count, stored_value = total[3].get(name, (0.0, 0.0))
+                total[3][name] = (stored_count + count, stored_value + value)
+
+    def rows(self) -> DerivedRows:
+        rows = DerivedRows()
+        for (ts, entity_id, level), (impressions, clicks, spend, actions) in self._totals.items():
+            actions = {
+                name: (round(count, DERIVED_PRECISION), round(value, DERIVED_PRECISION))
+                for name, (count, value) in sorted(actions.items())
+            }
+            conversions, revenue = conversion_totals(actions, self.conversion_types)
+            rows.append(
+                {
+                    "ts": ts,
+                    "level": level,
+                    "entity_id": entity_id,
+                    "impressions": impressions,
+                    "clicks": clicks,
+                    "spend": round(spend, DERIVED_PRECISION),
+                    "conversions": conversions,
+                    "revenue": round(revenue, DERIVED_PRECISION),
+                    "raw": None,
+                    "actions": actions,
+                }
+            )
+        return rows
+
+
+def _row_key(row: Dict[str, Any]) -> Tuple:
+    return (row["ts"], row["entity_id"], row["level"])
+
+
+def _lock_days(db: Session, facebook_account_id: int, rows: List[Dict[str, Any]]) -> None:
+    """
+    Serialize writers of the chunk's (account, day) snapshots until the end
+    of the transaction. The rollup deltas are computed from the pre-read of
+    the stored values; without the lock two concurrent upserts of a key,
+    including one neither of them finds stored yet, would both apply the
+    same delta.
+
+    PostgreSQL takes transaction advisory locks in date order, so writers
+    cannot deadlock and shards of different days never wait for each other.
+    SQLite has a single writer anyway; the write lock is taken before the
+    pre-read (the driver would otherwise read outside any transaction).
+    """
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        for day in sorted({row["ts"] for row in rows}):
+            # Two-key form: a separate key space from the single-key migration lock
+            db.execute(select(func.pg_advisory_xact_lock(facebook_account_id, day.toordinal())))
+    elif dialect_name == "sqlite":
+        connection = db.connection()
+        if not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def _existing_metrics(db: Session, facebook_account_id: int, rows: List[Dict[str, Any]]) -> Dict[Tuple, Tuple]:
+    """
+    Load ``(id, *metric values)`` of the stored snapshots for the keys in
+    ``rows``. The ts bounds of the chunk let the unique index seek to the
+    chunk's dates; the key list alone would be checked against every row of
+    the account.
+    """
+    table = MetricSnapshot.__table__
+    keys = {_row_key(row) for row in rows}
+    if not keys:
+        return {}
+    dates = [key[0] for key in keys]
+    metrics = [table.c.id] + [table.c[name] for name in METRIC_COLUMNS]
+    stmt = select(table.c.ts, table.c.entity_id, table.c.level, *metrics).where(
+        table.c.facebook_account_id == facebook_account_id,
+        table.c.ts.between(min(dates), max(dates)),
+        tuple_(table.c.ts, table.c.entity_id, table.c.level).in_(list(keys)),
+    )
+    return {tuple(r[:3]): tuple(r[3:]) for r in db.execute(stmt)}
+
+
+def _upsert_statement(dialect_name: str):
+    """Build the dialect specific ``INSERT ... ON CONFLICT DO UPDATE`` statement."""
+    table = MetricSnapshot.__table__
+    if dialect_name == "postgresql":
+        stmt = postgresql_insert(table)
+    elif dialect_name == "sqlite":
+        stmt = sqlite_insert(table)
+    else:
+        return None
+
+    excluded = stmt.excluded
+    # Raw too: a row whose metrics match is still written when its action
+    # breakdown changed, and raw holds the breakdown it was parsed from
+    changed = or_(
+        *[table.c[name] != excluded[name] for name in METRIC_COLUMNS],
+        *[table.c[name].is_distinct_from(excluded[name]) for name in RAW_COLUMNS],
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["facebook_account_id", "ts", "entity_id", "level"],
+        set_={name: excluded[name] for name in METRIC_COLUMNS + RAW_COLUMNS},
+        where=changed,
+    )
+
+
+def _write_generic(db: Session, facebook_account_id: int, inserts: List[Dict], updates: List[Dict]) -> None:
+    """Fallback for dialects without ON CONFLICT support."""
+    table = MetricSnapshot.__table__
+    if inserts:
+        db.execute(table.insert(), inserts)
+    for row in updates:
+        db.execute(
+            table.update()
+            .where(
+                and_(
+                    table.c.facebook_account_id == facebook_account_id,
+                    table.c.ts == row["ts"],
+                    table.c.entity_id == row["entity_id"],
+                    table.c.level == row["level"],
+                )
+            )
+            .values({name: row[name] for name in METRIC_COLUMNS + RAW_COLUMNS})
+        )
+
+
+def upsert_metric_rows(db: Session, facebook_account_id: int, rows: List[Dict[str, Any]]) -> IngestResult:
+    """
+    Upsert one chunk of parsed rows in a single transaction.
+
+    Existing values are read first so the result can tell inserted, updated
+    and unchanged rows apart; unchanged rows are not rewritten. The same
+    values give the rollup deltas, so the chunk's days are locked first
+    (:func:`_lock_days`). Rows carrying an ``actions`` breakdown
+    also replace the snapshot's ``metric_actions`` rows (and count as
+    updated when only the breakdown changed); rows without one, such as CSV
+    imports, leave stored breakdowns alone. Rows of archived months are
+    skipped (see app/facebook/retention.py). The ``entities`` a row names
+    are upserted into the entities table unless this process already wrote
+    them unchanged (see app/facebook/entities.py).
+    """
+    result = IngestResult()
+    if not rows:
+        return result
+
+    # Later duplicates of a key within the chunk win, as they would with
+    # sequential upserts.
+    deduped = {}
+    breakdowns = {}
+    entities = {}
+    for row in rows:
+        key = _row_key(row)
+        row = {**row, "facebook_account_id": facebook_account_id}
+        breakdowns.pop(key, None)
+        if "actions" in row:
+            breakdowns[key] = row.pop("actions")
+        merge_entities(entities, row.pop("entities", {}), row["ts"])
+        deduped[key] = row
+    rows = list(deduped.values())
+
+    try:
+        archived = archived_months(db, facebook_account_id)
+        if archived:
+            kept = [row for row in rows if period_start(row["ts"], "month") not in archived]
+            result.skipped = len(rows) - len(kept)
+            rows = kept
+
+        _lock_days(db, facebook_account_id, rows)
+        existing = _existing_metrics(db, facebook_account_id, rows)
+        stored = existing_actions(db, [existing[key][0] for key in breakdowns if key in existing])
+        inserts, updates = [], []
+        for row in rows:
+            key = _row_key(row)
+            current = existing.get(key)
+            if current is None:
+                inserts.append(row)
+            elif current[1:] != tuple(row[name] for name in METRIC_COLUMNS):
+                updates.append(row)
+            elif key in breakdowns and stored.get(current[0], {}) != breakdowns[key]:
+                updates.append(row)
+            else:
+                result.unchanged += 1
+        result.inserted = len(inserts)
+        result.updated = len(updates)
+
+        # Only rows actually written pay for encoding the raw JSON
+        for row in inserts + updates:
+            row.update(encode_raw(row.get("raw")))
+
+        stmt = _upsert_statement(db.get_bind().dialect.name)
+        if stmt is not None:
+            if inserts or updates:
+                db.execute(stmt, inserts + updates)
+        else:
+            _write_generic(db, facebook_account_id, inserts, updates)
+
+        # Breakdowns are keyed by snapshot id, so read back the ids of new rows
+        new_rows = [row for row in inserts if _row_key(row) in breakdowns]
+        ids = {**existing, **_existing_metrics(db, facebook_account_id, new_rows)} if new_rows else existing
+        replace_actions(
+            db,
+            {ids[_row_key(row)][0]: breakdowns[_row_key(row)] for row in inserts + updates if _row_key(row) in breakdowns},
+        )
+
+        changes = [(row, None) for row in inserts]
+        changes += [(row, dict(zip(METRIC_COLUMNS, existing[_row_key(row)][1:]))) for row in updates]
+        apply_rollup_deltas(db, rollup_deltas(changes))
+        if changes:
+            bump_data_version(db, facebook_account_id)
+        entities = changed_entities(facebook_account_id, entities)
+        upsert_entities(db, facebook_account_id, entities)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    remember_entities(facebook_account_id, entities)
+    return result
+
+
+def ingest_insights(
+    db: Session,
+    facebook_account_id: int,
+    ad_account_id: str,
+    level: str,
+    insights: Iterable[Dict[str, Any]],
+    chunk_size: int = INGEST_CHUNK_SIZE,
+) -> IngestResult:
+    """
+    Parse insight records and upsert them chunk by chunk. With ``level="all"``
+    the derived levels are written after the last ad row.
+    """
+    result = IngestResult()
+    chunk: List[Dict[str, Any]] = []
+    conversion_types = account_conversion_types(db, facebook_account_id)
+    aggregator = LevelAggregator(ad_account_id, conversion_types) if level == ALL_LEVELS else None
+    parse_level = "ad" if aggregator else level
+
+    for insight in insights:
+        row = parse_insight(insight, parse_level, ad_account_id, conversion_types)
+        if row is None:
+            result.skipped += 1
+            continue
+        if aggregator:
+            aggregator.add(insight)
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            result.add(upsert_metric_rows(db, facebook_account_id, chunk))
+            chunk = []
+
+    if aggregator:
+        chunk += aggregator.rows()
+    for start in range(0, len(chunk), chunk_size):
+        result.add(upsert_metric_rows(db, facebook_account_id, chunk[start:start + chunk_size]))
+
+    return result
+
+
+async def ingest_insight_pages_async(
+    db: Session,
+    facebook_account_id: int,
+    ad_account_id: str,
+    level: str,
+    pages: AsyncIterable[List[Dict[str, Any]]],
+    chunk_size: int = INGEST_CHUNK_SIZE,
+    prefetch_pages: int = PREFETCH_PAGES,
+    on_progress: Optional[ProgressCallback] = None,
+) -> IngestResult:
+    """
+    Persist pages of insights while the next pages are still downloading.
+
+    A producer task drains ``pages`` into a bounded ``asyncio.Queue`` while
+    the consumer upserts chunks. The blocking DB writes run via
+    ``asyncio.to_thread`` so the event loop keeps serving other requests.
+    ``on_progress`` may raise to abort the run (e.g. on cancellation).
+
+    With ``level="all"`` insight pages are parsed as ad rows; the derived
+    levels arrive as :class:`DerivedRows` pages (see
+    :func:`app.facebook.sharding.ingest_sharded`).
+    """
+    buffer: asyncio.Queue = asyncio.Queue(maxsize=prefetch_pages)
+
+    async def produce():
+        try:
+            async for page in pages:
+                await buffer.put(page)
+        finally:
+            await buffer.put(_DONE)
+
+    conversion_types = await asyncio.to_thread(account_conversion_types, db, facebook_account_id)
+    parse_level = "ad" if level == ALL_LEVELS else level
+    producer = asyncio.create_task(produce())
+    result = IngestResult()
+    chunk: List[Dict[str, Any]] = []
+    pages_done = 0
+
+    try:
+        while True:
+            page = await buffer.get()
+            if page is _DONE:
+                break
+            if isinstance(page, DerivedRows):
+                chunk += page
+                while len(chunk) >= chunk_size:
+                    head, chunk = chunk[:chunk_size], chunk[chunk_size:]
+                    result.add(await asyncio.to_thread(upsert_metric_rows, db, facebook_account_id, head))
+                continue
+            pages_done += 1
+            for insight in page:
+                row = parse_insight(insight, parse_level, ad_account_id, conversion_types)
+                if row is None:
+                    result.skipped += 1
+                    continue
+                chunk.append(row)
+            if len(chunk) >= chunk_size:
+                result.add(await asyncio.to_thread(upsert_metric_rows, db, facebook_account_id, chunk))
+                chunk = []
+            if on_progress is not None:
+                on_progress(pages_done, result)
+
+        # Surface producer failures (Graph API errors) before the final write
+        await producer
+        if chunk:
+            result.add(await asyncio.to_thread(upsert_metric_rows, db, facebook_account_id, chunk))
+            if on_progress is not None:
+                on_progress(pages_done, result)
+    finally:
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    return result
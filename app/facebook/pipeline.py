@@ -0,0 +1,216 @@
+"""
+Insights ingestion pipeline shared by the API routes and background work.
+
+``ingest_range`` fetches one account/level/date range from the Graph API and
+upserts it; the watermark helpers turn it into an incremental sync that only
+re-reads the attribution lookback window plus new days.
+
+``level="all"`` fetches ad-level rows once and derives the adset, campaign
+and account rows from them (see ``LevelAggregator``), a quarter of the Graph
+API calls of four separate pulls.
+"""
+import asyncio
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.facebook.client import AsyncFacebookGraphAPIClient, should_use_async_report
+from app.facebook.ingest import ALL_LEVELS, ProgressCallback
+from app.facebook.sharding import SHARD_MAX_ATTEMPTS, ShardedIngestResult, ingest_sharded, split_date_range
+from app.models import FacebookAccount, SyncState
+
+LEVELS = ["account", "campaign", "adset", "ad"]
+
+# Levels accepted by fetch and sync requests
+INGEST_LEVELS = LEVELS + [ALL_LEVELS]
+
+FETCH_MODES = ["auto", "sync", "async_job"]
+
+# Days re-read behind the watermark on every sync, so late-attributed
+# conversions are picked up.
+DEFAULT_LOOKBACK_DAYS = 7
+
+# Days fetched on the first sync of an account/level.
+DEFAULT_INITIAL_DAYS = 90
+
+
+@dataclass
+class SyncOutcome:
+    since: Optional[date]
+    until: Optional[date]
+    watermark: Optional[date]
+    result: Optional[ShardedIngestResult]  # None when already up to date
+
+
+def insight_fields(level: str) -> List[str]:
+    """Graph API fields requested for ``level``."""
+    fields = [
+        "date_start",
+        "date_stop",
+        "impressions",
+        "clicks",
+        "spend",
+        "actions",  # Contains conversions
+        "action_values",  # Contains revenue
+    ]
+
+    # Level-specific ID field, plus the ids and names of the parents that
+    # populate the entities table (app/facebook/entities.py)
+    if level == "campaign":
+        fields.append("campaign_id")
+        fields.append("campaign_name")
+    elif level == "adset":
+        fields.append("adset_id")
+        fields.append("adset_name")
+        fields += ["campaign_id", "campaign_name"]
+    elif level == "ad":
+        fields.append("ad_id")
+        fields.append("ad_name")
+        fields += ["adset_id", "adset_name", "campaign_id", "campaign_name"]
+    elif level == "account":
+        fields.append("account_id")
+    elif level == ALL_LEVELS:
+        fields += ["ad_id", "ad_name", "adset_id", "adset_name", "campaign_id", "campaign_name", "account_id"]
+
+    return fields
+
+
+def fetch_level(level: str) -> str:
+    """Graph API level requested for an ingestion level."""
+    return "ad" if level == ALL_LEVELS else level
+
+
+async def ingest_range(
+    db: Session,
+    fb_client: AsyncFacebookGraphAPIClient,
+    fb_account: FacebookAccount,
+    since: date,
+    until: date,
+    level: str,
+    shard: Optional[str] = None,
+    mode: str = "auto",
+    on_progress: Optional[ProgressCallback] = None,
+) -> ShardedIngestResult:
+    """
+    Fetch ``since..until`` for one account and level and upsert it.
+
+    Raises ValueError for an invalid shard size.
+    """
+    shards = split_date_range(since, until, shard)
+    fields = insight_fields(level)
+    graph_level = fetch_level(level)
+
+    def fetch_pages(shard_since: date, shard_until: date):
+        # Stream pages of insights; the next page downloads while the
+        # current one is written
+        days = (shard_until - shard_since).days + 1
+        if mode == "async_job" or (mode == "auto" and should_use_async_report(graph_level, days)):
+            iter_pages = fb_client.iter_insights_report_pages
+        else:
+            iter_pages = fb_client.iter_insights_pages
+        return iter_pages(
+            ad_account_id=fb_account.ad_account_id,
+            since=shard_since.isoformat(),
+            until=shard_until.isoformat(),
+            level=graph_level,
+            fields=fields,
+            access_token=fb_account.access_token,
+        )
+
+    return await ingest_sharded(
+        db,
+        facebook_account_id=fb_account.id,
+        ad_account_id=fb_account.ad_account_id,
+        level=level,
+        shards=shards,
+        fetch_pages=fetch_pages,
+        max_attempts=SHARD_MAX_ATTEMPTS if shard else 1,
+        on_progress=on_progress,
+    )
+
+
+def last_complete_date(today: Optional[date] = None) -> date:
+    """Most recent day whose insights are final (yesterday, UTC)."""
+    return (today or datetime.utcnow().date()) - timedelta(days=1)
+
+
+def get_sync_state(db: Session, facebook_account_id: int, level: str) -> Optional[SyncState]:
+    return (
+        db.query(SyncState)
+        .filter(SyncState.facebook_account_id == facebook_account_id, SyncState.level == level)
+        .first()
+    )
+
+
+def compute_sync_window(
+    watermark: Optional[date],
+    until: date,
+    lookback_days: int = DEFAULT_LOOKBACK_DAYS,
+    initial_days: int = DEFAULT_INITIAL_DAYS,
+) -> Tuple[date, date]:
+    """
+    Range to fetch for an incremental sync ending at ``until``.
+
+    With a watermark the window starts ``lookback_days`` before the day after
+    it; without one it covers the last ``initial_days`` days. The window is
+    empty (since > until) when there is nothing to fetch.
+    """
+    if watermark is None:
+        return until - timedelta(days=initial_days - 1), until
+    return watermark + timedelta(days=1) - timedelta(days=lookback_days), until
+
+
+def advance_watermark(
+    db: Session, facebook_account_id: int, level: str, result: ShardedIngestResult, since: date, until: date
+) -> Optional[date]:
+    """
+    Move the watermark to the last day that is now fully ingested.
+
+    If shards failed, the watermark stops the day before the earliest failed
+    shard so the next sync fetches it again. It never moves backwards.
+    """
+    complete_through = until
+    if result.failed_shards:
+        complete_through = min(failure.since for failure in result.failed_shards) - timedelta(days=1)
+
+    state = get_sync_state(db, facebook_account_id, level)
+    if state is None:
+        if complete_through < since:
+            return None
+        state = SyncState(facebook_account_id=facebook_account_id, level=level)
+        db.add(state)
+    elif state.last_complete_date >= complete_through:
+        return state.last_complete_date
+
+    state.last_complete_date = complete_through
+    state.updated_at = datetime.utcnow()
+    db.commit()
+    return complete_through
+
+
+async def sync_account(
+    db: Session,
+    fb_client: AsyncFacebookGraphAPIClient,
+    fb_account: FacebookAccount,
+    level: str,
+    lookback_days: int = DEFAULT_LOOKBACK_DAYS,
+    initial_days: int = DEFAULT_INITIAL_DAYS,
+    shard: Optional[str] = None,
+    mode: str = "auto",
+    on_progress: Optional[ProgressCallback] = None,
+) -> SyncOutcome:
+    """Fetch the window after the watermark (minus the lookback) and advance it."""
+    state = await asyncio.to_thread(get_sync_state, db, fb_account.id, level)
+    watermark = state.last_complete_date if state else None
+    since, until = compute_sync_window(watermark, last_complete_date(), lookback_days, initial_days)
+    if since > until:
+        return SyncOutcome(since=None, until=None, watermark=watermark, result=None)
+
+    result = await ingest_range(
+        db, fb_client, fb_account, since, until, level, shard=shard, mode=mode, on_progress=on_progress
+    )
+    if len(result.failed_shards) < result.shards_total:
+        watermark = await asyncio.to_thread(advance_watermark, db, fb_account.id, level, result, since, until)
+    return SyncOutcome(since=since, until=until, watermark=watermark, result=result)
@@ -0,0 +1,135 @@
+"""
+Storage of the raw Graph API JSON kept with every metric snapshot.
+
+``RAW_STORAGE`` selects how new rows store it:
+
+* ``zlib`` (default): compressed into the ``raw_blob`` BLOB column
+* ``zstd``: like zlib but with zstd, if the ``zstandard`` package is installed
+* ``text``: uncompressed in the legacy ``raw`` TEXT column
+* ``none``: not stored
+
+Both columns are deferred on the model, so ordinary queries never read
+them. Readers go through :func:`decode_raw`, which understands every mode,
+so rows written under different settings can coexist. Existing rows are
+converted with:
+
+    python -m app.facebook.raw_storage --migrate [--mode zlib] [--vacuum]
+"""
+import argparse
+import os
+import zlib
+from typing import Any, Dict, Optional
+
+from sqlalchemy import select, text, update
+from sqlalchemy.orm import Session
+
+from app.models import MetricSnapshot
+
+try:
+    import zstandard
+
+    ZSTD_AVAILABLE = True
+except ImportError:  # optional dependency
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+RAW_STORAGE_MODES = ["zlib", "zstd", "text", "none"]
+
+RAW_STORAGE = os.getenv("RAW_STORAGE", "zlib")
+
+ZLIB_LEVEL = 6
+
+ZSTD_LEVEL = 3
+
+# Rows converted per transaction by migrate_raw_storage
+MIGRATE_BATCH_SIZE = 2000
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _compressor(mode: str):
+    if mode == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("RAW_STORAGE=zstd requires the zstandard package")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress
+    return lambda data: zlib.compress(data, ZLIB_LEVEL)
+
+
+def encode_raw(raw: Optional[str], mode: Optional[str] = None) -> Dict[str, Any]:
+    """Column values (``raw``, ``raw_blob``) storing the JSON text ``raw``."""
+    mode = mode or RAW_STORAGE
+    if mode not in RAW_STORAGE_MODES:
+        raise ValueError(f"Unknown raw storage mode {mode!r}")
+    if raw is None or mode == "none":
+        return {"raw": None, "raw_blob": None}
+    if mode == "text":
+        return {"raw": raw, "raw_blob": None}
+    return {"raw": None, "raw_blob": _compressor(mode)(raw.encode())}
+
+
+def decode_raw(raw: Optional[str], raw_blob: Optional[bytes]) -> Optional[str]:
+    """The JSON text stored in either column, whatever mode wrote it."""
+    if raw_blob is not None:
+        raw_blob = bytes(raw_blob)
+        if raw_blob.startswith(_ZSTD_MAGIC):
+            if not ZSTD_AVAILABLE:
+                raise RuntimeError("Reading zstd compressed raw data requires the zstandard package")
+            return zstandard.ZstdDecompressor().decompress(raw_blob).decode()
+        return zlib.decompress(raw_blob).decode()
+    return raw
+
+
+def migrate_raw_storage(db: Session, mode: Optional[str] = None, batch_size: int = MIGRATE_BATCH_SIZE) -> int:
+    """
+    Re-encode every stored raw value with ``mode``, in id order, one
+    transaction per batch. Safe to interrupt and re-run. Returns the number
+    of rows rewritten.
+    """
+    mode = mode or RAW_STORAGE
+    encode_raw(None, mode)  # validate the mode up front
+    c = MetricSnapshot.__table__.c
+    rewritten = 0
+    last_id = 0
+    while True:
+        batch = db.execute(
+            select(c.id, c.raw, c.raw_blob)
+            .where(c.id > last_id, (c.raw.isnot(None)) | (c.raw_blob.isnot(None)))
+            .order_by(c.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return rewritten
+        for row_id, raw, raw_blob in batch:
+            values = encode_raw(decode_raw(raw, raw_blob), mode)
+            if values != {"raw": raw, "raw_blob": raw_blob}:
+                db.execute(update(MetricSnapshot.__table__).where(c.id == row_id).values(**values))
+                rewritten += 1
+        db.commit()
+        last_id = batch[-1][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage raw insight JSON storage")
+    parser.add_argument("--migrate", action="store_true", help="Re-encode existing rows")
+    parser.add_argument("--mode", choices=RAW_STORAGE_MODES, default=RAW_STORAGE)
+    parser.add_argument("--batch-size", type=int, default=MIGRATE_BATCH_SIZE)
+    parser.add_argument("--vacuum", action="store_true", help="Reclaim freed space afterwards (SQLite)")
+    args = parser.parse_args()
+    if not args.migrate:
+        parser.error("nothing to do (use --migrate)")
+
+    from app.database import SessionLocal, engine, init_db
+
+    init_db()
+    with SessionLocal() as db:
+        rewritten = migrate_raw_storage(db, args.mode, args.batch_size)
+    print(f"Re-encoded {rewritten} rows as {args.mode}")
+
+    if args.vacuum and engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+        print("Vacuumed database")
+
+
+if __name__ == "__main__":
+    main()
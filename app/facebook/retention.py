@@ -0,0 +1,305 @@
+"""
+Retention for metric snapshots: whole months older than the retention window
+are moved out of ``metric_snapshots`` into gzip NDJSON archive files.
+
+A month of one account is the partition unit. It is written to
+``ARCHIVE_DIR/<account id>/<YYYY-MM>.ndjson.gz``, recorded in
+``metric_archives``, and its rows and action breakdowns are deleted in one
+transaction, so the hot table and its indexes are sized by the retention
+window rather than by the account's history.
+
+Rollups are kept: summaries keep covering archived months. Ingestion skips
+rows of archived months (they would otherwise be counted in the rollups
+twice); :func:`restore_month` moves a month back first. Archived rows are
+read back with :func:`iter_archived_rows` (the export's ``include_archived``).
+The other routes that read snapshots report :func:`archived_before` when the
+days they read overlap an archived month, so partial history is explicit.
+
+    python -m app.facebook.retention --archive [--months 13] [--account-id 1]
+    python -m app.facebook.retention --restore --account-id 1 --month 2023-01
+"""
+import argparse
+import gzip
+import json
+import os
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, delete, func, or_, select, true
+from sqlalchemy.orm import Session
+
+from app.facebook.actions import existing_actions
+from app.facebook.raw_storage import decode_raw, encode_raw
+from app.facebook.rollups import period_start
+from app.models import MetricAction, MetricArchive, MetricSnapshot
+from app.response_cache import bump_data_version
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "data/archive")
+
+# Months kept in metric_snapshots, counting the current one; 0 keeps everything
+RETENTION_MONTHS = int(os.getenv("RETENTION_MONTHS", "0"))
+
+# Rows read per batch while archiving, and inserted per batch while restoring
+ARCHIVE_BATCH_SIZE = 5000
+
+ARCHIVE_FIELDS = ["id", "ts", "level", "entity_id", "impressions", "clicks", "spend", "conversions", "revenue"]
+
+
+def archive_path(facebook_account_id: int, month: date) -> str:
+    return os.path.join(ARCHIVE_DIR, str(facebook_account_id), f"{month:%Y-%m}.ndjson.gz")
+
+
+def add_months(month: date, count: int) -> date:
+    """First day of the month ``count`` months after (or before) ``month``."""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def retention_cutoff(retention_months: int, today: Optional[date] = None) -> date:
+    """First day of the oldest month kept hot."""
+    return add_months(today or date.today(), 1 - retention_months)
+
+
+def archived_months(db: Session, facebook_account_id: int) -> Set[date]:
+    stmt = select(MetricArchive.month).where(MetricArchive.facebook_account_id == facebook_account_id)
+    return set(db.execute(stmt).scalars())
+
+
+def archived_before(
+    db: Session, facebook_account_id: int, ranges: Iterable[Tuple[Optional[date], Optional[date]]]
+) -> Optional[date]:
+    """
+    First day after the newest archived month overlapping any of ``ranges``
+    (``(since, until)`` pairs, None for an open bound), or None when none
+    does. Snapshot reads of those ranges are missing archived rows before
+    that day.
+    """
+    a = MetricArchive.__table__.c
+    overlaps = [
+        and_(
+            a.month >= period_start(since, "month") if since else true(),
+            a.month <= until if until else true(),
+        )
+        for since, until in ranges
+    ]
+    if not overlaps:
+        return None
+    newest = db.execute(
+        select(func.max(a.month)).where(a.facebook_account_id == facebook_account_id, or_(*overlaps))
+    ).scalar()
+    return add_months(newest, 1) if newest else None
+
+
+def _write_month(db: Session, facebook_account_id: int, month: date, path: str) -> Tuple[int, List[int]]:
+    """Stream one month of snapshots into ``path``; returns the row count and the ids written."""
+    c = MetricSnapshot.__table__.c
+    stmt = (
+        select(*[c[name] for name in ARCHIVE_FIELDS], c.raw, c.raw_blob)
+        .where(c.facebook_account_id == facebook_account_id, c.ts >= month, c.ts < add_months(month, 1))
+        .order_by(c.ts, c.id)
+        .execution_options(yield_per=ARCHIVE_BATCH_SIZE)
+    )
+    ids: List[int] = []
+    with gzip.open(path, "wt", encoding="utf-8") as out:
+        for rows in db.execute(stmt).partitions():
+            breakdowns = existing_actions(db, [row[0] for row in rows])
+            for row in rows:
+                record = dict(zip(ARCHIVE_FIELDS, row))
+                record["ts"] = record["ts"].isoformat()
+                raw = decode_raw(row[-2], row[-1])
+                record["raw"] = json.loads(raw) if raw else None
+                if record["id"] in breakdowns:
+                    record["actions"] = breakdowns[record["id"]]
+                out.write(json.dumps(record, separators=(",", ":")) + "\n")
+                ids.append(record["id"])
+    return len(ids), ids
+
+
+def archive_month(db: Session, facebook_account_id: int, month: date) -> int:
+    """
+    Move one month of an account's snapshots to its archive file. The file
+    is complete on disk before any row is deleted. Returns the number of
+    rows archived (0 when the month is empty or already archived).
+    """
+    month = period_start(month, "month")
+    if month in archived_months(db, facebook_account_id):
+        return 0
+
+    path = archive_path(facebook_account_id, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + ".part"
+    try:
+        row_count, ids = _write_month(db, facebook_account_id, month, partial)
+        if not row_count:
+            os.remove(partial)
+            return 0
+        os.replace(partial, path)
+
+        a, c = MetricAction.__table__.c, MetricSnapshot.__table__.c
+        for start in range(0, len(ids), ARCHIVE_BATCH_SIZE):
+            batch = ids[start:start + ARCHIVE_BATCH_SIZE]
+            db.execute(delete(MetricAction.__table__).where(a.snapshot_id.in_(batch)))
+            db.execute(delete(MetricSnapshot.__table__).where(c.id.in_(batch)))
+        db.add(
+            MetricArchive(
+                facebook_account_id=facebook_account_id,
+                month=month,
+                path=path,
+                row_count=row_count,
+                byte_size=os.path.getsize(path),
+            )
+        )
+        bump_data_version(db, facebook_account_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        for leftover in (partial, path):  # the rows are still in the database
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    return row_count
+
+
+def archive_expired(
+    db: Session,
+    retention_months: int = RETENTION_MONTHS,
+    facebook_account_id: Optional[int] = None,
+    today: Optional[date] = None,
+) -> List[Tuple[int, date, int]]:
+    """
+    Archive every month older than the retention window, oldest first.
+    Returns ``(account id, month, rows)`` per archived month.
+    """
+    if retention_months <= 0:
+        return []
+    cutoff = retention_cutoff(retention_months, today)
+    c = MetricSnapshot.__table__.c
+    stmt = select(c.facebook_account_id, func.min(c.ts)).where(c.ts < cutoff).group_by(c.facebook_account_id)
+    if facebook_account_id is not None:
+        stmt = stmt.where(c.facebook_account_id == facebook_account_id)
+
+    archived = []
+    for account_id, oldest in db.execute(stmt).all():
+        month = period_start(oldest, "month")
+        while month < cutoff:
+            rows = archive_month(db, account_id, month)
+            if rows:
+                archived.append((account_id, month, rows))
+            month = add_months(month, 1)
+    return archived
+
+
+def _read_archive(path: str) -> Iterator[Dict[str, Any]]:
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        for line in archive:
+            record = json.loads(line)
+            record["ts"] = date.fromisoformat(record["ts"])
+            yield record
+
+
+def iter_archived_rows(
+    db: Session,
+    facebook_account_id: int,
+    level: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Archived snapshots of the account in ``since..until``, oldest first (one file open at a time)."""
+    stmt = (
+        select(MetricArchive.month, MetricArchive.path)
+        .where(MetricArchive.facebook_account_id == facebook_account_id)
+        .order_by(MetricArchive.month)
+    )
+    if since:
+        stmt = stmt.where(MetricArchive.month >= period_start(since, "month"))
+    if until:
+        stmt = stmt.where(MetricArchive.month <= until)
+    for _, path in db.execute(stmt).all():
+        for record in _read_archive(path):
+            if level and record["level"] != level:
+                continue
+            if (since and record["ts"] < since) or (until and record["ts"] > until):
+                continue
+            yield record
+
+
+def restore_month(db: Session, facebook_account_id: int, month: date) -> int:
+    """
+    Move an archived month back into metric_snapshots (ids preserved) and
+    delete its archive file. Rollups already include these rows and are left
+    as they are. Returns the number of rows restored.
+    """
+    month = period_start(month, "month")
+    archive = db.execute(
+        select(MetricArchive).where(
+            MetricArchive.facebook_account_id == facebook_account_id, MetricArchive.month == month
+        )
+    ).scalar_one_or_none()
+    if archive is None:
+        return 0
+
+    restored = 0
+    snapshots: List[Dict[str, Any]] = []
+    actions: List[Dict[str, Any]] = []
+
+    def flush():
+        if snapshots:
+            db.execute(MetricSnapshot.__table__.insert(), snapshots)
+        if actions:
+            db.execute(MetricAction.__table__.insert(), actions)
+        snapshots.clear()
+        actions.clear()
+
+    try:
+        for record in _read_archive(archive.path):
+            raw = json.dumps(record.pop("raw")) if record.get("raw") is not None else None
+            breakdown = record.pop("actions", {})
+            record.update(encode_raw(raw), facebook_account_id=facebook_account_id, created_at=datetime.utcnow())
+            snapshots.append(record)
+            actions += [
+                {"snapshot_id": record["id"], "action_type": name, "count": count, "value": value}
+                for name, (count, value) in breakdown.items()
+            ]
+            restored += 1
+            if len(snapshots) >= ARCHIVE_BATCH_SIZE:
+                flush()
+        flush()
+        db.delete(archive)
+        bump_data_version(db, facebook_account_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    os.remove(archive.path)
+    return restored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive or restore months of metric snapshots")
+    parser.add_argument("--archive", action="store_true", help="Archive months older than the retention window")
+    parser.add_argument("--restore", action="store_true", help="Move an archived month back into the database")
+    parser.add_argument("--months", type=int, default=RETENTION_MONTHS, help="Retention window in months")
+    parser.add_argument("--account-id", type=int, help="Limit to one facebook_accounts.id")
+    parser.add_argument("--month", help="Month to restore (YYYY-MM)")
+    args = parser.parse_args()
+    if args.archive == args.restore:
+        parser.error("pass exactly one of --archive or --restore")
+
+    from app.database import SessionLocal, init_db
+
+    init_db()
+    with SessionLocal() as db:
+        if args.archive:
+            if args.months <= 0:
+                parser.error("--months (or RETENTION_MONTHS) must be positive")
+            for account_id, month, rows in archive_expired(db, args.months, args.account_id):
+                print(f"Archived account {account_id} {month:%Y-%m}: {rows} rows")
+        else:
+            if args.account_id is None or not args.month:
+                parser.error("--restore needs --account-id and --month")
+            month = datetime.strptime(args.month, "%Y-%m").date()
+            print(f"Restored {restore_month(db, args.account_id, month)} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""
+Pre-aggregated metric rollups for dashboard queries.
+
+``upsert_metric_rows`` hands every inserted or changed snapshot to
+:func:`rollup_deltas` together with its previous values, and the resulting
+deltas are added to ``metric_rollups`` in the same transaction. Rollups are
+kept at three grains:
+
+* ``week`` / ``month`` per level and entity (``entity_id`` as ingested)
+* ``day`` / ``week`` / ``month`` per level for the whole account
+  (``entity_id == "*"``)
+
+Range queries combine whole months and weeks from the rollups with raw
+snapshots only for the leftover days at the edges, so a year of ad-level
+data is answered from a few dozen rows. :func:`rebuild_rollups` recomputes
+them from the snapshots and the archive files of archived months (for
+existing data or after manual edits):
+
+    python -m app.facebook.rollups --rebuild [--account-id 1]
+"""
+import argparse
+from collections import defaultdict
+from itertools import islice
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, desc, func, select, union_all
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.models import Entity, MetricArchive, MetricRollup, MetricSnapshot
+from app.response_cache import bump_data_version
+from app.utils import ctr_expression, roas_expression
+
+GRAINS = ["day", "week", "month"]
+
+ALL_ENTITIES = "*"
+
+# Additive MetricSnapshot columns carried into the rollups
+ROLLUP_METRICS = ["impressions", "clicks", "spend", "conversions", "revenue"]
+
+# Ancestors each level's totals can be summed up to, direct parent first
+HIERARCHY_GROUPS = {"ad": ["adset", "campaign"], "adset": ["campaign"]}
+
+# Group of entities whose parent is not in the entities table
+UNKNOWN_ENTITY = "unknown"
+
+# Columns entity_totals can be ordered by
+ORDER_COLUMNS = ROLLUP_METRICS + ["ctr", "roas"]
+
+# Snapshots read per batch by rebuild_rollups
+REBUILD_BATCH_SIZE = 5000
+
+RollupKey = Tuple[int, str, date, str, str]  # account, grain, period_start, level, entity_id
+
+
+def period_start(ts: date, grain: str) -> date:
+    """First day of the ``grain`` period containing ``ts`` (weeks start Monday)."""
+    if grain == "day":
+        return ts
+    if grain == "week":
+        return ts - timedelta(days=ts.weekday())
+    if grain == "month":
+        return ts.replace(day=1)
+    raise ValueError(f"Unknown grain {grain!r}")
+
+
+def _next_month(day: date) -> date:
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _rollup_keys(row: Dict[str, Any]) -> List[RollupKey]:
+    account_id, ts, level = row["facebook_account_id"], row["ts"], row["level"]
+    keys = [(account_id, grain, period_start(ts, grain), level, ALL_ENTITIES) for grain in GRAINS]
+    keys += [(account_id, grain, period_start(ts, grain), level, row["entity_id"]) for grain in ("week", "month")]
+    return keys
+
+
+def rollup_deltas(changes: Iterable[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]) -> Dict[RollupKey, Dict]:
+    """
+    Aggregate snapshot changes into per-rollup deltas.
+
+    ``changes`` yields ``(row, previous)`` pairs, where ``previous`` holds the
+    stored metric values for an update and is None for an insert.
+    """
+    deltas: Dict[RollupKey, Dict] = defaultdict(lambda: dict.fromkeys(ROLLUP_METRICS + ["row_count"], 0))
+    for row, previous in changes:
+        diff = {name: row[name] - (previous[name] if previous else 0) for name in ROLLUP_METRICS}
+        for key in _rollup_keys(row):
+            delta = deltas[key]
+            for name, value in diff.items():
+                delta[name] += value
+            if previous is None:
+                delta["row_count"] += 1
+    return deltas
+
+
+def _delta_rows(deltas: Dict[RollupKey, Dict]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "facebook_account_id": account_id,
+            "grain": grain,
+            "period_start": start,
+            "level": level,
+            "entity_id": entity_id,
+            **delta,
+        }
+        for (account_id, grain, start, level, entity_id), delta in deltas.items()
+    ]
+
+
+def apply_rollup_deltas(db: Session, deltas: Dict[RollupKey, Dict]) -> None:
+    """
+    Add ``deltas`` to the rollup rows, creating missing ones.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    if not deltas:
+        return
+    table = MetricRollup.__table__
+    rows = _delta_rows(deltas)
+    additive = ROLLUP_METRICS + ["row_count"]
+
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name in ("postgresql", "sqlite"):
+        stmt = postgresql_insert(table) if dialect_name == "postgresql" else sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["facebook_account_id", "grain", "level", "entity_id", "period_start"],
+            set_={name: table.c[name] + stmt.excluded[name] for name in additive},
+        )
+        db.execute(stmt, rows)
+        return
+
+    # Fallback for dialects without ON CONFLICT support
+    for row in rows:
+        keys = ("facebook_account_id", "grain", "period_start", "level", "entity_id")
+        match = and_(*[table.c[name] == row[name] for name in keys])
+        updated = db.execute(
+            table.update().where(match).values({name: table.c[name] + row[name] for name in additive})
+        ).rowcount
+        if not updated:
+            db.execute(table.insert(), [row])
+
+
+def rebuild_rollups(db: Session, facebook_account_id: Optional[int] = None) -> int:
+    """
+    Recompute rollups from the stored snapshots (one account, or all).
+
+    Months moved out by app/facebook/retention.py are read back from their
+    archive files, so their rollups survive the rebuild. Returns the number
+    of snapshots read, archived ones included.
+    """
+    from app.facebook.retention import iter_archived_rows  # retention imports this module
+
+    table = MetricSnapshot.__table__
+    columns = [table.c.facebook_account_id, table.c.ts, table.c.level, table.c.entity_id] + [
+        table.c[name] for name in ROLLUP_METRICS
+    ]
+    stmt = select(*columns)
+    cleanup = delete(MetricRollup)
+    archived_accounts = select(MetricArchive.facebook_account_id).distinct()
+    if facebook_account_id is not None:
+        stmt = stmt.where(table.c.facebook_account_id == facebook_account_id)
+        cleanup = cleanup.where(MetricRollup.facebook_account_id == facebook_account_id)
+        archived_accounts = archived_accounts.where(MetricArchive.facebook_account_id == facebook_account_id)
+
+    try:
+        db.execute(cleanup)
+        total = 0
+        for batch in db.execute(stmt.execution_options(yield_per=REBUILD_BATCH_SIZE)).mappings().partitions():
+            apply_rollup_deltas(db, rollup_deltas((row, None) for row in batch))
+            total += len(batch)
+        for account_id in db.scalars(archived_accounts).all():
+            records = iter_archived_rows(db, account_id)
+            while batch := list(islice(records, REBUILD_BATCH_SIZE)):
+                rows = ({**record, "facebook_account_id": account_id} for record in batch)
+                apply_rollup_deltas(db, rollup_deltas((row, None) for row in rows))
+                total += len(batch)
+        bump_data_version(db, facebook_account_id)  # estimated totals come from the rollups
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return total
+
+
+# ---- queries ----
+
+
+def cover_range(since: date, until: date) -> Tuple[List[date], List[date], List[Tuple[date, date]]]:
+    """
+    Split ``since..until`` into whole months, whole weeks and leftover days.
+
+    Returns ``(month_starts, week_starts, day_ranges)``. Weeks are only used
+    where they do not prevent a following whole month from being used.
+    """
+    months: List[date] = []
+    weeks: List[date] = []
+    day_ranges: List[Tuple[date, date]] = []
+
+    day = since
+    while day <= until:
+        next_month = _next_month(day)
+        if day.day == 1 and next_month - timedelta(days=1) <= until:
+            months.append(day)
+            day = next_month
+            continue
+        week_end = day + timedelta(days=6)
+        month_fits = _next_month(next_month) - timedelta(days=1) <= until
+        if day.weekday() == 0 and week_end <= until and (week_end < next_month or not month_fits):
+            weeks.append(day)
+            day = week_end + timedelta(days=1)
+            continue
+        if day_ranges and day_ranges[-1][1] == day - timedelta(days=1):
+            day_ranges[-1] = (day_ranges[-1][0], day)
+        else:
+            day_ranges.append((day, day))
+        day += timedelta(days=1)
+
+    return months, weeks, day_ranges
+
+
+def _metric_columns(columns, aggregate: bool = False) -> list:
+    """Metric columns plus CTR/ROAS, summed when ``aggregate`` is set."""
+    if aggregate:
+        values = {name: func.coalesce(func.sum(columns[name]), 0) for name in ROLLUP_METRICS}
+    else:
+        values = {name: columns[name] for name in ROLLUP_METRICS}
+    return [value.label(name) for name, value in values.items()] + [
+        ctr_expression(values["clicks"], values["impressions"]).label("ctr"),
+        roas_expression(values["revenue"], values["spend"]).label("roas"),
+    ]
+
+
+def account_totals(db: Session, facebook_account_id: int, level: str, since: date, until: date) -> Dict[str, Any]:
+    """Totals, CTR and ROAS of one level over ``since..until`` (account-daily rollups)."""
+    r = MetricRollup.__table__.c
+    stmt = select(*_metric_columns(r, aggregate=True)).where(
+        r.facebook_account_id == facebook_account_id,
+        r.grain == "day",
+        r.level == level,
+        r.entity_id == ALL_ENTITIES,
+        r.period_start.between(since, until),
+    )
+    return dict(db.execute(stmt).mappings().one())
+
+
+def account_series(
+    db: Session, facebook_account_id: int, level: str, since: date, until: date, grain: str = "day"
+) -> List[Dict[str, Any]]:
+    """
+    Per-period account totals. For ``week``/``month`` every period that
+    overlaps ``since..until`` is returned whole.
+    """
+    r = MetricRollup.__table__.c
+    stmt = (
+        select(r.period_start, *_metric_columns(r))
+        .where(
+            r.facebook_account_id == facebook_account_id,
+            r.grain == grain,
+            r.level == level,
+            r.entity_id == ALL_ENTITIES,
+            r.period_start.between(period_start(since, grain), until),
+        )
+        .order_by(r.period_start)
+    )
+    return [dict(row) for row in db.execute(stmt).mappings()]
+
+
+def snapshot_count(
+    db: Session,
+    facebook_account_id: int,
+    level: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+) -> int:
+    """
+    Number of snapshots matching the filters, from the account-daily
+    rollups' ``row_count`` (no snapshot scan). Only as current as the
+    rollups themselves. Days of archived months are left out: the rollups
+    keep them, but ``metric_snapshots`` no longer holds their rows.
+    """
+    from app.facebook.retention import add_months  # retention imports this module
+
+    r = MetricRollup.__table__.c
+    stmt = select(func.coalesce(func.sum(r.row_count), 0)).where(
+        r.facebook_account_id == facebook_account_id,
+        r.grain == "day",
+        r.entity_id == ALL_ENTITIES,
+    )
+    if level:
+        stmt = stmt.where(r.level == level)
+    if since:
+        stmt = stmt.where(r.period_start >= since)
+    if until:
+        stmt = stmt.where(r.period_start <= until)
+    archived = select(MetricArchive.month).where(MetricArchive.facebook_account_id == facebook_account_id)
+    for month in db.execute(archived).scalars():
+        stmt = stmt.where(~and_(r.period_start >= month, r.period_start < add_months(month, 1)))
+    return db.execute(stmt).scalar()
+
+
+def _entity_rows(facebook_account_id: int, level: str, since: date, until: date):
+    """
+    Subquery of ``(entity_id, *metrics)`` rows whose per-entity sums are the
+    totals over ``since..until``: whole months and weeks from the rollups,
+    the leftover days at the edges from the snapshots. None for an empty range.
+    """
+    months, weeks, day_ranges = cover_range(since, until)
+    r = MetricRollup.__table__.c
+    s = MetricSnapshot.__table__.c
+
+    parts = []
+    for grain, starts in (("month", months), ("week", weeks)):
+        if starts:
+            parts.append(
+                select(r.entity_id, *[r[name] for name in ROLLUP_METRICS]).where(
+                    r.facebook_account_id == facebook_account_id,
+                    r.grain == grain,
+                    r.level == level,
+                    r.entity_id != ALL_ENTITIES,
+                    r.period_start.in_(starts),
+                )
+            )
+    for first, last in day_ranges:
+        parts.append(
+            select(s.entity_id, *[s[name] for name in ROLLUP_METRICS]).where(
+                s.facebook_account_id == facebook_account_id,
+                s.level == level,
+                s.ts.between(first, last),
+            )
+        )
+    if not parts:
+        return None
+    return union_all(*parts).subquery() if len(parts) > 1 else parts[0].subquery()
+
+
+def _with_names(db: Session, facebook_account_id: int, level: str, totals, order_by: str) -> List[Dict[str, Any]]:
+    """Rows of the ``totals`` subquery (already limited) with the entity name joined on, None when unknown."""
+    e = Entity.__table__.c
+    stmt = (
+        select(totals.c.entity_id, e.name, *[totals.c[name] for name in ORDER_COLUMNS])
+        .select_from(
+            totals.outerjoin(
+                Entity.__table__,
+                and_(
+                    e.facebook_account_id == facebook_account_id,
+                    e.level == level,
+                    e.entity_id == totals.c.entity_id,
+                ),
+            )
+        )
+        .order_by(desc(totals.c[order_by]), totals.c.entity_id)
+    )
+    return [dict(row) for row in db.execute(stmt).mappings()]
+
+
+def entity_totals(
+    db: Session,
+    facebook_account_id: int,
+    level: str,
+    since: date,
+    until: date,
+    order_by: str = "spend",
+    limit: int = 50,
+) -> List[Dict[str, Any]]:
+    """
+    Per-entity totals over ``since..until`` with their names, largest
+    ``order_by`` first.
+
+    Whole months and weeks come from the rollups; only the leftover days at
+    the edges of the range are read from the snapshots. Raises ValueError
+    for an unknown ``order_by``.
+    """
+    if order_by not in ORDER_COLUMNS:
+        raise ValueError(f"order_by must be one of {', '.join(ORDER_COLUMNS)}")
+
+    combined = _entity_rows(facebook_account_id, level, since, until)
+    if combined is None:
+        return []
+    totals = (
+        select(combined.c.entity_id, *_metric_columns(combined.c, aggregate=True))
+        .group_by(combined.c.entity_id)
+        .order_by(desc(order_by), combined.c.entity_id)
+        .limit(limit)
+        .subquery()
+    )
+    return _with_names(db, facebook_account_id, level, totals, order_by)
+
+
+def hierarchy_totals(
+    db: Session,
+    facebook_account_id: int,
+    level: str,
+    group_by: str,
+    since: date,
+    until: date,
+    campaign_id: Optional[str] = None,
+    order_by: str = "spend",
+    limit: int = 50,
+) -> List[Dict[str, Any]]:
+    """
+    Totals of ``level`` entities summed up to their ``group_by`` ancestor
+    (ads per adset or campaign, adsets per campaign) over ``since..until``,
+    largest ``order_by`` first, optionally within one campaign.
+
+    The per-entity rows of :func:`entity_totals` are joined to the entities
+    table for their parent; entities not in it yet are grouped under
+    ``"unknown"``. Raises ValueError for an unknown ``order_by`` or a
+    ``group_by`` that is not an ancestor of ``level``.
+    """
+    if order_by not in ORDER_COLUMNS:
+        raise ValueError(f"order_by must be one of {', '.join(ORDER_COLUMNS)}")
+    if group_by not in HIERARCHY_GROUPS.get(level, []):
+        raise ValueError(f"{level} totals can be grouped by {', '.join(HIERARCHY_GROUPS.get(level, [])) or 'nothing'}")
+
+    combined = _entity_rows(facebook_account_id, level, since, until)
+    if combined is None:
+        return []
+    child = Entity.__table__.alias("child")
+    parent_column = child.c.parent_id if group_by == HIERARCHY_GROUPS[level][0] else child.c.campaign_id
+    group_key = func.coalesce(parent_column, UNKNOWN_ENTITY)
+    stmt = (
+        select(group_key.label("entity_id"), *_metric_columns(combined.c, aggregate=True))
+        .select_from(
+            combined.outerjoin(
+                child,
+                and_(
+                    child.c.facebook_account_id == facebook_account_id,
+                    child.c.level == level,
+                    child.c.entity_id == combined.c.entity_id,
+                ),
+            )
+        )
+        .group_by(group_key)
+        .order_by(desc(order_by), group_key)
+        .limit(limit)
+    )
+    if campaign_id is not None:
+        stmt = stmt.where(child.c.campaign_id == campaign_id)
+    return _with_names(db, facebook_account_id, group_by, stmt.subquery(), order_by)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain metric rollups")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute rollups from metric snapshots")
+    parser.add_argument("--account-id", type=int, default=None, help="Only this facebook_accounts.id")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.error("nothing to do (use --rebuild)")
+
+    from app.database import SessionLocal, init_db
+
+    init_db()
+    with SessionLocal() as db:
+        total = rebuild_rollups(db, args.account_id)
+    print(f"Rebuilt rollups from {total} snapshots")
+
+
+if __name__ == "__main__":
+    main()
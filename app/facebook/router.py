@@ -1,25 +1,69 @@
+import asyncio
+import base64
 import json
 from datetime import datetime, date
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
-from app.database import get_db
+from app.database import get_async_db, get_async_read_db, get_db, get_read_db
 from app.models import User, FacebookAccount, MetricSnapshot
 from app.schemas import (
     FacebookAccountResponse,
     SystemUserTokenRequest,
     FetchInsightsResponse,
+    ShardFailureResponse,
+    SyncInsightsResponse,
     MetricSnapshotListResponse,
     MetricSnapshotResponse,
+    RollupSummaryResponse,
+    EntityTotalsResponse,
+    HierarchyTotalsResponse,
+    EntityListResponse,
+    EntityRefreshResponse,
+    AnalyticsColumnsResponse,
+    ActionTotalsResponse,
+    ConversionActionTypesRequest,
+    ConversionActionTypesResponse,
 )
-from app.auth.dependencies import get_current_user
-from app.facebook.client import FacebookGraphAPIClient
+from app.auth.dependencies import get_current_user, get_current_user_id
+from app.facebook.actions import account_conversion_types, action_totals, set_conversion_action_types
+from app.facebook.analytics import MAX_ANALYTICS_ROWS, fetch_columns, parse_fields
+from app.facebook.client import AsyncFacebookGraphAPIClient
+from app.facebook.entities import ENTITY_LEVELS, list_entities, refresh_entities
+from app.facebook.export import EXPORT_FORMATS, iter_export
+from app.facebook.pipeline import (
+    DEFAULT_INITIAL_DAYS,
+    DEFAULT_LOOKBACK_DAYS,
+    FETCH_MODES,
+    INGEST_LEVELS,
+    LEVELS,
+    ingest_range,
+    sync_account,
+)
+from app.facebook.rollups import (
+    GRAINS,
+    HIERARCHY_GROUPS,
+    ORDER_COLUMNS,
+    account_series,
+    account_totals,
+    cover_range,
+    entity_totals,
+    hierarchy_totals,
+    snapshot_count,
+)
+from app.facebook.retention import archived_before
+from app.facebook.sharding import parse_shard_size
+from app.facebook.throttle import APP_KEY, account_key
+from app.response_cache import cache_key, cached_response, data_last_modified, data_version, store_response
 from app.config import settings
 
 router = APIRouter()
-fb_client = FacebookGraphAPIClient()
+fb_client = AsyncFacebookGraphAPIClient()
+
+TOTAL_MODES = ["auto", "exact", "estimate", "none"]
 
 
 @router.get("/oauth/login")
@@ -48,7 +92,7 @@ def facebook_oauth_login(
 
 
 @router.get("/oauth/callback", response_class=HTMLResponse)
-def facebook_oauth_callback(
+async def facebook_oauth_callback(
     code: Optional[str] = Query(None),
     state: Optional[str] = Query(None),
     error: Optional[str] = Query(None),
@@ -106,8 +150,8 @@ def facebook_oauth_callback(
             </html>
             """
 
-        # Verify user exists
-        user = db.query(User).filter(User.id == user_id).first()
+        # Verify user exists (the sync Session is used from a worker thread only)
+        user = await asyncio.to_thread(db.get, User, user_id)
         if not user:
             return """
             <html>
@@ -119,7 +163,7 @@ def facebook_oauth_callback(
             """
 
         # Step 1: Exchange code for short-lived token
-        token_data = fb_client.exchange_code_for_token(code, settings.FB_REDIRECT_URI)
+        token_data = await fb_client.exchange_code_for_token(code, settings.FB_REDIRECT_URI)
         short_lived_token = token_data.get("access_token")
 
         if not short_lived_token:
@@ -134,18 +178,12 @@ def facebook_oauth_callback(
             """
 
         # Step 2: Exchange for long-lived token
-        extended_data = fb_client.extend_token(short_lived_token)
+        extended_data = await fb_client.extend_token(short_lived_token)
         long_lived_token = extended_data.get("access_token")
         expires_at = extended_data.get("expires_at")
 
         # Step 3: Get ad accounts for this token
-        # Make a Graph API call to get ad accounts
-        accounts_url = f"{settings.FB_GRAPH_BASE_URL}/me/adaccounts"
-        params = {"access_token": long_lived_token, "fields": "id,name,account_id"}
-        response = fb_client._request_with_retry("GET", accounts_url, params=params)
-        accounts_data = response.json()
-
-        ad_accounts = accounts_data.get("data", [])
+        ad_accounts = await fb_client.get_ad_accounts(long_lived_token)
 
         if not ad_accounts:
             return """
@@ -159,40 +197,9 @@ def facebook_oauth_callback(
             """
 
         # Step 4: Store token for each ad account
-        stored_accounts = []
-        for account in ad_accounts:
-            ad_account_id = account.get("id")  # Format: act_123456789
-
-            # Check if account already exists for this user
-            existing = (
-                db.query(FacebookAccount)
-                .filter(
-                    FacebookAccount.user_id == user_id,
-                    FacebookAccount.ad_account_id == ad_account_id,
-                )
-                .first()
-            )
-
-            if existing:
-                # Update existing token
-                existing.access_token = long_lived_token
-                existing.expires_at = expires_at
-                existing.updated_at = datetime.utcnow()
-                stored_accounts.append(ad_account_id)
-            else:
-                # Create new record
-                fb_account = FacebookAccount(
-                    user_id=user_id,
-                    ad_account_id=ad_account_id,
-                    access_token=long_lived_token,
-                    token_type="Bearer",
-                    expires_at=expires_at,
-                    is_system_user=False,
-                )
-                db.add(fb_account)
-                stored_accounts.append(ad_account_id)
-
-        db.commit()
+        stored_accounts = await asyncio.to_thread(
+            _store_oauth_accounts, db, user_id, ad_accounts, long_lived_token, expires_at
+        )
 
         accounts_html = "<ul>" + "".join([f"<li>{acc}</li>" for acc in stored_accounts]) + "</ul>"
 
@@ -209,7 +216,7 @@ def facebook_oauth_callback(
         """
 
     except Exception as e:
-        db.rollback()
+        await asyncio.to_thread(db.rollback)
         return f"""
         <html>
             <body>
@@ -221,11 +228,52 @@ def facebook_oauth_callback(
         """
 
 
+def _store_oauth_accounts(
+    db: Session, user_id: int, ad_accounts: list, access_token: str, expires_at: Optional[datetime]
+) -> list[str]:
+    """Store the token for each ad account, updating accounts the user already has; returns their ids."""
+    stored_accounts = []
+    for account in ad_accounts:
+        ad_account_id = account.get("id")  # Format: act_123456789
+
+        # Check if account already exists for this user
+        existing = (
+            db.query(FacebookAccount)
+            .filter(
+                FacebookAccount.user_id == user_id,
+                FacebookAccount.ad_account_id == ad_account_id,
+            )
+            .first()
+        )
+
+        if existing:
+            # Update existing token
+            existing.access_token = access_token
+            existing.expires_at = expires_at
+            existing.updated_at = datetime.utcnow()
+        else:
+            # Create new record
+            db.add(
+                FacebookAccount(
+                    user_id=user_id,
+                    ad_account_id=ad_account_id,
+                    access_token=access_token,
+                    token_type="Bearer",
+                    expires_at=expires_at,
+                    is_system_user=False,
+                )
+            )
+        stored_accounts.append(ad_account_id)
+
+    db.commit()
+    return stored_accounts
+
+
 @router.post("/system_user/token", response_model=FacebookAccountResponse, status_code=status.HTTP_201_CREATED)
-def insert_system_user_token(
+async def insert_system_user_token(
     token_data: SystemUserTokenRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Insert a system user token manually (for testing/development).
@@ -233,13 +281,13 @@ def insert_system_user_token(
     """
     # Check if account already exists for this user
     existing = (
-        db.query(FacebookAccount)
-        .filter(
-            FacebookAccount.user_id == current_user.id,
-            FacebookAccount.ad_account_id == token_data.ad_account_id,
+        await db.execute(
+            select(FacebookAccount).where(
+                FacebookAccount.user_id == current_user.id,
+                FacebookAccount.ad_account_id == token_data.ad_account_id,
+            )
         )
-        .first()
-    )
+    ).scalar_one_or_none()
 
     if existing:
         # Update existing
@@ -247,8 +295,8 @@ def insert_system_user_token(
         existing.is_system_user = True
         existing.expires_at = None  # System user tokens don't expire
         existing.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(existing)
+        await db.commit()
+        await db.refresh(existing)
         return existing
 
     # Create new
@@ -261,50 +309,47 @@ def insert_system_user_token(
         is_system_user=True,
     )
     db.add(fb_account)
-    db.commit()
-    db.refresh(fb_account)
+    await db.commit()
+    await db.refresh(fb_account)
     return fb_account
 
 
 @router.get("/accounts", response_model=list[FacebookAccountResponse])
-def list_facebook_accounts(
+async def list_facebook_accounts(
+    request: Request,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """List all connected Facebook ad accounts for the current user."""
-    accounts = db.query(FacebookAccount).filter(FacebookAccount.user_id == current_user.id).all()
-    return accounts
-
-
-@router.post("/act/{ad_account_id}/fetch_insights", response_model=FetchInsightsResponse)
-def fetch_insights(
-    ad_account_id: str,
-    since: str = Query(..., description="Start date (YYYY-MM-DD)"),
-    until: str = Query(..., description="End date (YYYY-MM-DD)"),
-    level: str = Query("campaign", description="account, campaign, adset, or ad"),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    """List all connected Facebook ad accounts for the current user (with an ETag)."""
+    accounts = (await db.scalars(select(FacebookAccount).where(FacebookAccount.user_id == current_user.id))).all()
+    version = ",".join(f"{account.id}@{account.updated_at.isoformat()}" for account in accounts)
+    last_modified = max((account.updated_at for account in accounts), default=None)
+    key = cache_key("accounts", current_user.id, None, {}, version)
+    cached = await cached_response(request, key, last_modified)
+    if cached is not None:
+        return cached
+    return await store_response(key, [FacebookAccountResponse.model_validate(a) for a in accounts], last_modified)
+
+
+@router.get("/throttle/metrics")
+def get_throttle_metrics(
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_read_db),
 ):
     """
-    Fetch insights from Facebook Graph API and persist to database.
-    Handles pagination automatically.
+    Graph API throttler state for the app and the current user's ad accounts:
+    usage, current rates and blocks. Other users' accounts are left out.
     """
-    # Validate level
-    if level not in ["account", "campaign", "adset", "ad"]:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid level parameter")
+    ad_account_ids = db.scalars(select(FacebookAccount.ad_account_id).where(FacebookAccount.user_id == current_user_id))
+    return fb_client.throttler.metrics([APP_KEY] + [account_key(ad_account_id) for ad_account_id in ad_account_ids])
 
-    # Validate dates
-    try:
-        since_date = datetime.strptime(since, "%Y-%m-%d").date()
-        until_date = datetime.strptime(until, "%Y-%m-%d").date()
-    except ValueError:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid date format. Use YYYY-MM-DD")
 
-    # Get Facebook account
+def _get_account(db: Session, user_id: int, ad_account_id: str) -> FacebookAccount:
+    """Look up the user's ad account or raise 404."""
     fb_account = (
         db.query(FacebookAccount)
         .filter(
-            FacebookAccount.user_id == current_user.id,
+            FacebookAccount.user_id == user_id,
             FacebookAccount.ad_account_id == ad_account_id,
         )
         .first()
@@ -316,6 +361,18 @@ def fetch_insights(
             detail=f"Facebook account {ad_account_id} not found or not connected to your user",
         )
 
+    return fb_account
+
+
+async def _get_account_async(db: AsyncSession, user_id: int, ad_account_id: str) -> FacebookAccount:
+    """:func:`_get_account` for async sessions."""
+    return await db.run_sync(_get_account, user_id, ad_account_id)
+
+
+def _get_account_for_ingest(db: Session, user_id: int, ad_account_id: str) -> FacebookAccount:
+    """Look up the user's ad account and make sure its token can still be used."""
+    fb_account = _get_account(db, user_id, ad_account_id)
+
     # Check token expiration
     if fb_account.expires_at and fb_account.expires_at < datetime.utcnow():
         raise HTTPException(
@@ -323,183 +380,577 @@ def fetch_insights(
             detail="Access token expired. Please re-authorize the app.",
         )
 
-    # Define fields to fetch
-    fields = [
-        "date_start",
-        "date_stop",
-        "impressions",
-        "clicks",
-        "spend",
-        "actions",  # Contains conversions
-        "action_values",  # Contains revenue
-    ]
-
-    # Add level-specific ID field
-    if level == "campaign":
-        fields.append("campaign_id")
-        fields.append("campaign_name")
-    elif level == "adset":
-        fields.append("adset_id")
-        fields.append("adset_name")
-    elif level == "ad":
-        fields.append("ad_id")
-        fields.append("ad_name")
-    elif level == "account":
-        fields.append("account_id")
+    return fb_account
+
+
+async def _get_account_for_ingest_async(db: Session, user_id: int, ad_account_id: str) -> FacebookAccount:
+    """
+    :func:`_get_account_for_ingest` run in a worker thread, for async routes
+    holding a sync Session. The account is detached, so the commits of the
+    ingestion do not expire it and reading it never queries on the event loop.
+    """
+
+    def load() -> FacebookAccount:
+        fb_account = _get_account_for_ingest(db, user_id, ad_account_id)
+        db.expunge(fb_account)
+        return fb_account
 
+    return await asyncio.to_thread(load)
+
+
+def _parse_date_range(since: str, until: str) -> tuple[date, date]:
+    try:
+        since_date = datetime.strptime(since, "%Y-%m-%d").date()
+        until_date = datetime.strptime(until, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid date format. Use YYYY-MM-DD")
+
+    if since_date > until_date:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="since must be on or before until")
+
+    return since_date, until_date
+
+
+def _parse_optional_date(value: Optional[str], name: str) -> Optional[date]:
+    if not value:
+        return None
     try:
-        # Fetch all pages of insights
-        all_insights = fb_client.get_all_insights_pages(
-            ad_account_id=ad_account_id,
-            since=since,
-            until=until,
-            level=level,
-            fields=fields,
-            access_token=fb_account.access_token,
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid {name} date format")
+
+
+def _validate_ingest_params(level: str, mode: str, shard: Optional[str]) -> None:
+    if level not in INGEST_LEVELS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid level parameter")
+
+    if mode not in FETCH_MODES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid mode parameter")
+
+    if shard is not None:
+        try:
+            parse_shard_size(shard)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+def _raise_if_all_shards_failed(result) -> None:
+    if len(result.failed_shards) == result.shards_total:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to fetch insights: {result.failed_shards[0].error}",
         )
 
-        rows_ingested = 0
-        rows_skipped = 0
-
-        for insight in all_insights:
-            # Extract data
-            date_start = insight.get("date_start")
-            if not date_start:
-                rows_skipped += 1
-                continue
-
-            ts = datetime.strptime(date_start, "%Y-%m-%d").date()
-
-            # Determine entity_id based on level
-            if level == "campaign":
-                entity_id = insight.get("campaign_id", "unknown")
-            elif level == "adset":
-                entity_id = insight.get("adset_id", "unknown")
-            elif level == "ad":
-                entity_id = insight.get("ad_id", "unknown")
-            elif level == "account":
-                entity_id = insight.get("account_id", ad_account_id)
-            else:
-                entity_id = "unknown"
-
-            impressions = int(insight.get("impressions", 0))
-            clicks = int(insight.get("clicks", 0))
-            spend = float(insight.get("spend", 0.0))
-
-            # Extract conversions from actions array
-            conversions = 0
-            actions = insight.get("actions", [])
-            for action in actions:
-                if action.get("action_type") in ["purchase", "offsite_conversion.fb_pixel_purchase"]:
-                    conversions += int(action.get("value", 0))
-
-            # Extract revenue from action_values array
-            revenue = 0.0
-            action_values = insight.get("action_values", [])
-            for action_value in action_values:
-                if action_value.get("action_type") in ["purchase", "offsite_conversion.fb_pixel_purchase"]:
-                    revenue += float(action_value.get("value", 0.0))
-
-            # Store raw JSON
-            raw_json = json.dumps(insight)
-
-            # Create or update metric snapshot
-            try:
-                metric = MetricSnapshot(
-                    facebook_account_id=fb_account.id,
-                    ts=ts,
-                    level=level,
-                    entity_id=entity_id,
-                    impressions=impressions,
-                    clicks=clicks,
-                    spend=spend,
-                    conversions=conversions,
-                    revenue=revenue,
-                    raw=raw_json,
-                )
-                db.add(metric)
-                db.commit()
-                rows_ingested += 1
-            except IntegrityError:
-                # Duplicate entry - skip
-                db.rollback()
-                rows_skipped += 1
-                continue
-
-        return FetchInsightsResponse(
-            rows_ingested=rows_ingested,
-            rows_skipped=rows_skipped,
-            next_cursor=None,
-            status="success",
+
+def _ingest_response_fields(result) -> dict:
+    return dict(
+        rows_ingested=result.written,
+        rows_skipped=result.skipped + result.unchanged,
+        rows_inserted=result.inserted,
+        rows_updated=result.updated,
+        rows_unchanged=result.unchanged,
+        shards_total=result.shards_total,
+        failed_shards=[ShardFailureResponse(**vars(failure)) for failure in result.failed_shards],
+        next_cursor=None,
+        status="partial" if result.failed_shards else "success",
+    )
+
+
+@router.post("/act/{ad_account_id}/fetch_insights", response_model=FetchInsightsResponse)
+async def fetch_insights(
+    ad_account_id: str,
+    since: str = Query(..., description="Start date (YYYY-MM-DD)"),
+    until: str = Query(..., description="End date (YYYY-MM-DD)"),
+    level: str = Query(
+        "campaign", description="account, campaign, adset, ad, or all (ad level fetched once, the rest derived)"
+    ),
+    shard: Optional[str] = Query(None, description="Split the range into day, week, month or <N>d shards"),
+    mode: str = Query("auto", description="sync, async_job, or auto (async report job for large ranges)"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Fetch insights from Facebook Graph API and persist to database.
+    Handles pagination automatically, writing each page as it arrives.
+    With `shard`, the range is split and the shards are fetched concurrently;
+    failed shards are listed in the response so they can be retried alone.
+    Large ranges are pulled through Graph API async report jobs.
+    """
+    _validate_ingest_params(level, mode, shard)
+    since_date, until_date = _parse_date_range(since, until)
+    fb_account = await _get_account_for_ingest_async(db, current_user.id, ad_account_id)
+
+    try:
+        result = await ingest_range(db, fb_client, fb_account, since_date, until_date, level, shard=shard, mode=mode)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to fetch insights: {str(e)}",
         )
 
+    _raise_if_all_shards_failed(result)
+
+    return FetchInsightsResponse(**_ingest_response_fields(result))
+
+
+@router.post("/act/{ad_account_id}/sync", response_model=SyncInsightsResponse)
+async def sync_insights(
+    ad_account_id: str,
+    level: str = Query(
+        "campaign", description="account, campaign, adset, ad, or all (ad level fetched once, the rest derived)"
+    ),
+    lookback_days: int = Query(
+        DEFAULT_LOOKBACK_DAYS, ge=0, le=90, description="Days re-read behind the watermark for late attribution"
+    ),
+    initial_days: int = Query(
+        DEFAULT_INITIAL_DAYS, ge=1, le=1095, description="Days fetched when the account/level has never synced"
+    ),
+    shard: Optional[str] = Query(None, description="Split the range into day, week, month or <N>d shards"),
+    mode: str = Query("auto", description="sync, async_job, or auto (async report job for large ranges)"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Incrementally sync insights up to the last complete day (yesterday, UTC).
+
+    Only the days after the stored watermark, plus `lookback_days` before it,
+    are fetched and upserted. The watermark then advances to the last day
+    that was ingested without shard failures.
+    """
+    _validate_ingest_params(level, mode, shard)
+    fb_account = await _get_account_for_ingest_async(db, current_user.id, ad_account_id)
+
+    try:
+        outcome = await sync_account(
+            db, fb_client, fb_account, level, lookback_days, initial_days, shard=shard, mode=mode
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to fetch insights: {str(e)}",
         )
 
+    if outcome.result is None:
+        return SyncInsightsResponse(
+            rows_ingested=0, rows_skipped=0, shards_total=0, status="up_to_date", watermark=outcome.watermark
+        )
+
+    _raise_if_all_shards_failed(outcome.result)
+    return SyncInsightsResponse(
+        **_ingest_response_fields(outcome.result),
+        since=outcome.since,
+        until=outcome.until,
+        watermark=outcome.watermark,
+    )
+
+
+def _encode_cursor(ts: date, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{ts.isoformat()}|{row_id}".encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[date, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, row_id = raw.split("|")
+        return date.fromisoformat(ts), int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
 
 @router.get("/act/{ad_account_id}/insights_from_db", response_model=MetricSnapshotListResponse)
-def get_insights_from_db(
+async def get_insights_from_db(
     ad_account_id: str,
+    request: Request,
     limit: int = Query(50, ge=1, le=1000),
-    page: int = Query(1, ge=1),
+    page: int = Query(1, ge=1, description="Deprecated OFFSET paging; use cursor"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    total: str = Query("auto", description="exact, estimate (from rollups), none, or auto (exact on the first page)"),
     level: Optional[str] = Query(None, description="Filter by level: account, campaign, adset, ad"),
     since: Optional[str] = Query(None, description="Filter from date (YYYY-MM-DD)"),
     until: Optional[str] = Query(None, description="Filter to date (YYYY-MM-DD)"),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
     """
-    Retrieve persisted insights from database with pagination.
+    Retrieve persisted insights from database, newest first.
+    Pass the returned `next_cursor` as `cursor` to get the next page; cursor
+    pages seek on (ts, id) so deep pages cost the same as the first one.
     Computed metrics (CTR, ROAS) are calculated in the response.
-    """
-    # Get Facebook account
-    fb_account = (
-        db.query(FacebookAccount)
-        .filter(
-            FacebookAccount.user_id == current_user.id,
-            FacebookAccount.ad_account_id == ad_account_id,
-        )
-        .first()
-    )
 
-    if not fb_account:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Facebook account {ad_account_id} not found or not connected to your user",
-        )
+    Responses carry an ETag that changes with the account's data; a request
+    with a matching `If-None-Match` gets `304 Not Modified` without querying
+    the snapshots (see app/response_cache.py).
+
+    `archived_before` is set when the range overlaps archived months: rows
+    before that day are only read by the export with `include_archived`.
+    """
+    if total not in TOTAL_MODES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid total parameter")
+    since_date = _parse_optional_date(since, "since")
+    until_date = _parse_optional_date(until, "until")
+    fb_account = await _get_account_async(db, current_user.id, ad_account_id)
+
+    params = {
+        "limit": limit,
+        "page": page,
+        "cursor": cursor,
+        "total": total,
+        "level": level,
+        "since": since_date,
+        "until": until_date,
+    }
+    key = cache_key("insights_from_db", current_user.id, fb_account.id, params, data_version(fb_account))
+    cached = await cached_response(request, key, data_last_modified(fb_account))
+    if cached is not None:
+        return cached
 
     # Build query
-    query = db.query(MetricSnapshot).filter(MetricSnapshot.facebook_account_id == fb_account.id)
+    query = select(MetricSnapshot).where(MetricSnapshot.facebook_account_id == fb_account.id)
 
     # Apply filters
     if level:
-        query = query.filter(MetricSnapshot.level == level)
+        query = query.where(MetricSnapshot.level == level)
+    if since_date:
+        query = query.where(MetricSnapshot.ts >= since_date)
+    if until_date:
+        query = query.where(MetricSnapshot.ts <= until_date)
+
+    first_page = cursor is None and page == 1
+    if total == "exact" or (total == "auto" and first_page):
+        total_count = await db.scalar(select(func.count()).select_from(query.subquery()))
+    elif total == "estimate":
+        total_count = await db.run_sync(snapshot_count, fb_account.id, level, since_date, until_date)
+    else:
+        total_count = None
+
+    query = query.order_by(MetricSnapshot.ts.desc(), MetricSnapshot.id.desc())
+    if cursor is not None:
+        query = query.where(tuple_(MetricSnapshot.ts, MetricSnapshot.id) < tuple_(*_decode_cursor(cursor)))
+    elif page > 1:
+        query = query.offset((page - 1) * limit)
+
+    # One extra row tells whether there is a next page
+    metrics = (await db.scalars(query.limit(limit + 1))).all()
+    next_cursor = None
+    if len(metrics) > limit:
+        metrics = metrics[:limit]
+        next_cursor = _encode_cursor(metrics[-1].ts, metrics[-1].id)
 
-    if since:
-        try:
-            since_date = datetime.strptime(since, "%Y-%m-%d").date()
-            query = query.filter(MetricSnapshot.ts >= since_date)
-        except ValueError:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid since date format")
+    # Convert to response with computed fields
+    items = [MetricSnapshotResponse.from_orm_with_computed(metric) for metric in metrics]
+
+    response = MetricSnapshotListResponse(
+        items=items,
+        total=total_count,
+        total_is_estimate=total == "estimate",
+        page=page,
+        limit=limit,
+        next_cursor=next_cursor,
+        archived_before=await db.run_sync(archived_before, fb_account.id, [(since_date, until_date)]),
+    )
+    return await store_response(key, response, data_last_modified(fb_account))
+
+
+@router.get(
+    "/act/{ad_account_id}/analytics",
+    response_class=Response,
+    responses={200: {"model": AnalyticsColumnsResponse}},
+)
+def get_insights_analytics(
+    ad_account_id: str,
+    fields: Optional[str] = Query(None, description="Comma separated columns, e.g. ts,entity_id,spend,ctr,roas"),
+    level: Optional[str] = Query(None, description="Filter by level: account, campaign, adset, ad"),
+    since: Optional[str] = Query(None, description="Filter from date (YYYY-MM-DD)"),
+    until: Optional[str] = Query(None, description="Filter to date (YYYY-MM-DD)"),
+    limit: int = Query(100_000, ge=1, le=MAX_ANALYTICS_ROWS),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Persisted insights as column arrays (`{"columns": {"ts": [...], "spend": [...]}}`),
+    ordered by date. Only the requested `fields` are read; CTR and ROAS are
+    computed in the SQL projection and rows are never loaded as ORM objects.
+    `archived_before` is set when the range overlaps archived months.
+    """
+    try:
+        field_names = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if level and level not in LEVELS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid level parameter")
+    since_date = _parse_optional_date(since, "since")
+    until_date = _parse_optional_date(until, "until")
+    fb_account = _get_account(db, current_user.id, ad_account_id)
+
+    columns = fetch_columns(db, fb_account.id, field_names, level, since_date, until_date, limit)
+    archived = archived_before(db, fb_account.id, [(since_date, until_date)])
+    payload = {
+        "fields": field_names,
+        "row_count": len(columns[field_names[0]]),
+        "columns": columns,
+        "archived_before": archived.isoformat() if archived else None,
+    }
+    # Encoded directly: running 100k-row arrays through the response model
+    # validation would cost more than the query itself
+    return Response(content=json.dumps(payload, separators=(",", ":")), media_type="application/json")
+
+
+@router.get("/act/{ad_account_id}/export", response_class=StreamingResponse)
+def export_insights(
+    ad_account_id: str,
+    format: str = Query("ndjson", description="ndjson or csv"),
+    level: Optional[str] = Query(None, description="Filter by level: account, campaign, adset, ad"),
+    since: Optional[str] = Query(None, description="Filter from date (YYYY-MM-DD)"),
+    until: Optional[str] = Query(None, description="Filter to date (YYYY-MM-DD)"),
+    include_raw: bool = Query(False, description="Include the raw Graph API JSON of each row"),
+    gzip: bool = Query(False, description="Gzip the export (.gz download)"),
+    include_archived: bool = Query(False, description="Also include rows of archived months"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Stream all matching snapshots, oldest first, as NDJSON or CSV.
+    Rows are read through a server-side cursor in batches, so memory use does
+    not grow with the size of the export.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid format parameter")
+    if level and level not in LEVELS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid level parameter")
+    since_date = _parse_optional_date(since, "since")
+    until_date = _parse_optional_date(until, "until")
+    fb_account = _get_account(db, current_user.id, ad_account_id)
+
+    filename = f"{ad_account_id}_insights.{format}" + (".gz" if gzip else "")
+    body = iter_export(
+        db.get_bind(),
+        fb_account.id,
+        fmt=format,
+        level=level,
+        since=since_date,
+        until=until_date,
+        include_raw=include_raw,
+        compress=gzip,
+        include_archived=include_archived,
+    )
+    return StreamingResponse(
+        body,
+        media_type="application/gzip" if gzip else EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-    if until:
-        try:
-            until_date = datetime.strptime(until, "%Y-%m-%d").date()
-            query = query.filter(MetricSnapshot.ts <= until_date)
-        except ValueError:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid until date format")
 
-    # Get total count
-    total = query.count()
+@router.get("/act/{ad_account_id}/summary", response_model=RollupSummaryResponse)
+async def get_insights_summary(
+    ad_account_id: str,
+    since: str = Query(..., description="Start date (YYYY-MM-DD)"),
+    until: str = Query(..., description="End date (YYYY-MM-DD)"),
+    level: str = Query("campaign", description="Level whose ingested data is summed: account, campaign, adset, ad"),
+    grain: str = Query("day", description="Series granularity: day, week, or month"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """
+    Account totals (with CTR and ROAS) and a time series, served from the
+    pre-aggregated rollups instead of the raw snapshots.
+    """
+    if level not in LEVELS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid level parameter")
+    if grain not in GRAINS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid grain parameter")
+    since_date, until_date = _parse_date_range(since, until)
+    fb_account = await _get_account_async(db, current_user.id, ad_account_id)
+
+    return RollupSummaryResponse(
+        level=level,
+        since=since_date,
+        until=until_date,
+        grain=grain,
+        totals=await db.run_sync(account_totals, fb_account.id, level, since_date, until_date),
+        series=await db.run_sync(account_series, fb_account.id, level, since_date, until_date, grain),
+    )
 
-    # Paginate
-    offset = (page - 1) * limit
-    metrics = query.order_by(MetricSnapshot.ts.desc()).offset(offset).limit(limit).all()
 
-    # Convert to response with computed fields
-    items = [MetricSnapshotResponse.from_orm_with_computed(metric) for metric in metrics]
+@router.get("/act/{ad_account_id}/summary/entities", response_model=EntityTotalsResponse)
+async def get_entity_summary(
+    ad_account_id: str,
+    since: str = Query(..., description="Start date (YYYY-MM-DD)"),
+    until: str = Query(..., description="End date (YYYY-MM-DD)"),
+    level: str = Query("campaign", description="campaign, adset, or ad"),
+    order_by: str = Query("spend", description="impressions, clicks, spend, conversions, revenue, ctr, or roas"),
+    limit: int = Query(50, ge=1, le=1000),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """
+    Per-entity totals over a date range, largest first. Whole weeks and
+    months come from the rollups; only edge days read raw snapshots, so
+    `archived_before` is set when an edge day falls in an archived month.
+    """
+    if level not in LEVELS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid level parameter")
+    if order_by not in ORDER_COLUMNS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid order_by parameter")
+    since_date, until_date = _parse_date_range(since, until)
+    fb_account = await _get_account_async(db, current_user.id, ad_account_id)
+    items = await db.run_sync(
+        entity_totals, fb_account.id, level, since_date, until_date, order_by=order_by, limit=limit
+    )
+
+    return EntityTotalsResponse(
+        level=level,
+        since=since_date,
+        until=until_date,
+        order_by=order_by,
+        items=items,
+        archived_before=await db.run_sync(archived_before, fb_account.id, cover_range(since_date, until_date)[2]),
+    )
+
+
+@router.get("/act/{ad_account_id}/summary/hierarchy", response_model=HierarchyTotalsResponse)
+async def get_hierarchy_summary(
+    ad_account_id: str,
+    since: str = Query(..., description="Start date (YYYY-MM-DD)"),
+    until: str = Query(..., description="End date (YYYY-MM-DD)"),
+    level: str = Query("ad", description="Level whose ingested data is summed: adset or ad"),
+    group_by: str = Query("campaign", description="Ancestor level to sum up to: adset (from ad) or campaign"),
+    campaign_id: Optional[str] = Query(None, description="Only entities of this campaign"),
+    order_by: str = Query("spend", description="impressions, clicks, spend, conversions, revenue, ctr, or roas"),
+    limit: int = Query(50, ge=1, le=1000),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """
+    Totals rolled up the ad -> adset -> campaign hierarchy with names, e.g.
+    campaign totals from ad-level data or the adsets of one campaign.
+    Like the entity summary, `archived_before` flags archived edge days.
+    """
+    if group_by not in HIERARCHY_GROUPS.get(level, []):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid level or group_by parameter")
+    if order_by not in ORDER_COLUMNS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid order_by parameter")
+    since_date, until_date = _parse_date_range(since, until)
+    fb_account = await _get_account_async(db, current_user.id, ad_account_id)
+    items = await db.run_sync(
+        hierarchy_totals,
+        fb_account.id,
+        level,
+        group_by,
+        since_date,
+        until_date,
+        campaign_id=campaign_id,
+        order_by=order_by,
+        limit=limit,
+    )
+
+    return HierarchyTotalsResponse(
+        level=level,
+        group_by=group_by,
+        campaign_id=campaign_id,
+        since=since_date,
+        until=until_date,
+        order_by=order_by,
+        items=items,
+        archived_before=await db.run_sync(archived_before, fb_account.id, cover_range(since_date, until_date)[2]),
+    )
+
+
+@router.get("/act/{ad_account_id}/entities", response_model=EntityListResponse)
+async def get_entities(
+    ad_account_id: str,
+    level: str = Query("campaign", description="campaign, adset, or ad"),
+    parent_id: Optional[str] = Query(None, description="Only children of this campaign (adsets) or adset (ads)"),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """Campaigns, adsets or ads seen in ingested insights (or a refresh), with names and parents."""
+    if level not in ENTITY_LEVELS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid level parameter")
+    fb_account = await _get_account_async(db, current_user.id, ad_account_id)
+    items = await db.run_sync(list_entities, fb_account.id, level, parent_id, limit)
+    return EntityListResponse(level=level, parent_id=parent_id, items=items)
+
+
+@router.post("/act/{ad_account_id}/entities/refresh", response_model=EntityRefreshResponse)
+async def refresh_account_entities(
+    ad_account_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Read every campaign, adset and ad of the account from the Graph API,
+    including their delivery status and those without insights yet.
+    """
+    fb_account = await _get_account_for_ingest_async(db, current_user.id, ad_account_id)
+    try:
+        counts = await refresh_entities(db, fb_client, fb_account)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to refresh entities: {str(e)}",
+        )
+    return EntityRefreshResponse(ad_account_id=ad_account_id, entities=counts)
+
+
+@router.get("/act/{ad_account_id}/actions", response_model=ActionTotalsResponse)
+async def get_action_totals(
+    ad_account_id: str,
+    level: str = Query("campaign", description="Level whose ingested data is summed: account, campaign, adset, ad"),
+    since: Optional[str] = Query(None, description="Filter from date (YYYY-MM-DD)"),
+    until: Optional[str] = Query(None, description="Filter to date (YYYY-MM-DD)"),
+    action_types: Optional[str] = Query(None, description="Comma separated action types, e.g. add_to_cart,purchase"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """
+    Count and value per action type (funnel steps, pixel events), summed in
+    SQL from the stored breakdowns instead of re-parsing raw JSON.
+    `archived_before` is set when the range overlaps archived months.
+    """
+    if level not in LEVELS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid level parameter")
+    since_date = _parse_optional_date(since, "since")
+    until_date = _parse_optional_date(until, "until")
+    fb_account = await _get_account_async(db, current_user.id, ad_account_id)
+    types = [name.strip() for name in action_types.split(",") if name.strip()] if action_types else None
+
+    return ActionTotalsResponse(
+        level=level,
+        since=since_date,
+        until=until_date,
+        actions=await db.run_sync(action_totals, fb_account.id, level, since_date, until_date, types),
+        archived_before=await db.run_sync(archived_before, fb_account.id, [(since_date, until_date)]),
+    )
+
+
+@router.get("/act/{ad_account_id}/conversion_actions", response_model=ConversionActionTypesResponse)
+async def get_conversion_actions(
+    ad_account_id: str,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Action types counted as conversions and revenue for this account."""
+    fb_account = await _get_account_async(db, current_user.id, ad_account_id)
+    return ConversionActionTypesResponse(action_types=await db.run_sync(account_conversion_types, fb_account.id))
+
+
+@router.put("/act/{ad_account_id}/conversion_actions", response_model=ConversionActionTypesResponse)
+def update_conversion_actions(
+    ad_account_id: str,
+    request: ConversionActionTypesRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Change the action types counted as conversions and revenue. Stored
+    snapshots are recomputed from their action breakdowns, and the rollups
+    rebuilt, so history reflects the new definition.
+    """
+    fb_account = _get_account(db, current_user.id, ad_account_id)
+    action_types = list(dict.fromkeys(name.strip() for name in request.action_types if name.strip()))
+    if not action_types:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="action_types must not be empty")
 
-    return MetricSnapshotListResponse(items=items, total=total, page=page, limit=limit)
\ No newline at end of file
+    updated = set_conversion_action_types(db, fb_account, action_types)
+    return ConversionActionTypesResponse(action_types=action_types, snapshots_updated=updated)
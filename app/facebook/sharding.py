@@ -0,0 +1,187 @@
+"""
+Date-range sharding of insights fetches.
+
+A ``since..until`` window is split into shards (days, weeks, months or N-day
+blocks) that are fetched concurrently under a per-account concurrency cap.
+All shards feed one writer, so every page still goes through the same
+idempotent upsert path; a failed shard is retried on its own and reported
+back without discarding the others.
+
+With ``level="all"`` each shard attempt sums its ad rows into the derived
+levels and queues them once the shard's last page is in: a shard covers
+whole days, so the sums are complete, and a failed attempt's partial sums
+are dropped.
+"""
+import asyncio
+import re
+import weakref
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.facebook.actions import account_conversion_types
+from app.facebook.ingest import (
+    ALL_LEVELS,
+    IngestResult,
+    LevelAggregator,
+    ProgressCallback,
+    ingest_insight_pages_async,
+)
+
+# Concurrent shard fetches allowed per ad account, across all requests.
+SHARD_CONCURRENCY_PER_ACCOUNT = 4
+
+# Attempts per shard before it is reported as failed.
+SHARD_MAX_ATTEMPTS = 2
+
+SHARD_RETRY_DELAY = 2.0
+
+SHARD_SIZES = ("day", "week", "month")
+
+DateRange = Tuple[date, date]
+PageFetcher = Callable[[date, date], AsyncIterator[List[Dict[str, Any]]]]
+
+# Semaphores are bound to an event loop, so keep one registry per loop.
+_account_semaphores: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+@dataclass
+class ShardFailure:
+    since: date
+    until: date
+    error: str
+
+
+@dataclass
+class ShardedIngestResult(IngestResult):
+    shards_total: int = 0
+    failed_shards: List[ShardFailure] = field(default_factory=list)
+
+
+def parse_shard_size(shard: str) -> str:
+    """Validate a shard size: ``day``, ``week``, ``month`` or ``<N>d``."""
+    if shard in SHARD_SIZES or re.fullmatch(r"[1-9]\d*d", shard):
+        return shard
+    raise ValueError(f"Invalid shard size {shard!r}. Use day, week, month or <N>d")
+
+
+def split_date_range(since: date, until: date, shard: Optional[str] = None) -> List[DateRange]:
+    """
+    Split an inclusive date range into consecutive inclusive shards.
+
+    ``week`` shards end on Sundays and ``month`` shards on the last day of the
+    month, so boundaries are stable across calls with different ranges.
+    """
+    if since > until:
+        return []
+    if shard is None:
+        return [(since, until)]
+
+    shard = parse_shard_size(shard)
+    shards = []
+    start = since
+    while start <= until:
+        if shard == "day":
+            end = start
+        elif shard == "week":
+            end = start + timedelta(days=6 - start.weekday())
+        elif shard == "month":
+            next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+            end = next_month - timedelta(days=1)
+        else:
+            end = start + timedelta(days=int(shard[:-1]) - 1)
+        end = min(end, until)
+        shards.append((start, end))
+        start = end + timedelta(days=1)
+    return shards
+
+
+def account_semaphore(ad_account_id: str, limit: int = SHARD_CONCURRENCY_PER_ACCOUNT) -> asyncio.Semaphore:
+    """Shared per-account semaphore for the running event loop."""
+    loop = asyncio.get_running_loop()
+    semaphores = _account_semaphores.setdefault(loop, {})
+    if ad_account_id not in semaphores:
+        semaphores[ad_account_id] = asyncio.Semaphore(limit)
+    return semaphores[ad_account_id]
+
+
+async def ingest_sharded(
+    db: Session,
+    facebook_account_id: int,
+    ad_account_id: str,
+    level: str,
+    shards: List[DateRange],
+    fetch_pages: PageFetcher,
+    max_attempts: int = SHARD_MAX_ATTEMPTS,
+    retry_delay: float = SHARD_RETRY_DELAY,
+    on_progress: Optional[ProgressCallback] = None,
+) -> ShardedIngestResult:
+    """
+    Fetch every shard concurrently and upsert all pages through one writer.
+
+    ``fetch_pages(since, until)`` returns an async iterator of insight pages
+    for one shard. A shard that fails is retried from its first page (the
+    upsert is idempotent) and, after ``max_attempts``, recorded in
+    ``failed_shards``.
+    """
+    semaphore = account_semaphore(ad_account_id)
+    merged: asyncio.Queue = asyncio.Queue(maxsize=2 * SHARD_CONCURRENCY_PER_ACCOUNT)
+    failures: List[ShardFailure] = []
+    done = object()
+    conversion_types = None
+    if level == ALL_LEVELS:
+        conversion_types = await asyncio.to_thread(account_conversion_types, db, facebook_account_id)
+
+    async def run_shard(since: date, until: date):
+        async with semaphore:
+            for attempt in range(max_attempts):
+                aggregator = LevelAggregator(ad_account_id, conversion_types) if conversion_types is not None else None
+                try:
+                    async for page in fetch_pages(since, until):
+                        if aggregator:
+                            for insight in page:
+                                aggregator.add(insight)
+                        await merged.put(page)
+                    if aggregator:
+                        await merged.put(aggregator.rows())
+                    return
+                except Exception as e:
+                    if attempt < max_attempts - 1:
+                        await asyncio.sleep(retry_delay * (attempt + 1))
+                    else:
+                        failures.append(ShardFailure(since=since, until=until, error=str(e)))
+
+    async def run_all():
+        await asyncio.gather(*(run_shard(since, until) for since, until in shards))
+        await merged.put(done)
+
+    async def merged_pages():
+        while True:
+            page = await merged.get()
+            if page is done:
+                return
+            yield page
+
+    producers = asyncio.create_task(run_all())
+    try:
+        written = await ingest_insight_pages_async(
+            db,
+            facebook_account_id=facebook_account_id,
+            ad_account_id=ad_account_id,
+            level=level,
+            pages=merged_pages(),
+            on_progress=on_progress,
+        )
+    finally:
+        if not producers.done():
+            producers.cancel()
+        try:
+            await producers
+        except asyncio.CancelledError:
+            pass
+
+    result = ShardedIngestResult(shards_total=len(shards), failed_shards=failures)
+    result.add(written)
+    return result
@@ -0,0 +1,281 @@
+"""
+Rate-limit aware throttling for Graph API calls.
+
+Meta reports how close we are to its limits in the ``X-App-Usage``,
+``X-Ad-Account-Usage`` and ``X-Business-Use-Case-Usage`` response headers.
+UsageThrottler keeps one token bucket per app and per ad account, slows
+each bucket down as the reported usage climbs, and blocks a key entirely
+while Meta says access is suspended. State lives behind a threading.Lock so
+the sync client's threads and the async client's tasks share it.
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set
+
+APP_KEY = "app"
+
+# Longest a caller is put to sleep; beyond this ThrottledError is raised so
+# the caller can give up and retry the work later instead of holding on.
+MAX_THROTTLE_WAIT = 300.0
+
+# Graph API error codes that signal throttling (returned with HTTP 400/403)
+RATE_LIMIT_ERROR_CODES = {4, 17, 32, 613, *range(80000, 80015)}
+
+_AD_ACCOUNT_RE = re.compile(r"/(act_\d+)(?:/|$)")
+
+
+class ThrottledError(Exception):
+    """Meta has blocked access for longer than we are willing to wait."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Graph API access throttled, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def account_key(ad_account_id: str) -> str:
+    return f"account:{ad_account_id}"
+
+
+def keys_for_url(url: str) -> List[str]:
+    """Throttle keys a request to ``url`` counts against."""
+    match = _AD_ACCOUNT_RE.search(url)
+    if match:
+        return [APP_KEY, account_key(match.group(1))]
+    return [APP_KEY]
+
+
+def _parse_header(headers: Mapping[str, str], name: str) -> Optional[Any]:
+    value = headers.get(name)
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+def is_rate_limited(status_code: int, body: Any) -> bool:
+    """True for 429s and Graph API throttling errors."""
+    if status_code == 429:
+        return True
+    if status_code in (400, 403) and isinstance(body, dict):
+        code = body.get("error", {}).get("code")
+        return code in RATE_LIMIT_ERROR_CODES
+    return False
+
+
+class TokenBucket:
+    """Token bucket whose refill rate can be scaled down at runtime."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """Take one token, returning how long the caller must wait for it."""
+        self._refill(now)
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class UsageThrottler:
+    """
+    Per-app and per-ad-account throttle driven by Meta's usage headers.
+
+    Below ``slowdown_at`` percent usage a key runs at ``rate`` requests per
+    second. Above it the refill rate falls linearly towards
+    ``min_rate_factor * rate`` at 100%. When a header reports
+    ``estimated_time_to_regain_access`` (or a 100% ad account utilisation
+    with ``reset_time_duration``) the key is blocked until then.
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: float = 20.0,
+        slowdown_at: float = 75.0,
+        min_rate_factor: float = 0.05,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.slowdown_at = slowdown_at
+        self.min_rate_factor = min_rate_factor
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._usage: Dict[str, float] = {}
+        self._blocked_until: Dict[str, float] = {}
+        self._business_usage: Dict[str, Any] = {}
+        self._business_keys: Dict[str, Set[str]] = {}  # business id -> account keys that reported it
+        self._counters = {"requests": 0, "throttled": 0, "throttle_wait_seconds": 0.0, "rate_limited": 0}
+
+    def _bucket(self, key: str) -> TokenBucket:
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(self.rate, self.burst)
+        return self._buckets[key]
+
+    # ---- acquiring ----
+
+    def reserve(self, keys: List[str], max_wait: float = MAX_THROTTLE_WAIT) -> float:
+        """
+        Reserve a request slot on every key; returns the delay to honor.
+
+        Raises ThrottledError without reserving when a key is blocked for
+        longer than ``max_wait``.
+        """
+        with self._lock:
+            now = time.monotonic()
+            blocked = max([self._blocked_until.get(key, 0.0) - now for key in keys] + [0.0])
+            if blocked > max_wait:
+                raise ThrottledError(blocked)
+            delay = blocked
+            for key in keys:
+                delay = max(delay, self._bucket(key).reserve(now))
+            self._counters["requests"] += 1
+            if delay > 0:
+                self._counters["throttled"] += 1
+                self._counters["throttle_wait_seconds"] += delay
+            return delay
+
+    def acquire(self, keys: List[str]) -> None:
+        delay = self.reserve(keys)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, keys: List[str]) -> None:
+        delay = self.reserve(keys)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    # ---- observing ----
+
+    def _set_usage(self, key: str, usage: float) -> None:
+        self._usage[key] = usage
+        bucket = self._bucket(key)
+        if usage <= self.slowdown_at:
+            factor = 1.0
+        else:
+            headroom = max(0.0, 100.0 - usage) / (100.0 - self.slowdown_at)
+            factor = max(self.min_rate_factor, headroom)
+        bucket.rate = bucket.base_rate * factor
+
+    def _block(self, key: str, seconds: float, now: float) -> None:
+        if seconds > 0:
+            self._blocked_until[key] = max(self._blocked_until.get(key, 0.0), now + seconds)
+
+    def observe(self, keys: List[str], headers: Mapping[str, str]) -> None:
+        """Update usage and blocks from a response's usage headers."""
+        app_usage = _parse_header(headers, "x-app-usage")
+        account_usage = _parse_header(headers, "x-ad-account-usage")
+        business_usage = _parse_header(headers, "x-business-use-case-usage")
+        if not (app_usage or account_usage or business_usage):
+            return
+
+        account_pct = None
+        block_seconds = 0.0
+
+        if isinstance(account_usage, dict):
+            account_pct = float(account_usage.get("acc_id_util_pct", 0))
+            if account_pct >= 100:
+                block_seconds = float(account_usage.get("reset_time_duration", 0))
+
+        with self._lock:
+            if isinstance(business_usage, dict):
+                for business_id, entries in business_usage.items():
+                    self._business_usage[business_id] = entries
+                    self._business_keys.setdefault(business_id, set()).update(k for k in keys if k != APP_KEY)
+                    for entry in entries:
+                        pct = max(float(entry.get(f, 0)) for f in ("call_count", "total_cputime", "total_time"))
+                        account_pct = max(account_pct or 0.0, pct)
+                        regain_minutes = float(entry.get("estimated_time_to_regain_access", 0))
+                        block_seconds = max(block_seconds, regain_minutes * 60)
+
+            if isinstance(app_usage, dict):
+                values = [float(v) for v in app_usage.values() if isinstance(v, (int, float))]
+                self._set_usage(APP_KEY, max(values, default=0.0))
+
+            now = time.monotonic()
+            for key in keys:
+                if key == APP_KEY:
+                    continue
+                if account_pct is not None:
+                    self._set_usage(key, account_pct)
+                self._block(key, block_seconds, now)
+
+    def record_rate_limited(self) -> None:
+        with self._lock:
+            self._counters["rate_limited"] += 1
+
+    # ---- retries ----
+
+    def blocked_for(self, keys: List[str]) -> float:
+        """Seconds until every key in ``keys`` is unblocked."""
+        with self._lock:
+            now = time.monotonic()
+            return max([self._blocked_until.get(key, 0.0) - now for key in keys] + [0.0])
+
+    def retry_delay(
+        self, keys: List[str], attempt: int, factor: float = 2.0, cap: float = 60.0, max_wait: float = MAX_THROTTLE_WAIT
+    ) -> float:
+        """
+        Full-jitter backoff (uniform over ``0..factor ** attempt``), never
+        shorter than an announced access block.
+        """
+        blocked = self.blocked_for(keys)
+        if blocked > max_wait:
+            raise ThrottledError(blocked)
+        return max(random.uniform(0, min(cap, factor ** attempt)), blocked)
+
+    # ---- metrics ----
+
+    def metrics(self, keys: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Counters and per-key state. With ``keys``, only those keys and the
+        business use cases reported on responses for them are included.
+        """
+        with self._lock:
+            now = time.monotonic()
+            visible = set(self._buckets) if keys is None else set(keys)
+            return {
+                **self._counters,
+                "keys": {
+                    key: {
+                        "usage_pct": self._usage.get(key, 0.0),
+                        "rate_per_sec": round(bucket.rate, 3),
+                        "blocked_for_seconds": round(max(0.0, self._blocked_until.get(key, 0.0) - now), 1),
+                    }
+                    for key, bucket in self._buckets.items()
+                    if key in visible
+                },
+                "business_use_case_usage": {
+                    business_id: entries
+                    for business_id, entries in self._business_usage.items()
+                    if keys is None or self._business_keys.get(business_id, set()) & visible
+                },
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+            self._usage.clear()
+            self._blocked_until.clear()
+            self._business_usage.clear()
+            self._business_keys.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+
+
+# Shared by every client in the process
+throttler = UsageThrottler()
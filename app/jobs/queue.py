@@ -0,0 +1,168 @@
+"""
+Persisted ingestion job queue.
+
+Jobs live in the ``ingestion_jobs`` table, so any number of worker threads
+or processes sharing the database can claim them. Claiming is a
+conditional UPDATE (``... WHERE id = ? AND status = 'queued'``), which is
+atomic on both SQLite and PostgreSQL without row locks.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models import IngestionJob
+
+JOB_KINDS = ["fetch_insights", "sync", "csv_upload"]
+
+ACTIVE_STATUSES = ("queued", "running")
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+def dedup_key(facebook_account_id: int, kind: str, params: Dict[str, Any]) -> str:
+    """Identical account/kind/params share one active job."""
+    canonical = json.dumps({"account": facebook_account_id, "kind": kind, **params}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def find_active_job(db: Session, key: str) -> Optional[IngestionJob]:
+    return (
+        db.query(IngestionJob)
+        .filter(IngestionJob.dedup_key == key, IngestionJob.status.in_(ACTIVE_STATUSES))
+        .first()
+    )
+
+
+def enqueue_job(
+    db: Session, user_id: int, facebook_account_id: int, kind: str, params: Dict[str, Any]
+) -> Tuple[IngestionJob, bool]:
+    """
+    Queue a job, or return the active job with the same dedup key.
+
+    Returns ``(job, created)``. The partial unique index on active dedup keys
+    resolves races between concurrent enqueues.
+    """
+    key = dedup_key(facebook_account_id, kind, params)
+    existing = find_active_job(db, key)
+    if existing:
+        return existing, False
+
+    job = IngestionJob(
+        user_id=user_id,
+        facebook_account_id=facebook_account_id,
+        kind=kind,
+        params=json.dumps(params, default=str),
+        dedup_key=key,
+        status="queued",
+    )
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        existing = find_active_job(db, key)
+        if existing:
+            return existing, False
+        raise
+    db.refresh(job)
+    return job, True
+
+
+def claim_next_job(db: Session, worker_id: str) -> Optional[IngestionJob]:
+    """Atomically move the oldest queued job to running and return it."""
+    while True:
+        job_id = db.execute(
+            select(IngestionJob.id).where(IngestionJob.status == "queued").order_by(IngestionJob.id).limit(1)
+        ).scalar()
+        if job_id is None:
+            db.rollback()
+            return None
+
+        now = datetime.utcnow()
+        claimed = db.execute(
+            update(IngestionJob)
+            .where(IngestionJob.id == job_id, IngestionJob.status == "queued")
+            .values(
+                status="running",
+                worker_id=worker_id,
+                started_at=now,
+                heartbeat_at=now,
+                attempts=func.coalesce(IngestionJob.attempts, 0) + 1,
+            )
+        ).rowcount
+        db.commit()
+        if claimed:
+            return db.get(IngestionJob, job_id)
+        # Another worker won the race; try the next one
+
+
+def discard_upload(job: Optional[IngestionJob]) -> None:
+    """Delete the stored file of a finished csv_upload job."""
+    if job is None or job.kind != "csv_upload":
+        return
+    path = json.loads(job.params).get("path")
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def request_cancel(db: Session, job: IngestionJob) -> IngestionJob:
+    """Cancel a queued job immediately, or flag a running one to stop."""
+    cancelled = 0
+    if job.status == "queued":
+        cancelled = db.execute(
+            update(IngestionJob)
+            .where(IngestionJob.id == job.id, IngestionJob.status == "queued")
+            .values(status="cancelled", cancel_requested=True, finished_at=datetime.utcnow())
+        ).rowcount
+        if not cancelled:  # picked up in the meantime
+            job.cancel_requested = True
+    elif job.status == "running":
+        job.cancel_requested = True
+    db.commit()
+    db.refresh(job)
+    if cancelled:
+        discard_upload(job)  # no worker will read it
+    return job
+
+
+def requeue_stale_jobs(db: Session, stale_after: timedelta, max_attempts: int) -> int:
+    """
+    Put running jobs whose worker stopped heartbeating back in the queue.
+
+    A job that already ran ``max_attempts`` times is marked failed instead,
+    so a job that crashes its worker is not retried forever. Returns the
+    number of jobs requeued.
+    """
+    now = datetime.utcnow()
+    stale = (IngestionJob.status == "running", IngestionJob.heartbeat_at < now - stale_after)
+    exhausted = db.scalars(
+        select(IngestionJob).where(*stale, func.coalesce(IngestionJob.attempts, 0) >= max_attempts)
+    ).all()
+    failed: List[IngestionJob] = []
+    for job in exhausted:
+        # Conditional, like claiming: a late heartbeat or another poller wins
+        if db.execute(
+            update(IngestionJob)
+            .where(IngestionJob.id == job.id, *stale)
+            .values(
+                status="failed",
+                error=f"Worker stopped heartbeating on all {job.attempts} attempts",
+                finished_at=now,
+            )
+        ).rowcount:
+            failed.append(job)
+    requeued = db.execute(
+        update(IngestionJob)
+        .where(*stale, func.coalesce(IngestionJob.attempts, 0) < max_attempts)
+        .values(status="queued", worker_id=None)
+    ).rowcount
+    db.commit()
+    for job in failed:
+        discard_upload(job)
+    return requeued
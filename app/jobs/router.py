@@ -0,0 +1,105 @@
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.orm import Session
+from app.database import get_db
+from app.models import User, FacebookAccount, IngestionJob
+from app.schemas import IngestionJobCreate, IngestionJobResponse
+from app.auth.dependencies import get_current_user, get_current_user_id
+from app.facebook.sharding import parse_shard_size
+from app.jobs.queue import enqueue_job, request_cancel
+
+router = APIRouter()
+
+
+def _get_job(db: Session, user_id: int, job_id: int) -> IngestionJob:
+    job = db.query(IngestionJob).filter(IngestionJob.id == job_id, IngestionJob.user_id == user_id).first()
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job {job_id} not found")
+    return job
+
+
+@router.post("", response_model=IngestionJobResponse, status_code=status.HTTP_202_ACCEPTED)
+def enqueue_ingestion_job(
+    job_in: IngestionJobCreate,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Queue a background insights ingestion (fetch_insights or sync).
+    An identical request for the same account while a job is still queued or
+    running returns that job instead of creating a new one.
+    """
+    fb_account = (
+        db.query(FacebookAccount)
+        .filter(
+            FacebookAccount.user_id == current_user.id,
+            FacebookAccount.ad_account_id == job_in.ad_account_id,
+        )
+        .first()
+    )
+
+    if not fb_account:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Facebook account {job_in.ad_account_id} not found or not connected to your user",
+        )
+
+    if job_in.shard is not None:
+        try:
+            parse_shard_size(job_in.shard)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    params = {"level": job_in.level, "shard": job_in.shard, "mode": job_in.mode}
+    if job_in.kind == "fetch_insights":
+        if not job_in.since or not job_in.until:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="since and until are required")
+        if job_in.since > job_in.until:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="since must be on or before until")
+        params.update(since=job_in.since.isoformat(), until=job_in.until.isoformat())
+    else:
+        params.update(lookback_days=job_in.lookback_days, initial_days=job_in.initial_days)
+
+    job, created = enqueue_job(db, current_user.id, fb_account.id, job_in.kind, params)
+    if not created:
+        response.status_code = status.HTTP_200_OK
+    return IngestionJobResponse.from_job(job, deduplicated=not created)
+
+
+@router.get("", response_model=List[IngestionJobResponse])
+def list_ingestion_jobs(
+    limit: int = Query(50, ge=1, le=200),
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """List the current user's most recent jobs."""
+    jobs = (
+        db.query(IngestionJob)
+        .filter(IngestionJob.user_id == current_user_id)
+        .order_by(IngestionJob.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return [IngestionJobResponse.from_job(job) for job in jobs]
+
+
+@router.get("/{job_id}", response_model=IngestionJobResponse)
+def get_ingestion_job(
+    job_id: int,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """Job status and progress (pages fetched, rows written)."""
+    return IngestionJobResponse.from_job(_get_job(db, current_user_id, job_id))
+
+
+@router.post("/{job_id}/cancel", response_model=IngestionJobResponse)
+def cancel_ingestion_job(
+    job_id: int,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """Cancel a queued job, or ask a running job to stop."""
+    job = _get_job(db, current_user_id, job_id)
+    return IngestionJobResponse.from_job(request_cancel(db, job))
@@ -0,0 +1,295 @@
+"""
+Ingestion job workers.
+
+In development a small thread pool runs inside the API process (see
+``JOB_WORKERS``). In production set ``JOB_WORKERS=0`` on the API and run
+dedicated worker processes against the shared database:
+
+    python -m app.jobs.worker --workers 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.database import SessionLocal
+from app.facebook.client import AsyncFacebookGraphAPIClient
+from app.facebook.csv_import import ingest_csv
+from app.facebook.ingest import IngestResult
+from app.facebook.pipeline import ingest_range, sync_account
+from app.jobs.queue import claim_next_job, discard_upload, requeue_stale_jobs
+from app.models import FacebookAccount, IngestionJob
+
+logger = logging.getLogger(__name__)
+
+# Worker threads started inside the API process (0 disables them)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# Seconds an idle worker waits before polling the queue again
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+
+# Seconds between heartbeats (which also pick up cancel requests)
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "5.0"))
+
+# Running jobs without a heartbeat for this long are requeued
+JOB_STALE_AFTER = timedelta(seconds=float(os.getenv("JOB_STALE_SECONDS", "600")))
+
+# Runs a job gets before a stale one is marked failed instead of requeued
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+ClientFactory = Callable[[], AsyncFacebookGraphAPIClient]
+
+
+class JobCancelled(Exception):
+    """Raised from progress callbacks to stop work running outside the event loop."""
+
+
+def _finish_job(session_factory: sessionmaker, job_id: int, **values) -> None:
+    """Record the final status and delete the job's upload, whatever the outcome."""
+    with session_factory() as db:
+        db.execute(update(IngestionJob).where(IngestionJob.id == job_id).values(**values))
+        db.commit()
+        discard_upload(db.get(IngestionJob, job_id))
+
+
+def _heartbeat(session_factory: sessionmaker, job_id: int) -> bool:
+    """Refresh the heartbeat; returns True when a cancel was requested."""
+    with session_factory() as db:
+        db.execute(update(IngestionJob).where(IngestionJob.id == job_id).values(heartbeat_at=datetime.utcnow()))
+        db.commit()
+        job = db.get(IngestionJob, job_id)
+        return bool(job and job.cancel_requested)
+
+
+def _counts(result: IngestResult) -> dict:
+    return dict(
+        rows_written=result.written,
+        rows_inserted=result.inserted,
+        rows_updated=result.updated,
+        rows_unchanged=result.unchanged,
+        rows_skipped=result.skipped,
+    )
+
+
+async def _execute(
+    db: Session, job: IngestionJob, fb_client: AsyncFacebookGraphAPIClient, cancel: threading.Event
+) -> dict:
+    """Run the job's ingestion; returns the JSON summary stored on success."""
+    params = json.loads(job.params)
+    fb_account = db.get(FacebookAccount, job.facebook_account_id)
+    if fb_account is None:
+        raise ValueError(f"Facebook account {job.facebook_account_id} no longer exists")
+
+    def on_progress(pages: int, result: IngestResult, fraction: Optional[float] = None) -> None:
+        if cancel.is_set():
+            raise JobCancelled()
+        values = dict(pages_fetched=pages, **_counts(result))
+        if fraction is not None:
+            values["progress"] = round(fraction, 4)
+        db.execute(update(IngestionJob).where(IngestionJob.id == job.id).values(**values))
+        db.commit()
+
+    common = dict(shard=params.get("shard"), mode=params.get("mode", "auto"), on_progress=on_progress)
+    if job.kind == "csv_upload":
+        # Parsing is CPU bound and synchronous; it checks for cancellation
+        # through on_progress after every chunk. The file is deleted by
+        # _finish_job, so a run interrupted by a crash can be retried.
+        result = await asyncio.to_thread(
+            ingest_csv,
+            db,
+            fb_account.id,
+            params["path"],
+            params.get("level"),
+            on_progress=on_progress,
+            date_order=params.get("date_order"),
+        )
+        summary = {"filename": params.get("filename")}
+    elif job.kind == "sync":
+        outcome = await sync_account(
+            db,
+            fb_client,
+            fb_account,
+            params["level"],
+            lookback_days=params["lookback_days"],
+            initial_days=params["initial_days"],
+            **common,
+        )
+        result = outcome.result
+        summary = {
+            "since": outcome.since,
+            "until": outcome.until,
+            "watermark": outcome.watermark,
+            "status": "up_to_date" if result is None else None,
+        }
+    else:
+        result = await ingest_range(
+            db,
+            fb_client,
+            fb_account,
+            date.fromisoformat(params["since"]),
+            date.fromisoformat(params["until"]),
+            params["level"],
+            **common,
+        )
+        summary = {"since": params["since"], "until": params["until"]}
+
+    if result is not None:
+        failed_shards = getattr(result, "failed_shards", [])
+        if failed_shards and len(failed_shards) == result.shards_total:
+            raise RuntimeError(failed_shards[0].error)
+        summary.update(_counts(result), status="partial" if failed_shards else "success")
+        if hasattr(result, "shards_total"):
+            summary.update(shards_total=result.shards_total, failed_shards=[vars(failure) for failure in failed_shards])
+    return summary
+
+
+def run_job(
+    job_id: int,
+    session_factory: sessionmaker = SessionLocal,
+    client_factory: ClientFactory = AsyncFacebookGraphAPIClient,
+    heartbeat_interval: float = JOB_HEARTBEAT_INTERVAL,
+) -> str:
+    """
+    Run a claimed job to completion and record its final status.
+
+    A heartbeat task keeps ``heartbeat_at`` fresh and cancels the run when
+    ``cancel_requested`` is set. Returns the final status.
+    """
+    db = session_factory()
+    cancel = threading.Event()
+
+    async def main() -> str:
+        fb_client = client_factory()
+        run = asyncio.current_task()
+        cancelled = False
+
+        async def heartbeat():
+            nonlocal cancelled
+            while True:
+                await asyncio.sleep(heartbeat_interval)
+                if await asyncio.to_thread(_heartbeat, session_factory, job_id):
+                    cancelled = True
+                    cancel.set()
+                    run.cancel()
+                    return
+
+        beat = asyncio.create_task(heartbeat())
+        try:
+            job = db.get(IngestionJob, job_id)
+            if job.cancel_requested:
+                cancelled = True
+                raise asyncio.CancelledError()
+            summary = await _execute(db, job, fb_client, cancel)
+            final = dict(status="succeeded", result=json.dumps(summary, default=str))
+            if "rows_written" in summary:
+                final.update({name: summary[name] for name in _counts(IngestResult())})
+        except asyncio.CancelledError:
+            if not cancelled:
+                raise
+            final = dict(status="cancelled")
+        except JobCancelled:
+            final = dict(status="cancelled")
+        except Exception as e:
+            logger.exception("Ingestion job %s failed", job_id)
+            final = dict(status="failed", error=str(e))
+        finally:
+            beat.cancel()
+            await fb_client.aclose()
+
+        _finish_job(session_factory, job_id, finished_at=datetime.utcnow(), **final)
+        return final["status"]
+
+    try:
+        return asyncio.run(main())
+    finally:
+        # asyncio.run() waits for in-flight asyncio.to_thread writes, so
+        # nothing is still using the session when it is closed here.
+        db.close()
+
+
+def process_next_job(
+    session_factory: sessionmaker = SessionLocal,
+    worker_id: Optional[str] = None,
+    client_factory: ClientFactory = AsyncFacebookGraphAPIClient,
+) -> Optional[int]:
+    """Claim and run one queued job. Returns its id, or None if the queue is empty."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    with session_factory() as db:
+        job = claim_next_job(db, worker_id)
+        if job is None:
+            return None
+        job_id = job.id
+
+    run_job(job_id, session_factory=session_factory, client_factory=client_factory)
+    return job_id
+
+
+class WorkerPool:
+    """Threads that poll the job table and run jobs one at a time each."""
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        session_factory: sessionmaker = SessionLocal,
+        poll_interval: float = JOB_POLL_INTERVAL,
+    ):
+        self.workers = workers
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.pool_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(f"{self.pool_id}:{n}",), name=f"job-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self, worker_id: str) -> None:
+        while not self._stop.is_set():
+            try:
+                with self.session_factory() as db:
+                    requeue_stale_jobs(db, JOB_STALE_AFTER, JOB_MAX_ATTEMPTS)
+                if process_next_job(self.session_factory, worker_id) is None:
+                    self._stop.wait(self.poll_interval)
+            except Exception:
+                logger.exception("Job worker %s crashed while polling", worker_id)
+                self._stop.wait(self.poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run ingestion job workers")
+    parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    pool = WorkerPool(workers=args.workers)
+    pool.start()
+    logger.info("Started %d job workers (%s)", args.workers, pool.pool_id)
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+    stopped.wait()
+    pool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import init_db
+from app.migrations import prepare_schema
 from app.auth.router import router as auth_router
-from app.facebook.router import router as facebook_router
+from app.auth.utils import password_pool
+from app.facebook.router import router as facebook_router, fb_client
+from app.jobs.router import router as jobs_router
+from app.jobs.worker import JOB_WORKERS, WorkerPool
 from app.routes.pages import router as pages_router
 
 app = FastAPI(
@@ -18,17 +21,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified"],  # conditional requests (app/response_cache.py)
 )
 
-# Initialize database on startup
+job_workers = WorkerPool(workers=JOB_WORKERS)
+
+
+# Apply (or check, per SCHEMA_MODE) schema migrations on startup
 @app.on_event("startup")
 def on_startup():
-    init_db()
+    prepare_schema()
+    job_workers.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    job_workers.stop(timeout=5)
+    await fb_client.aclose()
+    password_pool.shutdown()
 
 
 # Include routers
 app.include_router(auth_router, prefix="/auth", tags=["Authentication"])
 app.include_router(facebook_router, prefix="/facebook", tags=["Facebook Marketing API"])
+app.include_router(jobs_router, prefix="/jobs", tags=["Ingestion Jobs"])
 app.include_router(pages_router, tags=["Pages"])
 
 
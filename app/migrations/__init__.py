@@ -0,0 +1,210 @@
+"""
+Versioned schema migrations.
+
+Each module in ``app/migrations/versions`` defines ``VERSION`` (an int),
+``DESCRIPTION`` and ``upgrade(op)``; applied versions are recorded in the
+``schema_migrations`` table. Operations check the current schema before
+changing it, so a migration interrupted half way is safely re-run.
+
+Migrations define the tables, columns and indexes they create themselves,
+as they were at that version, and never import app/models.py: replaying
+the history must give the same schema whatever the models look like now.
+
+``SCHEMA_MODE`` controls what the app does with the schema on startup:
+
+* ``migrate`` (default): apply pending migrations
+* ``check``: refuse to start while migrations are pending
+* ``skip``: no schema work at all; run ``python -m app.migrations upgrade``
+  once per deploy instead, so multi-worker boots do not race or reflect
+
+An up-to-date database costs one query on startup in ``migrate`` and
+``check`` mode.
+"""
+import importlib
+import logging
+import os
+import pkgutil
+from datetime import datetime
+from types import ModuleType
+from typing import List, Optional
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_MODES = ["migrate", "check", "skip"]
+
+SCHEMA_MODE = os.getenv("SCHEMA_MODE", "migrate")
+
+# pg_advisory_lock key serializing concurrent upgrades (e.g. several workers booting)
+MIGRATION_LOCK_ID = 724_413_018
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class PendingMigrationsError(RuntimeError):
+    """The database schema is older than the code (SCHEMA_MODE=check)."""
+
+
+class Operations:
+    """Schema operations available to migrations as ``op``."""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.dialect = engine.dialect.name
+
+    def execute(self, sql: str, **params) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(text(sql), params)
+
+    def create_table(self, table: Table) -> None:
+        """Create one table (with its indexes) if it does not exist."""
+        table.create(bind=self.engine, checkfirst=True)
+
+    def has_column(self, table_name: str, column_name: str) -> bool:
+        return column_name in {column["name"] for column in inspect(self.engine).get_columns(table_name)}
+
+    def add_column(self, table_name: str, column: Column) -> None:
+        """Add a nullable column if it is missing."""
+        if self.has_column(table_name, column.name):
+            return
+        if not column.nullable:
+            raise ValueError(f"{table_name}.{column.name}: only nullable columns can be added in place")
+        column_type = column.type.compile(dialect=self.engine.dialect)
+        self.execute(f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}")
+
+    def create_index(self, index: Index) -> None:
+        """
+        Create an index if it is missing. On PostgreSQL it is built
+        ``CONCURRENTLY``, so writes to the table continue during the build;
+        an invalid index left by an interrupted build is dropped and rebuilt.
+        """
+        if self.dialect != "postgresql":
+            with self.engine.begin() as conn:
+                index.create(conn, checkfirst=True)
+            return
+
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            valid = conn.execute(
+                text(
+                    "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                    "WHERE c.relname = :name"
+                ),
+                {"name": index.name},
+            ).scalar()
+            if valid:
+                return
+            if valid is not None:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+            ddl = str(CreateIndex(index).compile(dialect=self.engine.dialect))
+            conn.execute(text(ddl.replace("INDEX", "INDEX CONCURRENTLY", 1)))
+
+    def drop_index(self, name: str) -> None:
+        """Drop an index if it exists (``CONCURRENTLY`` on PostgreSQL)."""
+        if self.dialect != "postgresql":
+            self.execute(f"DROP INDEX IF EXISTS {name}")
+            return
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def load_migrations() -> List[ModuleType]:
+    """All migration modules, in version order."""
+    from app.migrations import versions
+
+    modules = [
+        importlib.import_module(f"{versions.__name__}.{info.name}")
+        for info in pkgutil.iter_modules(versions.__path__)
+    ]
+    modules.sort(key=lambda module: module.VERSION)
+    numbers = [module.VERSION for module in modules]
+    if len(set(numbers)) != len(numbers):
+        raise RuntimeError(f"Duplicate migration versions in {numbers}")
+    return modules
+
+
+def latest_version() -> int:
+    migrations = load_migrations()
+    return migrations[-1].VERSION if migrations else 0
+
+
+def current_version(engine: Engine) -> int:
+    """Highest applied version (0 for a database that was never migrated)."""
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(schema_migrations.name):
+            return 0
+        return conn.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+
+
+def pending_migrations(engine: Engine) -> List[ModuleType]:
+    applied = current_version(engine)
+    return [module for module in load_migrations() if module.VERSION > applied]
+
+
+def _apply(engine: Engine, target: Optional[int]) -> List[int]:
+    schema_migrations.create(engine, checkfirst=True)
+    op = Operations(engine)
+    applied = []
+    for module in pending_migrations(engine):
+        if target is not None and module.VERSION > target:
+            break
+        logger.info("Applying migration %s: %s", module.VERSION, module.DESCRIPTION)
+        module.upgrade(op)
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    schema_migrations.insert().values(
+                        version=module.VERSION, description=module.DESCRIPTION, applied_at=datetime.utcnow()
+                    )
+                )
+        except IntegrityError:
+            pass  # recorded by a concurrent process (no advisory lock outside PostgreSQL)
+        applied.append(module.VERSION)
+    return applied
+
+
+def upgrade(engine: Optional[Engine] = None, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to ``target`` (default: all). Returns the versions applied."""
+    if engine is None:
+        from app.database import engine
+    if not pending_migrations(engine):
+        return []
+    if engine.dialect.name != "postgresql":
+        return _apply(engine, target)
+
+    # Serialize concurrent upgrades; the loser finds nothing left to do
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock:
+        lock.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            return _apply(engine, target)
+        finally:
+            lock.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+
+def prepare_schema(engine: Optional[Engine] = None, mode: Optional[str] = None) -> None:
+    """Startup hook: handle the schema according to ``SCHEMA_MODE``."""
+    mode = mode or SCHEMA_MODE
+    if mode not in SCHEMA_MODES:
+        raise ValueError(f"Unknown SCHEMA_MODE {mode!r} (expected one of {', '.join(SCHEMA_MODES)})")
+    if mode == "skip":
+        return
+    if engine is None:
+        from app.database import engine
+    if mode == "check":
+        pending = pending_migrations(engine)
+        if pending:
+            raise PendingMigrationsError(
+                f"Database schema is at version {current_version(engine)}, code expects {pending[-1].VERSION}; "
+                "run `python -m app.migrations upgrade`"
+            )
+        return
+    upgrade(engine)
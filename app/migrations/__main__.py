@@ -0,0 +1,34 @@
+"""
+Schema migration CLI.
+
+Usage:
+    python -m app.migrations upgrade [--target N]
+    python -m app.migrations status
+"""
+import argparse
+import logging
+
+from app.migrations import current_version, latest_version, pending_migrations, upgrade
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the database schema")
+    parser.add_argument("command", choices=["upgrade", "status"])
+    parser.add_argument("--target", type=int, help="Stop after this version")
+    args = parser.parse_args()
+
+    from app.database import engine
+
+    if args.command == "status":
+        print(f"Database at version {current_version(engine)}, latest is {latest_version()}")
+        for module in pending_migrations(engine):
+            print(f"  pending {module.VERSION}: {module.DESCRIPTION}")
+        return
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    applied = upgrade(engine, target=args.target)
+    print(f"Applied {len(applied)} migration(s); database at version {current_version(engine)}")
+
+
+if __name__ == "__main__":
+    main()
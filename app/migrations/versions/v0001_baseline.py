@@ -0,0 +1,150 @@
+"""
+The schema as it was when migrations were introduced, frozen here rather
+than taken from app/models.py so replaying the history always gives the
+same result. Tables that already exist (pre-migrations databases) are left
+alone; later migrations bring them up to date.
+"""
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    text,
+)
+
+VERSION = 1
+DESCRIPTION = "baseline tables"
+
+metadata = MetaData()
+
+Table(
+    "users",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("email", String(255), unique=True, index=True, nullable=False),
+    Column("hashed_password", String(255), nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+Table(
+    "facebook_accounts",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("ad_account_id", String(50), nullable=False, index=True),
+    Column("access_token", Text, nullable=False),
+    Column("token_type", String(50), nullable=False),
+    Column("expires_at", DateTime, nullable=True),
+    Column("is_system_user", Boolean, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+    Index("idx_user_ad_account", "user_id", "ad_account_id"),
+)
+
+Table(
+    "metric_snapshots",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("facebook_account_id", Integer, ForeignKey("facebook_accounts.id"), nullable=False, index=True),
+    Column("ts", Date, nullable=False, index=True),
+    Column("level", String(20), nullable=False, index=True),
+    Column("entity_id", String(50), nullable=False, index=True),
+    Column("impressions", Integer, nullable=False),
+    Column("clicks", Integer, nullable=False),
+    Column("spend", Float, nullable=False),
+    Column("conversions", Integer, nullable=False),
+    Column("revenue", Float, nullable=False),
+    Column("raw", Text, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Index("idx_unique_metric", "facebook_account_id", "ts", "entity_id", "level", unique=True),
+    Index("idx_ts_level", "ts", "level"),
+)
+
+Table(
+    "metric_actions",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("snapshot_id", Integer, ForeignKey("metric_snapshots.id", ondelete="CASCADE"), nullable=False),
+    Column("action_type", String(100), nullable=False),
+    Column("count", Float, nullable=False),
+    Column("value", Float, nullable=False),
+    Index("idx_unique_metric_action", "snapshot_id", "action_type", unique=True),
+    Index("idx_metric_action_type", "action_type", "snapshot_id"),
+)
+
+Table(
+    "metric_rollups",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("facebook_account_id", Integer, ForeignKey("facebook_accounts.id"), nullable=False),
+    Column("grain", String(10), nullable=False),
+    Column("period_start", Date, nullable=False),
+    Column("level", String(20), nullable=False),
+    Column("entity_id", String(50), nullable=False),
+    Column("impressions", Integer, nullable=False),
+    Column("clicks", Integer, nullable=False),
+    Column("spend", Float, nullable=False),
+    Column("conversions", Integer, nullable=False),
+    Column("revenue", Float, nullable=False),
+    Column("row_count", Integer, nullable=False),
+    Index("idx_unique_rollup", "facebook_account_id", "grain", "level", "entity_id", "period_start", unique=True),
+)
+
+Table(
+    "sync_states",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("facebook_account_id", Integer, ForeignKey("facebook_accounts.id"), nullable=False),
+    Column("level", String(20), nullable=False),
+    Column("last_complete_date", Date, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+    Index("idx_sync_state_account_level", "facebook_account_id", "level", unique=True),
+)
+
+Table(
+    "ingestion_jobs",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("facebook_account_id", Integer, ForeignKey("facebook_accounts.id"), nullable=False),
+    Column("kind", String(20), nullable=False),
+    Column("params", Text, nullable=False),
+    Column("dedup_key", String(64), nullable=False),
+    Column("status", String(20), nullable=False),
+    Column("cancel_requested", Boolean, nullable=False),
+    Column("pages_fetched", Integer, nullable=False),
+    Column("rows_written", Integer, nullable=False),
+    Column("rows_inserted", Integer, nullable=False),
+    Column("rows_updated", Integer, nullable=False),
+    Column("rows_unchanged", Integer, nullable=False),
+    Column("rows_skipped", Integer, nullable=False),
+    Column("result", Text, nullable=True),
+    Column("error", Text, nullable=True),
+    Column("worker_id", String(100), nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("started_at", DateTime, nullable=True),
+    Column("heartbeat_at", DateTime, nullable=True),
+    Column("finished_at", DateTime, nullable=True),
+    Index("idx_job_status", "status", "id"),
+    Index(
+        "idx_job_active_dedup",
+        "dedup_key",
+        unique=True,
+        sqlite_where=text("status IN ('queued', 'running')"),
+        postgresql_where=text("status IN ('queued', 'running')"),
+    ),
+)
+
+
+def upgrade(op):
+    for table in metadata.sorted_tables:
+        op.create_table(table)
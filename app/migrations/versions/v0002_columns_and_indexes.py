@@ -0,0 +1,26 @@
+"""
+Columns and indexes added to existing tables before migrations existed
+(previously applied by init_db reflection on every startup).
+"""
+from sqlalchemy import Column, Date, Float, Index, Integer, LargeBinary, MetaData, String, Table, Text
+
+VERSION = 2
+DESCRIPTION = "job progress, raw_blob, conversion action types, keyset index"
+
+# The columns of metric_snapshots the index is built on, as of this version
+metric_snapshots = Table(
+    "metric_snapshots",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("facebook_account_id", Integer, nullable=False),
+    Column("ts", Date, nullable=False),
+    Column("level", String(20), nullable=False),
+)
+
+
+def upgrade(op):
+    op.add_column("ingestion_jobs", Column("progress", Float, nullable=True))
+    op.add_column("metric_snapshots", Column("raw_blob", LargeBinary, nullable=True))
+    op.add_column("facebook_accounts", Column("conversion_action_types", Text, nullable=True))
+    c = metric_snapshots.c
+    op.create_index(Index("idx_metric_account_level_ts_id", c.facebook_account_id, c.level, c.ts, c.id))
@@ -0,0 +1,26 @@
+"""Catalog of snapshot months moved to archive files."""
+from sqlalchemy import Column, Date, DateTime, ForeignKey, Index, Integer, MetaData, String, Table
+
+VERSION = 3
+DESCRIPTION = "metric_archives catalog"
+
+metadata = MetaData()
+
+Table("facebook_accounts", metadata, Column("id", Integer, primary_key=True))  # foreign key target only
+
+metric_archives = Table(
+    "metric_archives",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("facebook_account_id", Integer, ForeignKey("facebook_accounts.id"), nullable=False),
+    Column("month", Date, nullable=False),
+    Column("path", String(500), nullable=False),
+    Column("row_count", Integer, nullable=False),
+    Column("byte_size", Integer, nullable=False),
+    Column("archived_at", DateTime, nullable=False),
+    Index("idx_unique_metric_archive", "facebook_account_id", "month", unique=True),
+)
+
+
+def upgrade(op):
+    op.create_table(metric_archives)
@@ -0,0 +1,22 @@
+"""
+Drop indexes no query uses, or that another index already covers (found by
+app/query_audit.py). Each one cost a write per ingested row.
+"""
+VERSION = 4
+DESCRIPTION = "drop redundant metric indexes"
+
+REDUNDANT_INDEXES = [
+    "ix_metric_snapshots_id",
+    "ix_metric_snapshots_facebook_account_id",
+    "ix_metric_snapshots_ts",
+    "ix_metric_snapshots_level",
+    "ix_metric_snapshots_entity_id",
+    "idx_ts_level",
+    "ix_metric_actions_id",
+    "ix_metric_rollups_id",
+]
+
+
+def upgrade(op):
+    for name in REDUNDANT_INDEXES:
+        op.drop_index(name)
@@ -0,0 +1,30 @@
+"""Campaign, adset and ad dimensions."""
+from sqlalchemy import Column, Date, DateTime, ForeignKey, Index, Integer, MetaData, String, Table
+
+VERSION = 5
+DESCRIPTION = "entities dimension table"
+
+metadata = MetaData()
+
+Table("facebook_accounts", metadata, Column("id", Integer, primary_key=True))  # foreign key target only
+
+entities = Table(
+    "entities",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("facebook_account_id", Integer, ForeignKey("facebook_accounts.id"), nullable=False),
+    Column("level", String(20), nullable=False),
+    Column("entity_id", String(50), nullable=False),
+    Column("name", String(500), nullable=True),
+    Column("parent_id", String(50), nullable=True),
+    Column("campaign_id", String(50), nullable=True),
+    Column("status", String(30), nullable=True),
+    Column("last_seen", Date, nullable=True),
+    Column("updated_at", DateTime, nullable=False),
+    Index("idx_unique_entity", "facebook_account_id", "level", "entity_id", unique=True),
+    Index("idx_entity_parent", "facebook_account_id", "level", "parent_id", "entity_id"),
+)
+
+
+def upgrade(op):
+    op.create_table(entities)
@@ -0,0 +1,10 @@
+"""Per-account data version behind the response cache's ETags."""
+from sqlalchemy import Column, DateTime, Integer
+
+VERSION = 6
+DESCRIPTION = "facebook_accounts.data_version and data_updated_at"
+
+
+def upgrade(op):
+    op.add_column("facebook_accounts", Column("data_version", Integer, nullable=True))
+    op.add_column("facebook_accounts", Column("data_updated_at", DateTime, nullable=True))
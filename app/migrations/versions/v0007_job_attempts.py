@@ -0,0 +1,9 @@
+"""Count how often a job was claimed, so crashed jobs are not requeued forever."""
+from sqlalchemy import Column, Integer
+
+VERSION = 7
+DESCRIPTION = "ingestion_jobs.attempts"
+
+
+def upgrade(op):
+    op.add_column("ingestion_jobs", Column("attempts", Integer, nullable=True))
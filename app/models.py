@@ -1,6 +1,6 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Float, Date, Index
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Float, Date, Index, LargeBinary, text
+from sqlalchemy.orm import deferred, relationship
 from app.database import Base
 
 
@@ -26,6 +26,11 @@ class FacebookAccount(Base):
     token_type = Column(String(50), default="Bearer", nullable=False)
     expires_at = Column(DateTime, nullable=True)  # UTC datetime when token expires
     is_system_user = Column(Boolean, default=False, nullable=False)
+    # JSON list of action types counted as conversions; NULL means the defaults
+    conversion_action_types = Column(Text, nullable=True)
+    # Bumped with every change to the account's snapshots (app/response_cache.py); NULL means 0
+    data_version = Column(Integer, nullable=True)
+    data_updated_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
@@ -40,22 +45,188 @@ class FacebookAccount(Base):
 class MetricSnapshot(Base):
     __tablename__ = "metric_snapshots"
 
-    id = Column(Integer, primary_key=True, index=True)
-    facebook_account_id = Column(Integer, ForeignKey("facebook_accounts.id"), nullable=False, index=True)
-    ts = Column(Date, nullable=False, index=True)  # Date of the metric
-    level = Column(String(20), nullable=False, index=True)  # account, campaign, adset, ad
-    entity_id = Column(String(50), nullable=False, index=True)  # ID of the entity (campaign_id, adset_id, etc.)
+    id = Column(Integer, primary_key=True)
+    facebook_account_id = Column(Integer, ForeignKey("facebook_accounts.id"), nullable=False)
+    ts = Column(Date, nullable=False)  # Date of the metric
+    level = Column(String(20), nullable=False)  # account, campaign, adset, ad
+    entity_id = Column(String(50), nullable=False)  # ID of the entity (campaign_id, adset_id, etc.)
     impressions = Column(Integer, default=0, nullable=False)
     clicks = Column(Integer, default=0, nullable=False)
     spend = Column(Float, default=0.0, nullable=False)
     conversions = Column(Integer, default=0, nullable=False)
     revenue = Column(Float, default=0.0, nullable=False)
-    raw = Column(Text, nullable=True)  # JSON string of raw Graph API response
+    # Raw Graph API response, loaded only on access (see app/facebook/raw_storage.py)
+    raw = deferred(Column(Text, nullable=True))  # JSON string (RAW_STORAGE=text)
+    raw_blob = deferred(Column(LargeBinary, nullable=True))  # compressed JSON
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     facebook_account = relationship("FacebookAccount", back_populates="metric_snapshots")
+    actions = relationship("MetricAction", back_populates="snapshot")
 
+    # Every query is scoped to one account. The two indexes below serve all of
+    # them (checked by app/query_audit.py); each extra index is another write
+    # per ingested row.
     __table_args__ = (
+        # Upsert key; also serves account + ts range reads across levels
         Index("idx_unique_metric", "facebook_account_id", "ts", "entity_id", "level", unique=True),
-        Index("idx_ts_level", "ts", "level"),
+        # Account + level + ts range reads, and keyset pagination on (ts, id)
+        Index("idx_metric_account_level_ts_id", "facebook_account_id", "level", "ts", "id"),
+    )
+
+
+class MetricAction(Base):
+    """
+    Per action type breakdown of a snapshot's ``actions`` / ``action_values``
+    arrays, written with the snapshot (see app/facebook/actions.py).
+    """
+
+    __tablename__ = "metric_actions"
+
+    id = Column(Integer, primary_key=True)
+    snapshot_id = Column(Integer, ForeignKey("metric_snapshots.id", ondelete="CASCADE"), nullable=False)
+    action_type = Column(String(100), nullable=False)  # e.g. purchase, add_to_cart, link_click
+    count = Column(Float, default=0.0, nullable=False)  # from actions
+    value = Column(Float, default=0.0, nullable=False)  # from action_values
+
+    snapshot = relationship("MetricSnapshot", back_populates="actions")
+
+    __table_args__ = (
+        Index("idx_unique_metric_action", "snapshot_id", "action_type", unique=True),
+        Index("idx_metric_action_type", "action_type", "snapshot_id"),
+    )
+
+
+class MetricRollup(Base):
+    """
+    Pre-aggregated metrics, maintained incrementally as snapshots are upserted
+    (see app/facebook/rollups.py).
+
+    ``week`` and ``month`` rows exist per entity; ``entity_id == "*"`` rows hold
+    the account total of a level for every grain, including ``day``.
+    """
+
+    __tablename__ = "metric_rollups"
+
+    id = Column(Integer, primary_key=True)
+    facebook_account_id = Column(Integer, ForeignKey("facebook_accounts.id"), nullable=False)
+    grain = Column(String(10), nullable=False)  # day, week (starting Monday), month
+    period_start = Column(Date, nullable=False)
+    level = Column(String(20), nullable=False)
+    entity_id = Column(String(50), nullable=False)
+    impressions = Column(Integer, default=0, nullable=False)
+    clicks = Column(Integer, default=0, nullable=False)
+    spend = Column(Float, default=0.0, nullable=False)
+    conversions = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0.0, nullable=False)
+    row_count = Column(Integer, default=0, nullable=False)  # snapshots aggregated
+
+    __table_args__ = (
+        Index(
+            "idx_unique_rollup", "facebook_account_id", "grain", "level", "entity_id", "period_start", unique=True
+        ),
+    )
+
+
+class MetricArchive(Base):
+    """
+    A month of an account's snapshots moved out of metric_snapshots into an
+    archive file (see app/facebook/retention.py).
+    """
+
+    __tablename__ = "metric_archives"
+
+    id = Column(Integer, primary_key=True, index=True)
+    facebook_account_id = Column(Integer, ForeignKey("facebook_accounts.id"), nullable=False)
+    month = Column(Date, nullable=False)  # first day of the archived month
+    path = Column(String(500), nullable=False)  # gzip NDJSON, one snapshot per line
+    row_count = Column(Integer, nullable=False)
+    byte_size = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("idx_unique_metric_archive", "facebook_account_id", "month", unique=True),
+    )
+
+
+class Entity(Base):
+    """
+    Campaign, adset and ad dimensions: names and hierarchy, upserted from
+    the insight rows during ingestion (see app/facebook/entities.py).
+    """
+
+    __tablename__ = "entities"
+
+    id = Column(Integer, primary_key=True)
+    facebook_account_id = Column(Integer, ForeignKey("facebook_accounts.id"), nullable=False)
+    level = Column(String(20), nullable=False)  # campaign, adset, ad
+    entity_id = Column(String(50), nullable=False)  # as in metric_snapshots.entity_id
+    name = Column(String(500), nullable=True)
+    parent_id = Column(String(50), nullable=True)  # adset of an ad, campaign of an adset
+    campaign_id = Column(String(50), nullable=True)  # campaign of an ad or adset
+    status = Column(String(30), nullable=True)  # effective_status, from an entities refresh
+    last_seen = Column(Date, nullable=True)  # latest day with ingested insights
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("idx_unique_entity", "facebook_account_id", "level", "entity_id", unique=True),
+        # Children of a parent (ads of an adset, adsets of a campaign), in id order
+        Index("idx_entity_parent", "facebook_account_id", "level", "parent_id", "entity_id"),
+    )
+
+
+class SyncState(Base):
+    """Incremental sync watermark: last fully ingested date per account and level."""
+
+    __tablename__ = "sync_states"
+
+    id = Column(Integer, primary_key=True, index=True)
+    facebook_account_id = Column(Integer, ForeignKey("facebook_accounts.id"), nullable=False)
+    level = Column(String(20), nullable=False)
+    last_complete_date = Column(Date, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("idx_sync_state_account_level", "facebook_account_id", "level", unique=True),
+    )
+
+
+class IngestionJob(Base):
+    """Background insights ingestion job (see app/jobs)."""
+
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    facebook_account_id = Column(Integer, ForeignKey("facebook_accounts.id"), nullable=False)
+    kind = Column(String(20), nullable=False)  # fetch_insights, sync, csv_upload
+    params = Column(Text, nullable=False)  # JSON: level, since, until, shard, mode, path, ...
+    dedup_key = Column(String(64), nullable=False)
+    status = Column(String(20), default="queued", nullable=False)  # queued, running, succeeded, failed, cancelled
+    cancel_requested = Column(Boolean, default=False, nullable=False)
+    pages_fetched = Column(Integer, default=0, nullable=False)  # pages, or chunks for csv_upload
+    progress = Column(Float, nullable=True)  # fraction done, when the total is known
+    rows_written = Column(Integer, default=0, nullable=False)
+    rows_inserted = Column(Integer, default=0, nullable=False)
+    rows_updated = Column(Integer, default=0, nullable=False)
+    rows_unchanged = Column(Integer, default=0, nullable=False)
+    rows_skipped = Column(Integer, default=0, nullable=False)
+    result = Column(Text, nullable=True)  # JSON summary on success
+    error = Column(Text, nullable=True)
+    worker_id = Column(String(100), nullable=True)
+    attempts = Column(Integer, default=0, nullable=True)  # times claimed by a worker
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("idx_job_status", "status", "id"),
+        # At most one active job per dedup key; identical requests share it
+        Index(
+            "idx_job_active_dedup",
+            "dedup_key",
+            unique=True,
+            sqlite_where=text("status IN ('queued', 'running')"),
+            postgresql_where=text("status IN ('queued', 'running')"),
+        ),
     )
\ No newline at end of file
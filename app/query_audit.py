@@ -0,0 +1,189 @@
+"""
+Query plan audit.
+
+Captures the SQL statements a workload issues (for example a set of API
+requests), runs ``EXPLAIN`` for each of them and reports:
+
+* full scans of the audited tables (a table or whole index read end to end)
+* indexes of the audited tables that no plan used
+* indexes made redundant by another index or the primary key (a leading
+  prefix of another index costs a write per row and serves no query the
+  longer index cannot)
+
+    with capture_statements(engine) as statements:
+        ...  # run the workload
+    report = audit(engine, statements)
+    print(format_report(report))
+
+SQLite (``EXPLAIN QUERY PLAN``) and PostgreSQL (``EXPLAIN (FORMAT JSON)``)
+are supported. ``python -m benchmarks.audit_query_plans`` audits the router
+queries on a seeded database; tests/test_facebook.py asserts on the same
+report so a plan regression fails the suite.
+"""
+import re
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Connection, Engine
+
+# High-volume tables whose access paths are audited
+AUDITED_TABLES = ["metric_snapshots", "metric_actions", "metric_rollups", "entities"]
+
+# Statement kinds that have a plan worth checking (inserts are keyed writes)
+EXPLAINED_STATEMENTS = ("SELECT", "WITH", "UPDATE", "DELETE")
+
+_SQLITE_SCAN = re.compile(r"^SCAN (\w+)")
+_SQLITE_INDEX = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+
+@dataclass
+class CapturedStatement:
+    statement: str
+    parameters: Any
+
+
+@dataclass
+class StatementPlan:
+    statement: str
+    plan: List[str]
+    full_scans: List[str] = field(default_factory=list)  # audited tables read end to end
+    indexes: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class AuditReport:
+    plans: List[StatementPlan]
+    unused_indexes: List[str]
+    redundant_indexes: List[Tuple[str, str]]  # (index, the index or primary key covering it)
+
+    @property
+    def full_scans(self) -> List[StatementPlan]:
+        return [plan for plan in self.plans if plan.full_scans]
+
+    @property
+    def ok(self) -> bool:
+        return not (self.full_scans or self.unused_indexes or self.redundant_indexes)
+
+
+@contextmanager
+def capture_statements(*engines: Engine) -> Iterator[List[CapturedStatement]]:
+    """
+    Record the distinct statements executed on ``engines`` inside the block
+    (with the parameters of their first execution). For an ``AsyncEngine``
+    pass its ``sync_engine``.
+    """
+    captured: List[CapturedStatement] = []
+    seen: Set[str] = set()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if executemany or statement in seen:
+            return
+        if statement.lstrip().split(None, 1)[0].upper() in EXPLAINED_STATEMENTS:
+            seen.add(statement)
+            captured.append(CapturedStatement(statement, parameters))
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield captured
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record)
+
+
+def _sqlite_plan(conn: Connection, captured: CapturedStatement, tables: List[str]) -> StatementPlan:
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {captured.statement}", captured.parameters).all()
+    plan = StatementPlan(captured.statement, [row[-1] for row in rows])
+    for detail in plan.plan:
+        scan = _SQLITE_SCAN.match(detail)
+        if scan and scan.group(1) in tables:
+            plan.full_scans.append(scan.group(1))
+        plan.indexes.update(_SQLITE_INDEX.findall(detail))
+    return plan
+
+
+def _postgresql_plan(conn: Connection, captured: CapturedStatement, tables: List[str]) -> StatementPlan:
+    document = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {captured.statement}", captured.parameters).scalar()
+    plan = StatementPlan(captured.statement, [])
+
+    def walk(node: Dict[str, Any], depth: int) -> None:
+        relation, index = node.get("Relation Name"), node.get("Index Name")
+        line = "  " * depth + node["Node Type"]
+        if relation:
+            line += f" on {relation}"
+        if index:
+            line += f" using {index}"
+            plan.indexes.add(index)
+        plan.plan.append(line)
+        if node["Node Type"] == "Seq Scan" and relation in tables:
+            plan.full_scans.append(relation)
+        for child in node.get("Plans", []):
+            walk(child, depth + 1)
+
+    walk(document[0]["Plan"], 0)
+    return plan
+
+
+def explain(conn: Connection, captured: CapturedStatement, tables: List[str] = AUDITED_TABLES) -> StatementPlan:
+    """Plan of one captured statement, with full scans of ``tables`` and the indexes used.
+
+    Raises ``ValueError`` for dialects other than SQLite and PostgreSQL.
+    """
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        return _sqlite_plan(conn, captured, tables)
+    if dialect == "postgresql":
+        return _postgresql_plan(conn, captured, tables)
+    raise ValueError(f"Query plan audit does not support the {dialect} dialect")
+
+
+def redundant_indexes(engine: Engine, tables: List[str] = AUDITED_TABLES) -> List[Tuple[str, str]]:
+    """Non-unique indexes whose columns are a leading prefix of another index or of the primary key."""
+    inspector = inspect(engine)
+    redundant = []
+    for table in tables:
+        indexes = inspector.get_indexes(table)
+        covering = [("primary key", inspector.get_pk_constraint(table)["constrained_columns"])]
+        covering += [(index["name"], index["column_names"]) for index in indexes]
+        for index in indexes:
+            if index["unique"]:
+                continue
+            columns = index["column_names"]
+            for name, other in covering:
+                if name != index["name"] and other[: len(columns)] == columns:
+                    redundant.append((index["name"], name))
+                    break
+    return redundant
+
+
+def audit(
+    engine: Engine, statements: List[CapturedStatement], tables: Optional[List[str]] = None
+) -> AuditReport:
+    """EXPLAIN every captured statement and check the index set of ``tables``."""
+    tables = tables or AUDITED_TABLES
+    with engine.connect() as conn:
+        plans = [explain(conn, captured, tables) for captured in statements]
+    used = set().union(*[plan.indexes for plan in plans])
+    inspector = inspect(engine)
+    unused = [
+        index["name"]
+        for table in tables
+        for index in inspector.get_indexes(table)
+        if not index["unique"] and index["name"] not in used
+    ]
+    return AuditReport(plans, unused, redundant_indexes(engine, tables))
+
+
+def format_report(report: AuditReport) -> str:
+    lines = [f"{len(report.plans)} statements explained"]
+    for plan in report.full_scans:
+        lines.append(f"FULL SCAN of {', '.join(plan.full_scans)}:")
+        lines.append(f"  {' '.join(plan.statement.split())}")
+        lines += [f"    {detail}" for detail in plan.plan]
+    lines += [f"UNUSED index {name}" for name in report.unused_indexes]
+    lines += [f"REDUNDANT index {name} (covered by {other})" for name, other in report.redundant_indexes]
+    if report.ok:
+        lines.append("no full scans, unused or redundant indexes")
+    return "\n".join(lines)
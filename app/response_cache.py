@@ -0,0 +1,217 @@
+"""
+HTTP response cache for the dashboard read endpoints.
+
+Cached bodies are keyed by endpoint, user, account, the parsed query
+parameters and a version of the data behind them. For insights that is the
+account's ``data_version``, which every write to its snapshots bumps in the
+same transaction (:func:`bump_data_version`). The route reads the version
+with the account row it loads anyway, so a changed version is a cache miss
+and old entries simply age out; nothing is ever invalidated by key.
+
+Responses carry ``ETag`` (a digest of the whole key, so it differs between
+endpoints, users and accounts even at the same data version) and
+``Last-Modified`` with ``Cache-Control: private, no-cache``, so browsers
+revalidate every poll and get ``304 Not Modified`` while the data is
+unchanged, before any query runs.
+
+``RESPONSE_CACHE_BACKEND`` selects where bodies are kept:
+
+* ``memory`` (default): an LRU of ``RESPONSE_CACHE_SIZE`` bodies per process
+* ``redis``: shared by every worker at ``RESPONSE_CACHE_URL``, entries
+  expiring after ``RESPONSE_CACHE_TTL`` seconds (needs the ``redis`` package)
+* ``none``: no bodies kept; ETags and 304s still work
+
+Other stores plug in through :func:`set_backend`. Backends are async, so a
+lookup in a shared store does not block the event loop of the async routes
+that use them.
+"""
+import hashlib
+import json
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from app.cache import LRUCache
+from app.models import FacebookAccount
+
+try:
+    import redis.asyncio as redis
+
+    REDIS_AVAILABLE = True
+except ImportError:  # optional dependency
+    redis = None
+    REDIS_AVAILABLE = False
+
+RESPONSE_CACHE_BACKENDS = ["memory", "redis", "none"]
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "redis://localhost:6379/0")
+
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+
+CACHE_CONTROL = "private, no-cache"
+
+
+class ResponseCacheBackend(ABC):
+    """Store of serialized response bodies; implementations may drop entries at any time."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, body: bytes) -> None:
+        ...
+
+
+class NullBackend(ResponseCacheBackend):
+    async def get(self, key: str) -> Optional[bytes]:
+        return None
+
+    async def set(self, key: str, body: bytes) -> None:
+        pass
+
+
+class MemoryBackend(ResponseCacheBackend):
+    """Per-process LRU."""
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE):
+        self.cache = LRUCache(maxsize)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self.cache.get(key)
+
+    async def set(self, key: str, body: bytes) -> None:
+        self.cache.put(key, body)
+
+
+class RedisBackend(ResponseCacheBackend):
+    """Shared by every worker process; entries expire after ``ttl`` seconds."""
+
+    def __init__(self, url: str = RESPONSE_CACHE_URL, ttl: int = RESPONSE_CACHE_TTL, prefix: str = "response:"):
+        if not REDIS_AVAILABLE:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=redis requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, body: bytes) -> None:
+        await self.client.set(self.prefix + key, body, ex=self.ttl)
+
+
+def create_backend(name: str = RESPONSE_CACHE_BACKEND) -> ResponseCacheBackend:
+    if name == "memory":
+        return MemoryBackend()
+    if name == "redis":
+        return RedisBackend()
+    if name == "none":
+        return NullBackend()
+    raise ValueError(
+        f"Unknown RESPONSE_CACHE_BACKEND {name!r} (expected one of {', '.join(RESPONSE_CACHE_BACKENDS)})"
+    )
+
+
+backend: ResponseCacheBackend = create_backend()
+
+
+def set_backend(new_backend: ResponseCacheBackend) -> None:
+    global backend
+    backend = new_backend
+
+
+def bump_data_version(db: Session, facebook_account_id: Optional[int] = None) -> None:
+    """Mark an account's (or every account's) data as changed, in the caller's transaction."""
+    c = FacebookAccount.__table__.c
+    stmt = update(FacebookAccount.__table__).values(
+        data_version=func.coalesce(c.data_version, 0) + 1,
+        data_updated_at=datetime.utcnow(),
+        updated_at=c.updated_at,  # the account itself did not change
+    )
+    if facebook_account_id is not None:
+        stmt = stmt.where(c.id == facebook_account_id)
+    db.execute(stmt)
+
+
+def data_version(account: FacebookAccount) -> str:
+    return str(account.data_version or 0)
+
+
+def data_last_modified(account: FacebookAccount) -> datetime:
+    return account.data_updated_at or account.created_at
+
+
+def cache_key(endpoint: str, user_id: int, account_id: Optional[int], params: Dict[str, Any], version: str) -> str:
+    """Key of one response: the parsed (so normalized) parameters, not the raw query string."""
+    normalized = json.dumps(params, sort_keys=True, default=str, separators=(",", ":"))
+    digest = hashlib.sha1(f"{normalized}|{version}".encode()).hexdigest()
+    return f"{endpoint}:{user_id}:{account_id}:{digest}"
+
+
+def _to_second(value: datetime) -> datetime:
+    """A naive UTC datetime as aware UTC, at the one second precision of HTTP dates."""
+    return value.replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def etag(key: str) -> str:
+    """Entity tag of a response: a digest of its whole cache key (endpoint, user, account, parameters, version)."""
+    return '"' + hashlib.sha1(key.encode()).hexdigest()[:32] + '"'
+
+
+def _validators(key: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    headers = {"ETag": etag(key), "Cache-Control": CACHE_CONTROL}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(_to_second(last_modified), usegmt=True)
+    return headers
+
+
+def _not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return _to_second(last_modified) <= since
+    return False
+
+
+async def cached_response(
+    request: Request, key: str, last_modified: Optional[datetime] = None
+) -> Optional[Response]:
+    """``304`` when the client's copy is current, the cached body when there is one, else None."""
+    headers = _validators(key, last_modified)
+    if _not_modified(request, headers["ETag"], last_modified):
+        return Response(status_code=304, headers=headers)
+    body = await backend.get(key)
+    if body is None:
+        return None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def store_response(key: str, payload: Any, last_modified: Optional[datetime] = None) -> Response:
+    """Serialize ``payload`` (a pydantic model or a list of them), cache the body and return it with validators."""
+    if isinstance(payload, BaseModel):
+        body = payload.model_dump_json().encode()
+    else:
+        body = ("[" + ",".join(item.model_dump_json() for item in payload) + "]").encode()
+    await backend.set(key, body)
+    return Response(content=body, media_type="application/json", headers=_validators(key, last_modified))
@@ -1,9 +1,27 @@
+import csv
+import os
+import uuid
 from typing import Optional
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, Depends, File, Form, UploadFile, HTTPException, status
 from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from app.auth.dependencies import get_current_user
+from app.database import get_db
+from app.facebook.csv_import import DATE_ORDERS, CsvFormatError, parse_csv_row, resolve_columns
+from app.facebook.pipeline import LEVELS
+from app.jobs.queue import enqueue_job
+from app.models import User, FacebookAccount
+from app.schemas import IngestionJobResponse
 
 router = APIRouter()
 
+# Where uploads wait for a worker; must be shared with worker processes
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join("data", "uploads"))
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(2 * 1024**3)))
+
+UPLOAD_COPY_BYTES = 1024 * 1024
+
 
 # ============ Request/Response Models ============
 class AskAIRequest(BaseModel):
@@ -60,16 +78,80 @@ def reports_page():
     }
 
 
-@router.post("/reports/upload")
-async def upload_report(file: UploadFile = File(...)):
-    """Upload CSV file placeholder. Does not process the file."""
+def _save_upload(file: UploadFile) -> str:
+    """Copy the upload to UPLOAD_DIR in fixed-size chunks; returns the path."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}.csv")
+    written = 0
+    try:
+        with open(path, "wb") as out:
+            while chunk := file.file.read(UPLOAD_COPY_BYTES):
+                written += len(chunk)
+                if written > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"File exceeds {MAX_UPLOAD_BYTES} bytes",
+                    )
+                out.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+@router.post("/reports/upload", response_model=IngestionJobResponse, status_code=status.HTTP_202_ACCEPTED)
+def upload_report(
+    file: UploadFile = File(...),
+    ad_account_id: str = Form(..., description="Ad account the report belongs to, e.g. act_123456789"),
+    level: Optional[str] = Form(None, description="account, campaign, adset, or ad (detected from the columns)"),
+    date_order: Optional[str] = Form(None, description="mdy or dmy; required for dates like 01/02/2024"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Upload a Meta Ads Manager CSV export and ingest it in the background.
+
+    The file is stored and queued as a `csv_upload` job; poll
+    `GET /jobs/{id}` for progress and the final ingest summary.
+    """
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file provided")
-
-    return {
-        "filename": file.filename,
-        "message": "File uploaded successfully (not processed)"
-    }
+    if level is not None and level not in LEVELS:
+        raise HTTPException(status_code=400, detail="Invalid level parameter")
+    if date_order is not None and date_order not in DATE_ORDERS:
+        raise HTTPException(status_code=400, detail="Invalid date_order parameter")
+
+    fb_account = (
+        db.query(FacebookAccount)
+        .filter(FacebookAccount.user_id == current_user.id, FacebookAccount.ad_account_id == ad_account_id)
+        .first()
+    )
+    if not fb_account:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Facebook account {ad_account_id} not found or not connected to your user",
+        )
+
+    path = _save_upload(file)
+
+    # Reject files whose columns or dates cannot be mapped before queueing them
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header:
+                raise CsvFormatError("The file is empty")
+            file_level, columns = resolve_columns(header, level)
+            record = next(reader, None)
+            if record:
+                parse_csv_row(record, header, file_level, columns, date_order)
+    except (CsvFormatError, UnicodeDecodeError, csv.Error) as e:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail=f"Unsupported CSV: {e}")
+
+    params = {"path": path, "filename": file.filename, "level": level, "date_order": date_order}
+    job, _ = enqueue_job(db, current_user.id, fb_account.id, "csv_upload", params)
+    return IngestionJobResponse.from_job(job)
 
 
 # ============ Manage Accounts ============
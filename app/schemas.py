@@ -1,3 +1,4 @@
+import json
 from datetime import datetime, date
 from typing import Optional, List
 from pydantic import BaseModel, EmailStr, Field
@@ -41,13 +42,30 @@ class SystemUserTokenRequest(BaseModel):
     access_token: str
 
 
+class ShardFailureResponse(BaseModel):
+    since: date
+    until: date
+    error: str
+
+
 class FetchInsightsResponse(BaseModel):
-    rows_ingested: int
-    rows_skipped: int
+    rows_ingested: int  # inserted + updated
+    rows_skipped: int  # unkeyed rows + rows already stored with identical metrics
+    rows_inserted: int = 0
+    rows_updated: int = 0
+    rows_unchanged: int = 0
+    shards_total: int = 1
+    failed_shards: List[ShardFailureResponse] = []
     next_cursor: Optional[str] = None
     status: str = "success"
 
 
+class SyncInsightsResponse(FetchInsightsResponse):
+    since: Optional[date] = None  # window fetched; None when already up to date
+    until: Optional[date] = None
+    watermark: Optional[date] = None  # last fully ingested day after this sync
+
+
 class MetricSnapshotResponse(BaseModel):
     id: int
     ts: date
@@ -88,6 +106,171 @@ class MetricSnapshotResponse(BaseModel):
 
 class MetricSnapshotListResponse(BaseModel):
     items: List[MetricSnapshotResponse]
-    total: int
+    total: Optional[int] = None  # omitted on cursor pages unless requested
+    total_is_estimate: bool = False
     page: int
-    limit: int
\ No newline at end of file
+    limit: int
+    next_cursor: Optional[str] = None  # pass as ?cursor= for the next page
+    archived_before: Optional[date] = None  # rows before this day may be archived (export include_archived)
+
+
+class AnalyticsColumnsResponse(BaseModel):
+    """Column-oriented snapshot data: one array per requested field."""
+
+    fields: List[str]
+    row_count: int
+    columns: dict  # field -> list of values, all the same length
+    archived_before: Optional[date] = None  # rows before this day may be archived (export include_archived)
+
+
+# ============ Rollup Schemas ============
+class MetricTotals(BaseModel):
+    impressions: int
+    clicks: int
+    spend: float
+    conversions: int
+    revenue: float
+    ctr: float  # (clicks / impressions) * 100, computed in SQL
+    roas: float  # revenue / spend, computed in SQL
+
+
+class RollupPoint(MetricTotals):
+    period_start: date
+
+
+class RollupSummaryResponse(BaseModel):
+    level: str
+    since: date
+    until: date
+    grain: str
+    totals: MetricTotals
+    series: List[RollupPoint]  # whole periods overlapping since..until
+
+
+class EntityTotals(MetricTotals):
+    entity_id: str
+    name: Optional[str] = None  # from the entities table
+
+
+class EntityTotalsResponse(BaseModel):
+    level: str
+    since: date
+    until: date
+    order_by: str
+    items: List[EntityTotals]
+    archived_before: Optional[date] = None  # edge days before this day may be archived
+
+
+class HierarchyTotalsResponse(EntityTotalsResponse):
+    group_by: str  # level the items are, summed from ``level`` rows
+    campaign_id: Optional[str] = None
+
+
+# ============ Entity Schemas ============
+class EntityResponse(BaseModel):
+    level: str
+    entity_id: str
+    name: Optional[str]
+    parent_id: Optional[str]
+    campaign_id: Optional[str]
+    status: Optional[str]  # set by a refresh, insights carry none
+    last_seen: Optional[date]  # latest insight date
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class EntityListResponse(BaseModel):
+    level: str
+    parent_id: Optional[str]
+    items: List[EntityResponse]
+
+
+class EntityRefreshResponse(BaseModel):
+    ad_account_id: str
+    entities: dict  # level -> entities read
+
+
+# ============ Action Breakdown Schemas ============
+class ConversionActionTypesRequest(BaseModel):
+    action_types: List[str] = Field(..., min_length=1, max_length=50)
+
+
+class ConversionActionTypesResponse(BaseModel):
+    action_types: List[str]
+    snapshots_updated: Optional[int] = None  # set when the types were changed
+
+
+class ActionTotals(BaseModel):
+    action_type: str
+    count: float  # summed from actions
+    value: float  # summed from action_values
+    entities: int  # distinct entities reporting the action
+
+
+class ActionTotalsResponse(BaseModel):
+    level: str
+    since: Optional[date]
+    until: Optional[date]
+    actions: List[ActionTotals]
+    archived_before: Optional[date] = None  # breakdowns before this day may be archived
+
+
+# ============ Job Schemas ============
+class IngestionJobCreate(BaseModel):
+    ad_account_id: str = Field(..., pattern=r"^act_\d+$")
+    kind: str = Field("fetch_insights", pattern=r"^(fetch_insights|sync)$")
+    level: str = Field("campaign", pattern=r"^(account|campaign|adset|ad|all)$")
+    since: Optional[date] = None  # required for fetch_insights
+    until: Optional[date] = None
+    shard: Optional[str] = None
+    mode: str = Field("auto", pattern=r"^(auto|sync|async_job)$")
+    lookback_days: int = Field(7, ge=0, le=90)  # sync only
+    initial_days: int = Field(90, ge=1, le=1095)  # sync only
+
+
+class IngestionJobResponse(BaseModel):
+    id: int
+    kind: str
+    status: str
+    params: dict
+    cancel_requested: bool
+    pages_fetched: int
+    progress: Optional[float] = None
+    rows_written: int
+    rows_inserted: int
+    rows_updated: int
+    rows_unchanged: int
+    rows_skipped: int
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    deduplicated: bool = False  # True when an identical active job was returned
+
+    @classmethod
+    def from_job(cls, job, deduplicated: bool = False):
+        return cls(
+            id=job.id,
+            kind=job.kind,
+            status=job.status,
+            params=json.loads(job.params),
+            cancel_requested=job.cancel_requested,
+            pages_fetched=job.pages_fetched,
+            progress=job.progress,
+            rows_written=job.rows_written,
+            rows_inserted=job.rows_inserted,
+            rows_updated=job.rows_updated,
+            rows_unchanged=job.rows_unchanged,
+            rows_skipped=job.rows_skipped,
+            result=json.loads(job.result) if job.result else None,
+            error=job.error,
+            attempts=job.attempts or 0,
+            created_at=job.created_at,
+            started_at=job.started_at,
+            finished_at=job.finished_at,
+            deduplicated=deduplicated,
+        )
\ No newline at end of file
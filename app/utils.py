@@ -2,6 +2,7 @@
 Utility functions for metrics calculations and formatting.
 """
 from typing import List, Dict, Any
+from sqlalchemy import Float, Numeric, case, cast, func, type_coerce
 from app.models import MetricSnapshot
 
 
@@ -37,6 +38,36 @@ def calculate_roas(revenue: float, spend: float) -> float:
     return round(revenue / spend, 2)
 
 
+def ctr_expression(clicks, impressions):
+    """
+    SQL counterpart of :func:`calculate_ctr` for aggregate queries.
+
+    Args:
+        clicks: Column or SQL expression for clicks
+        impressions: Column or SQL expression for impressions
+
+    Returns:
+        SQL expression for CTR as a percentage, rounded to 2 decimals
+    """
+    ctr = case((impressions > 0, clicks * 100.0 / impressions), else_=0.0)
+    return type_coerce(func.round(cast(ctr, Numeric), 2), Float)
+
+
+def roas_expression(revenue, spend):
+    """
+    SQL counterpart of :func:`calculate_roas` for aggregate queries.
+
+    Args:
+        revenue: Column or SQL expression for revenue
+        spend: Column or SQL expression for spend
+
+    Returns:
+        SQL expression for ROAS, rounded to 2 decimals
+    """
+    roas = case((spend > 0, revenue / spend), else_=0.0)
+    return type_coerce(func.round(cast(roas, Numeric), 2), Float)
+
+
 def enrich_metric_with_computed_fields(metric: MetricSnapshot) -> Dict[str, Any]:
     """
     Add computed fields (CTR, ROAS) to a metric snapshot.
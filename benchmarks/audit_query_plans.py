@@ -0,0 +1,84 @@
+"""
+Audit: EXPLAIN every query the insights routers issue against a seeded
+database, and report full scans of the metric tables and unused or
+redundant indexes (see app/query_audit.py). Exits non-zero on findings.
+
+Usage:
+    python -m benchmarks.audit_query_plans --rows 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.auth.dependencies import get_current_user
+from app.database import (
+    create_async_db_engine,
+    create_db_engine,
+    get_async_db,
+    get_async_read_db,
+    get_db,
+    get_read_db,
+)
+from app.facebook.ingest import ingest_insights
+from app.main import app
+from app.models import User
+from app.query_audit import audit, capture_statements, format_report
+from benchmarks.bench_ingest import fresh_session
+from tests.workload import make_insights, run_workload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "audit.sqlite")
+        db, account_id = fresh_session(path)
+        user = db.execute(select(User)).scalar_one()
+        db.close()
+
+        engine = create_db_engine(f"sqlite:///{path}")
+        async_engine = create_async_db_engine(f"sqlite:///{path}")
+        sync_sessions = sessionmaker(autoflush=False, bind=engine)
+        async_sessions = async_sessionmaker(async_engine, expire_on_commit=False)
+
+        def sync_db():
+            with sync_sessions() as session:
+                yield session
+
+        async def async_db():
+            async with async_sessions() as session:
+                yield session
+
+        async def current_user():
+            return user
+
+        app.dependency_overrides.update(
+            {
+                get_db: sync_db,
+                get_read_db: sync_db,
+                get_async_db: async_db,
+                get_async_read_db: async_db,
+                get_current_user: current_user,
+            }
+        )
+        with capture_statements(engine, async_engine.sync_engine) as statements:
+            with sync_sessions() as session:
+                ingest_insights(session, account_id, "act_1", "ad", make_insights(args.rows))
+            with TestClient(app) as client:
+                run_workload(client)
+
+        report = audit(engine, statements)
+        print(format_report(report))
+        sys.exit(0 if report.ok else 1)
+
+
+if __name__ == "__main__":
+    main()
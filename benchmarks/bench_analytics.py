@@ -0,0 +1,65 @@
+"""
+Benchmark: row-by-row ORM + Pydantic serialization vs the columnar analytics read.
+
+Usage:
+    python -m benchmarks.bench_analytics --rows 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from app.facebook.analytics import DEFAULT_FIELDS, fetch_columns
+from app.facebook.ingest import ingest_insights
+from app.models import MetricSnapshot
+from app.schemas import MetricSnapshotResponse
+from benchmarks.bench_ingest import fresh_session
+from tests.workload import make_insights
+
+
+def orm_rows(db, account_id: int) -> str:
+    """What insights_from_db does per row, for every row."""
+    metrics = (
+        db.query(MetricSnapshot)
+        .filter(MetricSnapshot.facebook_account_id == account_id)
+        .order_by(MetricSnapshot.ts, MetricSnapshot.id)
+        .all()
+    )
+    items = [MetricSnapshotResponse.from_orm_with_computed(metric).model_dump(mode="json") for metric in metrics]
+    return json.dumps(items)
+
+
+def columnar(db, account_id: int) -> str:
+    columns = fetch_columns(db, account_id, DEFAULT_FIELDS)
+    return json.dumps({"fields": DEFAULT_FIELDS, "columns": columns}, separators=(",", ":"))
+
+
+def run(name: str, fn, db, account_id: int) -> None:
+    db.expire_all()
+    tracemalloc.start()
+    started = time.perf_counter()
+    body = fn(db, account_id)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<12} {elapsed:>8.2f}s   peak {peak / 2**20:>8.1f} MiB   body {len(body) / 2**20:>6.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db, account_id = fresh_session(os.path.join(tmp, "bench.sqlite"))
+        ingest_insights(db, account_id, "act_1", "ad", make_insights(args.rows))
+        print(f"{args.rows:,} ad-level rows, SQLite file database")
+        run("ORM+Pydantic", orm_rows, db, account_id)
+        run("columnar", columnar, db, account_id)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
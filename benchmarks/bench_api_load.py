@@ -0,0 +1,152 @@
+"""
+Benchmark: dashboard latency under concurrent users, async session routes vs
+the same queries on synchronous sessions (FastAPI's threadpool).
+
+Each simulated user repeatedly loads a dashboard: the first page of
+insights_from_db and the account summary. Requests go through the ASGI app
+in-process; authentication is stubbed so only the data path is measured.
+
+Usage:
+    python -m benchmarks.bench_api_load --rows 50000 --users 100,300,500
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from datetime import date
+
+import httpx
+from fastapi import APIRouter, Depends
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.auth.dependencies import get_current_user
+from app.database import (
+    create_async_db_engine,
+    create_db_engine,
+    get_async_db,
+    get_async_read_db,
+    get_db,
+    get_read_db,
+)
+from app.facebook.ingest import ingest_insights
+from app.facebook.rollups import account_series, account_totals
+from app.main import app
+from app.models import MetricSnapshot, User
+from app.schemas import MetricSnapshotResponse
+from benchmarks.bench_ingest import fresh_session
+from tests.workload import make_insights
+
+SINCE, UNTIL = date(2024, 1, 1), date(2024, 3, 31)
+
+sync_router = APIRouter()
+
+
+@sync_router.get("/bench/sync/{ad_account_id}/insights")
+def sync_insights(ad_account_id: str, db: Session = Depends(get_read_db)):
+    """The first insights_from_db page on a sync session (as before the async layer)."""
+    query = db.query(MetricSnapshot).filter(MetricSnapshot.facebook_account_id == 1, MetricSnapshot.level == "ad")
+    total = query.count()
+    metrics = query.order_by(MetricSnapshot.ts.desc(), MetricSnapshot.id.desc()).limit(51).all()
+    return {"total": total, "items": [MetricSnapshotResponse.from_orm_with_computed(m) for m in metrics[:50]]}
+
+
+@sync_router.get("/bench/sync/{ad_account_id}/summary")
+def sync_summary(ad_account_id: str, db: Session = Depends(get_read_db)):
+    return {
+        "totals": account_totals(db, 1, "ad", SINCE, UNTIL),
+        "series": account_series(db, 1, "ad", SINCE, UNTIL, "day"),
+    }
+
+
+app.include_router(sync_router)
+
+DASHBOARDS = {
+    "async": [
+        "/facebook/act/act_1/insights_from_db?level=ad&limit=50",
+        f"/facebook/act/act_1/summary?level=ad&since={SINCE}&until={UNTIL}",
+    ],
+    "sync": ["/bench/sync/act_1/insights", "/bench/sync/act_1/summary"],
+}
+
+
+async def run_users(client: httpx.AsyncClient, urls, users: int, rounds: int):
+    latencies = []
+
+    async def user():
+        for _ in range(rounds):
+            for url in urls:
+                started = time.perf_counter()
+                response = await client.get(url)
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.text
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(users)))
+    return latencies, time.perf_counter() - started
+
+
+def percentile(values, q: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1] * 1000
+
+
+async def bench(users_levels, rounds: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'mode':<6} {'users':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for users in users_levels:
+            for mode, urls in DASHBOARDS.items():
+                latencies, elapsed = await run_users(client, urls, users, rounds)
+                print(
+                    f"{mode:<6} {users:>6} {len(latencies) / elapsed:>8.0f} {percentile(latencies, 50):>8.1f} "
+                    f"{percentile(latencies, 95):>8.1f} {percentile(latencies, 99):>8.1f}"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--users", default="100,300,500", help="Comma separated concurrency levels")
+    parser.add_argument("--rounds", type=int, default=3, help="Dashboard loads per user")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite")
+        db, account_id = fresh_session(path)
+        ingest_insights(db, account_id, "act_1", "ad", make_insights(args.rows))
+        user = db.execute(select(User)).scalar_one()
+        assert db.execute(select(func.count()).select_from(MetricSnapshot)).scalar() == args.rows
+        db.close()
+
+        sync_sessions = sessionmaker(autoflush=False, bind=create_db_engine(f"sqlite:///{path}"))
+        async_sessions = async_sessionmaker(create_async_db_engine(f"sqlite:///{path}"), expire_on_commit=False)
+
+        def sync_db():
+            with sync_sessions() as session:
+                yield session
+
+        async def async_db():
+            async with async_sessions() as session:
+                yield session
+
+        async def current_user():
+            return user
+
+        app.dependency_overrides.update(
+            {
+                get_db: sync_db,
+                get_read_db: sync_db,
+                get_async_db: async_db,
+                get_async_read_db: async_db,
+                get_current_user: current_user,
+            }
+        )
+        print(f"{args.rows:,} ad-level rows, SQLite file database, {args.rounds} dashboard loads per user")
+        asyncio.run(bench([int(n) for n in args.users.split(",")], args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark: per-row commit ingestion vs chunked bulk upsert.
+
+Usage:
+    python -m benchmarks.bench_ingest --rows 20000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.facebook.ingest import ingest_insights, parse_insight
+from app.models import User, FacebookAccount, MetricSnapshot
+from tests.workload import make_insights
+
+
+def fresh_session(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    user = User(email="bench@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    account = FacebookAccount(user_id=user.id, ad_account_id="act_1", access_token="t")
+    db.add(account)
+    db.commit()
+    return db, account.id
+
+
+def per_row_commit(db, account_id: int, insights) -> None:
+    """The pre-bulk ingestion loop: one commit per row, IntegrityError on duplicates."""
+    for insight in insights:
+        row = parse_insight(insight, "ad", "act_1")
+        if row is None:
+            continue
+        row.pop("actions")  # the old loop kept no breakdowns or entities
+        row.pop("entities")
+        try:
+            db.add(MetricSnapshot(facebook_account_id=account_id, **row))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+
+
+def bulk_upsert(db, account_id: int, insights) -> None:
+    ingest_insights(db, account_id, "act_1", "ad", insights)
+
+
+def run(name: str, fn, insights, path: str) -> None:
+    db, account_id = fresh_session(path)
+    started = time.perf_counter()
+    fn(db, account_id, insights)
+    first = time.perf_counter() - started
+
+    # Second pass over the same rows: the duplicate/re-sync case
+    started = time.perf_counter()
+    fn(db, account_id, insights)
+    second = time.perf_counter() - started
+    db.close()
+
+    n = len(insights)
+    print(f"{name:<16} first load {n / first:>10,.0f} rows/s   re-sync {n / second:>10,.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+
+    insights = make_insights(args.rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite")
+        print(f"{args.rows:,} ad-level rows, SQLite file database")
+        run("per-row commit", per_row_commit, insights, path)
+        run("bulk upsert", bulk_upsert, insights, path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Benchmark: login throughput under a concurrent burst, with password hashing
+on FastAPI's shared threadpool (the previous handlers) vs the bounded
+password pool (app/auth/utils.py).
+
+Each simulated user logs in repeatedly while a prober hits the synchronous
+``/`` route, which needs a threadpool thread like every sync route does.
+Reported per mode: logins/s, logins/s per core, login latency, refused
+attempts (503 from a full pool, retried after Retry-After) and the prober's latency.
+
+Usage:
+    python -m benchmarks.bench_password_hashing --users 50,200 --rounds 12
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.auth import router as auth_router
+from app.auth import utils as auth_utils
+from app.auth.utils import PasswordHashPool, build_context
+from app.database import create_async_db_engine, get_async_db
+from app.main import app
+from app.models import User
+from benchmarks.bench_ingest import fresh_session
+
+PASSWORD = "bench-password"
+
+pool_work = auth_router._password_work
+
+
+async def threadpool_work(fn, *args):
+    """The previous handlers: hashing on FastAPI's threadpool, unbounded."""
+    return await run_in_threadpool(fn, *args)
+
+
+def percentile(values, q: float) -> float:
+    if len(values) < 2:
+        return values[0] * 1000 if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1] * 1000
+
+
+async def burst(client: httpx.AsyncClient, users: int, logins_per_user: int):
+    latencies, refused, probes = [], 0, []
+    done = asyncio.Event()
+
+    async def user():
+        nonlocal refused
+        for _ in range(logins_per_user):
+            started = time.perf_counter()
+            while True:
+                response = await client.post(
+                    "/auth/login", data={"username": "bench@example.com", "password": PASSWORD}
+                )
+                if response.status_code != 503:
+                    break
+                refused += 1
+                await asyncio.sleep(random.uniform(0.5, 1.0) * float(response.headers["Retry-After"]))
+            assert response.status_code == 200, response.text
+            latencies.append(time.perf_counter() - started)  # including retries
+
+    async def prober():
+        while not done.is_set():
+            started = time.perf_counter()
+            assert (await client.get("/")).status_code == 200
+            probes.append(time.perf_counter() - started)
+            await asyncio.sleep(0.05)
+
+    probe = asyncio.create_task(prober())
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(users)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await probe
+    return latencies, refused, probes, elapsed
+
+
+async def bench(users_levels, logins_per_user: int, workers: int, max_pending: int):
+    cores = os.cpu_count() or 1
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        print(
+            f"{'mode':<10} {'users':>6} {'logins/s':>9} {'per core':>9} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'refused':>8} {'probe p95 ms':>13}"
+        )
+        for users in users_levels:
+            for mode in ("threadpool", "pool"):
+                if mode == "pool":
+                    auth_router.password_pool = PasswordHashPool(workers=workers, max_pending=max_pending)
+                    auth_router._password_work = pool_work
+                else:
+                    auth_router._password_work = threadpool_work
+                latencies, refused, probes, elapsed = await burst(client, users, logins_per_user)
+                rate = len(latencies) / elapsed
+                print(
+                    f"{mode:<10} {users:>6} {rate:>9.1f} {rate / cores:>9.1f} {percentile(latencies, 50):>8.0f} "
+                    f"{percentile(latencies, 95):>8.0f} {refused:>8} {percentile(probes, 95):>13.1f}"
+                )
+                if mode == "pool":
+                    auth_router.password_pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", default="50,200", help="Comma separated concurrent users")
+    parser.add_argument("--logins", type=int, default=2, help="Logins per user")
+    parser.add_argument("--rounds", type=int, default=auth_utils.BCRYPT_ROUNDS, help="bcrypt cost")
+    parser.add_argument("--workers", type=int, default=auth_utils.PASSWORD_HASH_WORKERS, help="Password pool size")
+    parser.add_argument("--max-pending", type=int, default=auth_utils.PASSWORD_HASH_MAX_PENDING)
+    args = parser.parse_args()
+
+    auth_utils.pwd_context = build_context(["bcrypt"], bcrypt_rounds=args.rounds)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite")
+        db, _ = fresh_session(path)
+        db.query(User).update({"hashed_password": auth_utils.get_password_hash(PASSWORD)})
+        db.commit()
+        db.close()
+
+        async_sessions = async_sessionmaker(create_async_db_engine(f"sqlite:///{path}"), expire_on_commit=False)
+
+        async def async_db():
+            async with async_sessions() as session:
+                yield session
+
+        app.dependency_overrides[get_async_db] = async_db
+        print(
+            f"bcrypt cost {args.rounds}, {os.cpu_count() or 1} core(s), "
+            f"password pool of {args.workers} (max {args.max_pending} pending)"
+        )
+        asyncio.run(bench([int(n) for n in args.users.split(",")], args.logins, args.workers, args.max_pending))
+
+
+if __name__ == "__main__":
+    main()
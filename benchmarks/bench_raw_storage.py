@@ -0,0 +1,89 @@
+"""
+Benchmark: table size and read latency with the raw JSON stored as text vs compressed.
+
+Usage:
+    python -m benchmarks.bench_raw_storage --rows 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import text
+
+from app.facebook import raw_storage
+from app.facebook.export import iter_export
+from app.facebook.ingest import ingest_insights
+from app.models import MetricSnapshot
+from benchmarks.bench_ingest import fresh_session
+from tests.workload import make_insights
+
+
+def realistic(insights):
+    """Pad the synthetic rows with the fields a real insights response carries."""
+    for i, insight in enumerate(insights):
+        insight.update(
+            {
+                "account_id": "1",
+                "campaign_id": f"camp_{i % 20}",
+                "campaign_name": f"Campaign {i % 20} - Prospecting - Broad",
+                "adset_id": f"adset_{i % 200}",
+                "adset_name": f"Ad set {i % 200} - Lookalike 1%",
+                "ad_name": f"Ad {insight['ad_id']} - Video 15s",
+                "reach": str(900 + i),
+                "frequency": "1.11",
+                "cpm": "12.34",
+                "cpc": "0.56",
+                "actions": insight["actions"]
+                + [
+                    {"action_type": name, "value": str(i % 50)}
+                    for name in ("link_click", "landing_page_view", "add_to_cart", "initiate_checkout", "video_view")
+                ],
+                "cost_per_action_type": [{"action_type": "link_click", "value": "0.61"}],
+            }
+        )
+    return insights
+
+
+def timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    modes = ["text", "zlib"] + (["zstd"] if raw_storage.ZSTD_AVAILABLE else [])
+    insights = realistic(make_insights(args.rows))
+    print(f"{args.rows:,} ad-level rows, SQLite file database")
+    print(f"{'mode':<6} {'file':>10} {'ingest':>9} {'list rows':>10} {'export+raw':>11}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in modes:
+            raw_storage.RAW_STORAGE = mode
+            path = os.path.join(tmp, f"{mode}.sqlite")
+            db, account_id = fresh_session(path)
+            ingest = timed(lambda: ingest_insights(db, account_id, "act_1", "ad", insights))
+            with db.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("VACUUM"))
+
+            def list_rows():
+                db.expire_all()
+                db.query(MetricSnapshot).filter(MetricSnapshot.facebook_account_id == account_id).all()
+
+            def export():
+                for _ in iter_export(db.get_bind(), account_id, include_raw=True):
+                    pass
+
+            listing = timed(list_rows)
+            exporting = timed(export)
+            size = os.path.getsize(path) / 2**20
+            print(f"{mode:<6} {size:>7.1f} MiB {ingest:>8.2f}s {listing:>9.2f}s {exporting:>10.2f}s")
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: dashboard queries over raw snapshots vs the metric rollups.
+
+Loads a year of ad-level rows, then times account totals and top entities
+over the full year both ways.
+
+Usage:
+    python -m benchmarks.bench_rollups --ads 100
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+from app.facebook.ingest import ingest_insights
+from app.facebook.rollups import account_totals, entity_totals
+from app.models import MetricSnapshot
+from benchmarks.bench_ingest import fresh_session
+
+SINCE = date(2024, 1, 1)
+UNTIL = date(2024, 12, 31)
+
+
+def make_year(ads: int):
+    day = SINCE
+    while day <= UNTIL:
+        for a in range(ads):
+            yield {
+                "date_start": day.isoformat(),
+                "date_stop": day.isoformat(),
+                "ad_id": f"ad_{a}",
+                "impressions": str(1000 + a),
+                "clicks": str(a % 50),
+                "spend": f"{a % 40 + 1:.2f}",
+                "actions": [{"action_type": "purchase", "value": "1"}],
+                "action_values": [{"action_type": "purchase", "value": "25.00"}],
+            }
+        day += timedelta(days=1)
+
+
+def raw_account_totals(db, account_id: int):
+    return (
+        db.query(func.sum(MetricSnapshot.spend), func.sum(MetricSnapshot.clicks), func.sum(MetricSnapshot.impressions))
+        .filter(MetricSnapshot.facebook_account_id == account_id, MetricSnapshot.ts.between(SINCE, UNTIL))
+        .one()
+    )
+
+
+def raw_entity_totals(db, account_id: int):
+    return (
+        db.query(MetricSnapshot.entity_id, func.sum(MetricSnapshot.spend).label("spend"))
+        .filter(MetricSnapshot.facebook_account_id == account_id, MetricSnapshot.ts.between(SINCE, UNTIL))
+        .group_by(MetricSnapshot.entity_id)
+        .order_by(func.sum(MetricSnapshot.spend).desc())
+        .limit(50)
+        .all()
+    )
+
+
+def timed(name: str, fn, repeat: int = 5) -> None:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - started) / repeat
+    print(f"{name:<28} {elapsed * 1000:>10.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ads", type=int, default=100, help="Ads per day")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db, account_id = fresh_session(os.path.join(tmp, "bench.sqlite"))
+        started = time.perf_counter()
+        result = ingest_insights(db, account_id, "act_1", "ad", make_year(args.ads))
+        print(f"{result.inserted:,} ad-level rows loaded in {time.perf_counter() - started:.1f}s (with rollups)")
+
+        timed("raw account totals", lambda: raw_account_totals(db, account_id))
+        timed("rollup account totals", lambda: account_totals(db, account_id, "ad", SINCE, UNTIL))
+        timed("raw top 50 entities", lambda: raw_entity_totals(db, account_id))
+        timed("rollup top 50 entities", lambda: entity_totals(db, account_id, "ad", SINCE, UNTIL))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
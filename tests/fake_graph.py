@@ -0,0 +1,156 @@
+"""
+In-process fake of the Graph API endpoints the app uses, served through
+httpx.MockTransport.
+"""
+import json
+from collections import defaultdict
+from datetime import datetime
+
+import httpx
+
+ID_FIELDS = ["account_id", "campaign_id", "adset_id", "ad_id"]
+METRIC_FIELDS = ["impressions", "clicks", "spend"]
+ACTION_FIELDS = ["actions", "action_values"]
+
+
+def _add(a, b):
+    """Sum two Graph API number strings, keeping integers integral."""
+    if "." in a or "." in b:
+        return f"{float(a) + float(b):.2f}"
+    return str(int(a) + int(b))
+
+
+class FakeGraphAPI:
+    """
+    Minimal Graph API: OAuth token exchange, /me/adaccounts, the synchronous
+    insights edge, async report runs that complete after a few polls, and
+    the campaigns, adsets and ads edges.
+
+    Like Graph, insights come back one row per day only with
+    ``time_increment=1``; otherwise each entity gets one total for the range.
+    """
+
+    def __init__(self, page_size=100, polls_until_complete=2, fail_reports=False):
+        self.insights = defaultdict(list)  # ad_account_id -> insight rows
+        self.entities = defaultdict(list)  # (ad_account_id, edge) -> campaigns, adsets or ads
+        self.ad_accounts = []
+        self.page_size = page_size
+        self.polls_until_complete = polls_until_complete
+        self.fail_reports = fail_reports
+        self.reports = {}
+        self.requests = []
+        self.insight_params = []  # query parameters of every insights request
+
+    def add_insights(self, ad_account_id, rows):
+        self.insights[ad_account_id].extend(rows)
+
+    def add_entities(self, ad_account_id, edge, rows):
+        self.entities[(ad_account_id, edge)].extend(rows)
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+    def count(self, method, suffix):
+        return sum(1 for m, path in self.requests if m == method and path.endswith(suffix))
+
+    # ---- routing ----
+
+    def handle(self, request):
+        parts = [p for p in request.url.path.split("/") if p]
+        if parts and parts[0].startswith("v") and parts[0][1:2].isdigit():
+            parts = parts[1:]  # strip API version
+        self.requests.append((request.method, "/" + "/".join(parts)))
+        params = request.url.params
+
+        if parts == ["oauth", "access_token"]:
+            if params.get("grant_type") == "fb_exchange_token":
+                return httpx.Response(200, json={"access_token": "long_lived_token", "expires_in": 5184000})
+            return httpx.Response(200, json={"access_token": "short_lived_token"})
+        if parts == ["me", "adaccounts"]:
+            return httpx.Response(200, json={"data": self.ad_accounts})
+        if len(parts) == 2 and parts[0].startswith("act_") and parts[1] == "insights":
+            self.insight_params.append(dict(params))
+            rows = self._rows_in_range(parts[0], params)
+            if request.method == "POST":
+                return self._create_report(rows)
+            return self._page(rows, params, int(params.get("limit", self.page_size)))
+        if len(parts) == 2 and parts[0].startswith("act_") and parts[1] in ("campaigns", "adsets", "ads"):
+            fields = params["fields"].split(",")
+            rows = [
+                {name: row[name] for name in fields if name in row} for row in self.entities[(parts[0], parts[1])]
+            ]
+            return self._page(rows, params, int(params.get("limit", self.page_size)))
+        if len(parts) == 1 and parts[0] in self.reports:
+            return self._report_status(parts[0])
+        if len(parts) == 2 and parts[0] in self.reports and parts[1] == "insights":
+            return self._page(self.reports[parts[0]]["rows"], params, int(params.get("limit", self.page_size)))
+
+        return httpx.Response(404, json={"error": {"message": f"Unknown path {request.url.path}"}})
+
+    def _rows_in_range(self, ad_account_id, params):
+        time_range = json.loads(params["time_range"])
+        since = datetime.strptime(time_range["since"], "%Y-%m-%d").date()
+        until = datetime.strptime(time_range["until"], "%Y-%m-%d").date()
+        rows = [
+            row
+            for row in self.insights[ad_account_id]
+            if since <= datetime.strptime(row["date_start"], "%Y-%m-%d").date() <= until
+        ]
+        if params.get("time_increment") == "1":
+            return rows
+        return self._range_totals(rows, time_range)
+
+    @staticmethod
+    def _range_totals(rows, time_range):
+        """One row per entity summing the range, dated like Graph does (date_start = since)."""
+        totals = {}
+        for row in rows:
+            key = tuple(row.get(name) for name in ID_FIELDS)
+            total = totals.get(key)
+            if total is None:
+                totals[key] = {
+                    **row,
+                    "date_start": time_range["since"],
+                    "date_stop": time_range["until"],
+                    **{name: [dict(action) for action in row[name]] for name in ACTION_FIELDS if name in row},
+                }
+                continue
+            for name in METRIC_FIELDS:
+                if name in row:
+                    total[name] = _add(total.get(name, "0"), row[name])
+            for name in ACTION_FIELDS:
+                by_type = {action["action_type"]: action for action in total.setdefault(name, [])}
+                for action in row.get(name, []):
+                    current = by_type.get(action["action_type"])
+                    if current is not None:
+                        current["value"] = _add(current["value"], action["value"])
+                    else:
+                        total[name].append(dict(action))
+        return list(totals.values())
+
+    def _page(self, rows, params, limit):
+        offset = int(params.get("after", "0"))
+        page = rows[offset : offset + limit]
+        paging = {}
+        if offset + limit < len(rows):
+            paging = {"cursors": {"after": str(offset + limit)}, "next": "https://graph.facebook.com/next"}
+        return httpx.Response(200, json={"data": page, "paging": paging})
+
+    def _create_report(self, rows):
+        report_run_id = str(900000 + len(self.reports))
+        self.reports[report_run_id] = {"rows": rows, "polls": 0}
+        return httpx.Response(200, json={"report_run_id": report_run_id})
+
+    def _report_status(self, report_run_id):
+        report = self.reports[report_run_id]
+        report["polls"] += 1
+        if self.fail_reports:
+            status, percent = "Job Failed", 0
+        elif report["polls"] >= self.polls_until_complete:
+            status, percent = "Job Completed", 100
+        else:
+            status, percent = "Job Running", 50
+        return httpx.Response(
+            200,
+            json={"id": report_run_id, "async_status": status, "async_percent_completion": percent},
+        )
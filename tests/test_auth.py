@@ -1,16 +1,23 @@
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from app.main import app
-from app.database import Base, get_db
+from app.database import Base, get_async_db, get_db
 from app.models import User
-from app.auth.utils import get_password_hash
+from app.auth.dependencies import claims_cache, decode_access_token, principal_cache
+from app.auth import router as auth_router, utils as auth_utils
+from app.auth.utils import PasswordHashPool, build_context, get_password_hash
 
 # Test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# NullPool: the test client may run each request on a new event loop
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
 
 def override_get_db():
@@ -21,7 +28,13 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 client = TestClient(app)
 
 
@@ -29,6 +42,8 @@ client = TestClient(app)
 def setup_database():
     """Create tables before each test and drop after."""
     Base.metadata.create_all(bind=engine)
+    principal_cache.clear()
+    claims_cache.clear()
     yield
     Base.metadata.drop_all(bind=engine)
 
@@ -98,4 +113,77 @@ def test_login_nonexistent_user():
         "/auth/login",
         data={"username": "nonexistent@example.com", "password": "password123"},
     )
-    assert response.status_code == 401
\ No newline at end of file
+    assert response.status_code == 401
+
+
+def test_current_user_is_cached_until_the_user_changes():
+    """Test that token resolution is served from the principal cache and invalidated by user writes."""
+    client.post("/auth/register", json={"email": "test@example.com", "password": "testpass123"})
+    token = client.post(
+        "/auth/login", data={"username": "test@example.com", "password": "testpass123"}
+    ).json()["access_token"]
+    claims = decode_access_token(token)
+    assert claims.issued_at is not None
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/facebook/accounts", headers=headers).status_code == 200
+    hits = principal_cache.hits
+    assert client.get("/facebook/accounts", headers=headers).status_code == 200
+    assert principal_cache.hits == hits + 1
+
+    # A password change drops the cached principal once it commits, even if a
+    # request cached the old row again between the flush and the commit
+    db = TestingSessionLocal()
+    user = db.query(User).one()
+    user.hashed_password = get_password_hash("newpass456")
+    db.flush()
+    assert client.get("/facebook/accounts", headers=headers).status_code == 200
+    db.commit()
+    assert principal_cache.get((claims.user_id, claims.issued_at)) is None
+
+    # Bulk updates skip the mapper events; they drop every cached principal at commit
+    assert client.get("/facebook/accounts", headers=headers).status_code == 200
+    db.query(User).update({"hashed_password": get_password_hash("bulkpass789")})
+    assert len(principal_cache) == 1
+    db.rollback()
+    assert len(principal_cache) == 1  # nothing committed, nothing dropped
+    db.query(User).update({"hashed_password": get_password_hash("bulkpass789")})
+    db.commit()
+    assert len(principal_cache) == 0
+
+    # So does deleting the user, after which the token is refused
+    assert client.get("/facebook/accounts", headers=headers).status_code == 200
+    db.delete(user)
+    db.commit()
+    db.close()
+    assert len(principal_cache) == 0
+    assert client.get("/facebook/accounts", headers=headers).status_code == 401
+    # Claims-only routes only check the token
+    assert client.get("/facebook/throttle/metrics", headers=headers).status_code == 200
+    assert client.get("/facebook/throttle/metrics").status_code == 401
+
+
+def test_login_rehashes_outdated_hashes_and_sheds_load(monkeypatch):
+    """Test rehash-on-login when the configured cost rises, and 503 when the password pool is full."""
+    monkeypatch.setattr(auth_utils, "pwd_context", build_context(["bcrypt"], bcrypt_rounds=5))
+    db = TestingSessionLocal()
+    db.add(User(email="test@example.com", hashed_password=build_context(["bcrypt"], bcrypt_rounds=4).hash("pass123")))
+    db.commit()
+
+    form = {"username": "test@example.com", "password": "pass123"}
+    assert client.post("/auth/login", data=form).status_code == 200
+    db.expire_all()
+    rehashed = db.query(User).one().hashed_password
+    assert rehashed.startswith("$2b$05$")
+    assert client.post("/auth/login", data=form).status_code == 200
+    db.expire_all()
+    assert db.query(User).one().hashed_password == rehashed  # already current
+    db.close()
+
+    pool = PasswordHashPool(workers=1, max_pending=1)
+    pool.pending = 1  # one hash already in flight
+    monkeypatch.setattr(auth_router, "password_pool", pool)
+    response = client.post("/auth/login", data=form)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert pool.rejected == 1
\ No newline at end of file
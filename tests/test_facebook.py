@@ -1,18 +1,60 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import threading
+import time
+from types import SimpleNamespace
+import httpx
 import pytest
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from app.main import app
-from app.database import Base, get_db
-from app.models import User, FacebookAccount, MetricSnapshot
+from app.database import Base, create_db_engine, get_async_db, get_async_read_db, get_db, get_read_db
+from app.models import (
+    User,
+    Entity,
+    FacebookAccount,
+    MetricAction,
+    MetricArchive,
+    MetricSnapshot,
+    MetricRollup,
+    SyncState,
+)
 from app.auth.utils import get_password_hash
-from app.auth.dependencies import create_access_token
+from app.auth.dependencies import claims_cache, create_access_token, principal_cache
+from app import cache as cache_module
+from app.facebook.entities import entity_cache
+from app.facebook.ingest import ingest_insight_pages_async, ingest_insights
+from app.facebook.raw_storage import decode_raw, encode_raw, migrate_raw_storage
+from app.facebook import ingest as ingest_module, retention
+from app.facebook.pipeline import compute_sync_window, last_complete_date
+from app.facebook.rollups import cover_range, entity_totals, rebuild_rollups
+from tests.fake_graph import FakeGraphAPI
+from tests.workload import make_insights, run_workload
+from app.facebook.sharding import SHARD_CONCURRENCY_PER_ACCOUNT, ingest_sharded, split_date_range
+from app.facebook import router as facebook_router
+from app.facebook.client import AsyncFacebookGraphAPIClient
+from app.facebook.throttle import ThrottledError, UsageThrottler, account_key, keys_for_url
+from app.jobs.queue import claim_next_job, requeue_stale_jobs
+from app.jobs.worker import process_next_job, run_job
+from app import migrations
+from app.query_audit import audit, capture_statements, format_report
+from app.response_cache import MemoryBackend, set_backend
+from app.routes import pages as pages_routes
 
 # Test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# NullPool: the test client may run each request on a new event loop
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
 
 def override_get_db():
@@ -23,7 +65,15 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
+app.dependency_overrides[get_read_db] = override_get_db
+app.dependency_overrides[get_async_read_db] = override_get_async_db
 client = TestClient(app)
 
 
@@ -31,6 +81,10 @@ client = TestClient(app)
 def setup_database():
     """Create tables before each test and drop after."""
     Base.metadata.create_all(bind=engine)
+    entity_cache.clear()
+    principal_cache.clear()
+    claims_cache.clear()
+    set_backend(MemoryBackend())
     yield
     Base.metadata.drop_all(bind=engine)
 
@@ -174,4 +228,1390 @@ def test_get_insights_unauthorized_account(test_user_and_token):
 def test_oauth_login_requires_auth():
     """Test that OAuth endpoints require authentication."""
     response = client.get("/facebook/oauth/login")
-    assert response.status_code == 401
\ No newline at end of file
+    assert response.status_code == 401
+
+
+def _make_fb_account(user_id, ad_account_id="act_123456789"):
+    db = TestingSessionLocal()
+    fb_account = FacebookAccount(
+        user_id=user_id,
+        ad_account_id=ad_account_id,
+        access_token="test_token",
+        token_type="Bearer",
+        is_system_user=True,
+    )
+    db.add(fb_account)
+    db.commit()
+    db.refresh(fb_account)
+    db.close()
+    return fb_account
+
+
+def _campaign_insight(day, campaign_id="camp_1", impressions=1000, clicks=50, spend="100.00"):
+    return {
+        "date_start": day,
+        "date_stop": day,
+        "campaign_id": campaign_id,
+        "impressions": str(impressions),
+        "clicks": str(clicks),
+        "spend": spend,
+        "actions": [{"action_type": "purchase", "value": "5"}],
+        "action_values": [{"action_type": "purchase", "value": "500.00"}],
+    }
+
+
+def test_ingest_insights_upsert_counts(test_user_and_token):
+    """Test that bulk ingestion reports inserted, updated and unchanged rows."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    insights = [_campaign_insight("2024-01-01"), _campaign_insight("2024-01-02"), {"campaign_id": "no_date"}]
+
+    db = TestingSessionLocal()
+    result = ingest_insights(db, fb_account.id, "act_123456789", "campaign", insights, chunk_size=2)
+    assert (result.inserted, result.updated, result.unchanged, result.skipped) == (2, 0, 0, 1)
+
+    insights[1] = _campaign_insight("2024-01-02", clicks=75)
+    result = ingest_insights(db, fb_account.id, "act_123456789", "campaign", insights, chunk_size=2)
+    assert (result.inserted, result.updated, result.unchanged, result.skipped) == (0, 1, 1, 1)
+
+    rows = db.query(MetricSnapshot).order_by(MetricSnapshot.ts).all()
+    assert [r.clicks for r in rows] == [50, 75]
+    assert rows[0].conversions == 5
+    assert rows[0].revenue == 500.0
+    db.close()
+
+
+def _use_mock_graph(monkeypatch, handler):
+    """Point the router's Graph API client at an in-process mock transport."""
+    mock_client = AsyncFacebookGraphAPIClient(transport=httpx.MockTransport(handler), throttler=UsageThrottler())
+    monkeypatch.setattr(facebook_router, "fb_client", mock_client)
+    return mock_client
+
+
+def test_fetch_insights_reports_counts(test_user_and_token, monkeypatch):
+    """Test fetch_insights persists rows through the bulk upsert path."""
+    _make_fb_account(test_user_and_token["user"].id)
+    token = test_user_and_token["token"]
+    insights = [_campaign_insight("2024-01-01"), _campaign_insight("2024-01-01", campaign_id="camp_2")]
+    pages = {None: (insights[:1], "c1"), "c1": (insights[1:], None)}
+
+    def handler(request):
+        data, after = pages[request.url.params.get("after")]
+        paging = {"cursors": {"after": after}} if after else {}
+        return httpx.Response(200, json={"data": data, "paging": paging})
+
+    _use_mock_graph(monkeypatch, handler)
+
+    url = "/facebook/act/act_123456789/fetch_insights?since=2024-01-01&until=2024-01-01&level=campaign"
+    response = client.post(url, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["rows_ingested"] == 2
+    assert data["rows_inserted"] == 2
+
+    response = client.post(url, headers={"Authorization": f"Bearer {token}"})
+    data = response.json()
+    assert data["rows_ingested"] == 0
+    assert data["rows_unchanged"] == 2
+    assert data["rows_skipped"] == 2
+
+
+def test_iter_insights_pages_follows_cursors(monkeypatch):
+    """Test that the page iterator yields one page per cursor."""
+    responses = {
+        None: {"data": [{"n": 1}, {"n": 2}], "paging": {"cursors": {"after": "c1"}}},
+        "c1": {"data": [{"n": 3}], "paging": {"cursors": {}}},
+    }
+    requested = []
+
+    async def fake_get_insights(after_cursor=None, **kwargs):
+        requested.append(after_cursor)
+        return responses[after_cursor]
+
+    async def run():
+        fb = AsyncFacebookGraphAPIClient(throttler=UsageThrottler())
+        monkeypatch.setattr(fb, "get_insights", fake_get_insights)
+        pages = fb.iter_insights_pages(
+            ad_account_id="act_1", since="2024-01-01", until="2024-01-31", level="ad", fields=[], access_token="t"
+        )
+        assert await pages.__anext__() == [{"n": 1}, {"n": 2}]
+        assert requested == [None]
+        assert [page async for page in pages] == [[{"n": 3}]]
+        assert requested == [None, "c1"]
+        await fb.aclose()
+
+    asyncio.run(run())
+
+
+def test_async_ingest_propagates_producer_errors(test_user_and_token):
+    """Test that a Graph API failure while prefetching pages is re-raised by the ingest."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+
+    async def pages():
+        yield [_campaign_insight("2024-01-01")]
+        raise RuntimeError("graph api down")
+
+    consumed = []
+    db = TestingSessionLocal()
+    with pytest.raises(RuntimeError, match="graph api down"):
+        asyncio.run(
+            ingest_insight_pages_async(
+                db,
+                fb_account.id,
+                "act_123456789",
+                "campaign",
+                pages(),
+                prefetch_pages=1,
+                on_progress=lambda done, result: consumed.append(done),
+            )
+        )
+    assert consumed == [1]
+    db.close()
+
+
+def test_async_client_retries_server_errors(monkeypatch):
+    """Test that the async client retries 5xx responses with asyncio.sleep backoff."""
+    calls = []
+    sleeps = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if len(calls) == 1:
+            return httpx.Response(500)
+        return httpx.Response(200, json={"data": [{"id": "act_1"}]})
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    fb = AsyncFacebookGraphAPIClient(transport=httpx.MockTransport(handler), throttler=UsageThrottler())
+
+    async def run():
+        try:
+            return await fb.get_ad_accounts("token")
+        finally:
+            await fb.aclose()
+
+    assert asyncio.run(run()) == [{"id": "act_1"}]
+    assert len(calls) == 2
+    assert len(sleeps) == 1 and 0 <= sleeps[0] <= 1.0  # full jitter over 0..2**0
+
+
+def test_oauth_callback_stores_accounts(test_user_and_token, monkeypatch):
+    """Test the async OAuth callback against a mock Graph API."""
+    user = test_user_and_token["user"]
+
+    def handler(request):
+        if request.url.path.endswith("/oauth/access_token"):
+            if request.url.params.get("grant_type") == "fb_exchange_token":
+                return httpx.Response(200, json={"access_token": "long_lived", "expires_in": 3600})
+            return httpx.Response(200, json={"access_token": "short_lived"})
+        if request.url.path.endswith("/me/adaccounts"):
+            return httpx.Response(200, json={"data": [{"id": "act_42", "account_id": "42"}]})
+        return httpx.Response(404, json={"error": "not found"})
+
+    _use_mock_graph(monkeypatch, handler)
+    response = client.get(f"/facebook/oauth/callback?code=abc&state=user_{user.id}")
+    assert response.status_code == 200
+    assert "Authorization Successful" in response.text
+
+    db = TestingSessionLocal()
+    account = db.query(FacebookAccount).filter(FacebookAccount.ad_account_id == "act_42").first()
+    assert account.access_token == "long_lived"
+    db.close()
+
+
+def test_async_routes_keep_sync_sessions_off_the_event_loop(test_user_and_token, fake_graph):
+    """Test that async routes using a sync Session run its queries in worker threads."""
+    user = test_user_and_token["user"]
+    _make_fb_account(user.id)
+    fake_graph.ad_accounts = [{"id": "act_123456789", "account_id": "123456789"}]
+    fake_graph.add_insights("act_123456789", _ad_insights(days=3, ads_per_day=2))
+    fake_graph.add_entities("act_123456789", "campaigns", [{"id": "camp_1", "name": "Campaign"}])
+    on_loop = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return  # a worker thread
+        on_loop.append(statement)
+
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        assert client.get(f"/facebook/oauth/callback?code=abc&state=user_{user.id}").status_code == 200
+        url = "/facebook/act/act_123456789/fetch_insights?since=2024-01-01&until=2024-01-03&level=ad&shard=day"
+        assert client.post(url, headers=headers).status_code == 200
+        assert client.post("/facebook/act/act_123456789/sync?level=ad", headers=headers).status_code == 200
+        assert client.post("/facebook/act/act_123456789/entities/refresh", headers=headers).status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert on_loop == []
+
+
+def test_split_date_range():
+    """Test shard boundaries for week, month and N-day shards."""
+    assert split_date_range(date(2024, 1, 1), date(2024, 1, 31)) == [(date(2024, 1, 1), date(2024, 1, 31))]
+    assert split_date_range(date(2024, 1, 3), date(2024, 1, 16), "week") == [
+        (date(2024, 1, 3), date(2024, 1, 7)),
+        (date(2024, 1, 8), date(2024, 1, 14)),
+        (date(2024, 1, 15), date(2024, 1, 16)),
+    ]
+    months = split_date_range(date(2024, 1, 15), date(2024, 3, 10), "month")
+    assert months == [
+        (date(2024, 1, 15), date(2024, 1, 31)),
+        (date(2024, 2, 1), date(2024, 2, 29)),
+        (date(2024, 3, 1), date(2024, 3, 10)),
+    ]
+    assert len(split_date_range(date(2024, 1, 1), date(2024, 12, 31), "10d")) == 37
+    with pytest.raises(ValueError):
+        split_date_range(date(2024, 1, 1), date(2024, 1, 2), "fortnight")
+
+
+def test_ingest_sharded_caps_concurrency(test_user_and_token):
+    """Test that shards run concurrently but never above the per-account cap."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    shards = split_date_range(date(2024, 1, 1), date(2024, 1, 12), "day")
+    running = {"now": 0, "peak": 0}
+
+    async def fetch_pages(since, until):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+        yield [_campaign_insight(since.isoformat())]
+
+    async def run():
+        db = TestingSessionLocal()
+        try:
+            return await ingest_sharded(db, fb_account.id, "act_123456789", "campaign", shards, fetch_pages)
+        finally:
+            db.close()
+
+    result = asyncio.run(run())
+    assert result.inserted == 12
+    assert result.failed_shards == []
+    assert 1 < running["peak"] <= SHARD_CONCURRENCY_PER_ACCOUNT
+
+
+def test_fetch_insights_sharded_isolates_failures(test_user_and_token, monkeypatch):
+    """Test that a failing shard is retried, reported, and does not discard the others."""
+    _make_fb_account(test_user_and_token["user"].id)
+    token = test_user_and_token["token"]
+    attempts = []
+
+    def handler(request):
+        time_range = json.loads(request.url.params["time_range"])
+        attempts.append(time_range["since"])
+        if time_range["since"] == "2024-01-08":
+            return httpx.Response(500, json={"error": {"message": "Please reduce the amount of data"}})
+        day = time_range["since"]
+        return httpx.Response(200, json={"data": [_campaign_insight(day)], "paging": {}})
+
+    async def fake_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    _use_mock_graph(monkeypatch, handler)
+    response = client.post(
+        "/facebook/act/act_123456789/fetch_insights?since=2024-01-01&until=2024-01-21&level=campaign&shard=week",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "partial"
+    assert data["shards_total"] == 3
+    assert data["rows_inserted"] == 2
+    assert [(f["since"], f["until"]) for f in data["failed_shards"]] == [("2024-01-08", "2024-01-14")]
+    # 3 client retries for each of the 2 shard attempts
+    assert attempts.count("2024-01-08") == 6
+
+
+def test_fetch_insights_rejects_bad_shard(test_user_and_token):
+    """Test shard size validation."""
+    token = test_user_and_token["token"]
+    response = client.post(
+        "/facebook/act/act_123456789/fetch_insights?since=2024-01-01&until=2024-01-21&shard=fortnight",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def fake_graph(monkeypatch):
+    """Route the router's Graph API client to an in-process fake Graph API."""
+    fake = FakeGraphAPI(page_size=25)
+    fb = AsyncFacebookGraphAPIClient(transport=fake.transport(), throttler=UsageThrottler())
+    monkeypatch.setattr(facebook_router, "fb_client", fb)
+
+    async def fake_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    return fake
+
+
+def _ad_insights(days, ads_per_day):
+    start = date(2024, 1, 1)
+    rows = []
+    for d in range(days):
+        day = (start + timedelta(days=d)).isoformat()
+        for a in range(ads_per_day):
+            rows.append(
+                {"date_start": day, "date_stop": day, "ad_id": f"ad_{a}", "impressions": "10", "clicks": "1", "spend": "1"}
+            )
+    return rows
+
+
+def test_fetch_insights_uses_async_report_for_large_ranges(test_user_and_token, fake_graph):
+    """Test that large ad-level pulls go through report_run_id jobs."""
+    _make_fb_account(test_user_and_token["user"].id)
+    fake_graph.add_insights("act_123456789", _ad_insights(days=30, ads_per_day=4))
+
+    response = client.post(
+        "/facebook/act/act_123456789/fetch_insights?since=2024-01-01&until=2024-01-30&level=ad",
+        headers={"Authorization": f"Bearer {test_user_and_token['token']}"},
+    )
+    assert response.status_code == 200
+    assert response.json()["rows_inserted"] == 120
+    assert fake_graph.count("POST", "/act_123456789/insights") == 1
+    assert fake_graph.count("GET", "/act_123456789/insights") == 0
+    assert fake_graph.count("GET", "/900000") == 2  # polled until "Job Completed"
+
+
+def test_fetch_insights_small_range_stays_synchronous(test_user_and_token, fake_graph):
+    """Test that small pulls keep using the paginated insights GET."""
+    _make_fb_account(test_user_and_token["user"].id)
+    fake_graph.add_insights("act_123456789", _ad_insights(days=5, ads_per_day=30))
+
+    response = client.post(
+        "/facebook/act/act_123456789/fetch_insights?since=2024-01-01&until=2024-01-05&level=ad",
+        headers={"Authorization": f"Bearer {test_user_and_token['token']}"},
+    )
+    assert response.status_code == 200
+    assert response.json()["rows_inserted"] == 150
+    assert fake_graph.count("POST", "/act_123456789/insights") == 0
+    assert fake_graph.count("GET", "/act_123456789/insights") == 2
+
+
+def test_insights_are_requested_per_day(test_user_and_token, fake_graph):
+    """Test that sync and report-job insights requests ask for daily rows (time_increment=1)."""
+    _make_fb_account(test_user_and_token["user"].id)
+    fake_graph.add_insights("act_123456789", _ad_insights(days=30, ads_per_day=2))
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+
+    for until in ("2024-01-03", "2024-01-30"):  # synchronous GET, then an async report run
+        url = f"/facebook/act/act_123456789/fetch_insights?since=2024-01-01&until={until}&level=ad"
+        assert client.post(url, headers=headers).status_code == 200
+    assert fake_graph.count("POST", "/act_123456789/insights") == 1
+    assert {params.get("time_increment") for params in fake_graph.insight_params} == {"1"}
+
+    db = TestingSessionLocal()
+    assert db.query(MetricSnapshot).count() == 60
+    assert {row.impressions for row in db.query(MetricSnapshot)} == {10}  # daily values, not range totals
+    db.close()
+
+
+def test_fetch_insights_all_levels_derives_from_ad_rows(test_user_and_token, fake_graph):
+    """Test that level=all pulls ad rows once and derives adset, campaign and account rows from them."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    rows = []
+    for d in range(3):
+        day = f"2024-01-0{d + 1}"
+        for a in range(6):
+            rows.append(
+                {
+                    "date_start": day,
+                    "date_stop": day,
+                    "account_id": "123456789",
+                    "campaign_id": f"camp_{a // 4}",
+                    "adset_id": f"adset_{a // 2}",
+                    "ad_id": f"ad_{a}",
+                    "impressions": str(10 * (a + 1)),
+                    "clicks": "1",
+                    "spend": f"{0.1 * (a + 1):.2f}",
+                    "actions": [{"action_type": "purchase", "value": "1"}],
+                    "action_values": [{"action_type": "purchase", "value": "2.50"}],
+                }
+            )
+    fake_graph.add_insights("act_123456789", rows)
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+    url = "/facebook/act/act_123456789/fetch_insights?since=2024-01-01&until=2024-01-03&level=all&shard=day&mode=sync"
+
+    response = client.post(url, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["rows_inserted"] == 3 * (6 + 3 + 2 + 1)
+    assert fake_graph.count("GET", "/act_123456789/insights") == 3  # one ad-level page per day, nothing else
+
+    db = TestingSessionLocal()
+    campaign = db.query(MetricSnapshot).filter_by(level="campaign", entity_id="camp_0", ts=date(2024, 1, 2)).one()
+    assert (campaign.impressions, campaign.clicks, campaign.spend) == (100, 4, 1.0)
+    assert (campaign.conversions, campaign.revenue, campaign.raw_blob) == (4, 10.0, None)
+    assert {(a.action_type, a.count, a.value) for a in campaign.actions} == {("purchase", 4.0, 10.0)}
+    account = db.query(MetricSnapshot).filter_by(level="account", ts=date(2024, 1, 1)).one()
+    assert (account.entity_id, account.impressions) == ("123456789", 210)
+    assert db.query(MetricSnapshot).filter_by(level="adset").count() == 9
+    db.close()
+
+    response = client.post(url, headers=headers)
+    assert (response.json()["rows_unchanged"], response.json()["rows_updated"]) == (36, 0)
+    response = client.get(
+        "/facebook/act/act_123456789/summary?since=2024-01-01&until=2024-01-03&level=campaign", headers=headers
+    )
+    assert response.json()["totals"]["impressions"] == 3 * 210
+    assert client.post(url.replace("level=all", "level=everything"), headers=headers).status_code == 400
+
+
+def test_entities_named_and_summed_up_the_hierarchy(test_user_and_token, fake_graph, monkeypatch):
+    """Test that ingested insights populate the entities table, its hierarchy rollups and the refresh."""
+    _make_fb_account(test_user_and_token["user"].id)
+    rows = []
+    for day, ad_name in (("2024-01-01", "Ad zero"), ("2024-01-02", "Ad zero (renamed)")):
+        for a in range(4):
+            adset = (a + 1) // 2  # ad_0 | ad_1, ad_2 | ad_3
+            rows.append(
+                {
+                    "date_start": day,
+                    "date_stop": day,
+                    "ad_id": f"ad_{a}",
+                    "ad_name": ad_name if a == 0 else f"Ad {a}",
+                    "adset_id": f"adset_{adset}",
+                    "adset_name": f"Adset {adset}",
+                    "campaign_id": f"camp_{adset // 2}",
+                    "campaign_name": f"Campaign {adset // 2}",
+                    "impressions": "100",
+                    "clicks": "10",
+                    "spend": f"{a + 1}.00",
+                }
+            )
+    fake_graph.add_insights("act_123456789", rows)
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+    url = "/facebook/act/act_123456789/fetch_insights?since=2024-01-01&until=2024-01-02&level=ad&mode=sync"
+    assert client.post(url, headers=headers).status_code == 200
+
+    db = TestingSessionLocal()
+    ad = db.query(Entity).filter_by(level="ad", entity_id="ad_0").one()
+    assert (ad.name, ad.parent_id, ad.campaign_id) == ("Ad zero (renamed)", "adset_0", "camp_0")
+    assert ad.last_seen == date(2024, 1, 2)
+    assert db.query(Entity).filter_by(level="adset", entity_id="adset_1").one().campaign_id == "camp_0"
+    assert db.query(Entity).count() == 4 + 3 + 2
+    written = {entity.entity_id: entity.updated_at for entity in db.query(Entity)}
+    db.close()
+
+    # Unchanged entities are skipped on the next pull (the cache remembers what was written)
+    assert client.post(url, headers=headers).status_code == 200
+    db = TestingSessionLocal()
+    assert {entity.entity_id: entity.updated_at for entity in db.query(Entity)} == written
+
+    # A value another worker wrote stands only until this process's cache entry expires
+    db.query(Entity).filter_by(level="ad", entity_id="ad_0").update({"name": "Renamed elsewhere"})
+    db.commit()
+    assert client.post(url, headers=headers).status_code == 200
+    assert db.query(Entity.name).filter_by(level="ad", entity_id="ad_0").scalar() == "Renamed elsewhere"
+    later = time.monotonic() + entity_cache.ttl + 1
+    with monkeypatch.context() as m:
+        m.setattr(cache_module, "time", SimpleNamespace(monotonic=lambda: later))
+        assert client.post(url, headers=headers).status_code == 200
+    db.expire_all()
+    assert db.query(Entity.name).filter_by(level="ad", entity_id="ad_0").scalar() == "Ad zero (renamed)"
+    db.close()
+
+    summary = "/facebook/act/act_123456789/summary"
+    response = client.get(f"{summary}/hierarchy?since=2024-01-01&until=2024-01-02&level=ad", headers=headers)
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert [(i["entity_id"], i["name"], i["spend"], i["impressions"]) for i in items] == [
+        ("camp_0", "Campaign 0", 12.0, 600),
+        ("camp_1", "Campaign 1", 8.0, 200),
+    ]
+    response = client.get(
+        f"{summary}/hierarchy?since=2024-01-01&until=2024-01-02&level=ad&group_by=adset&campaign_id=camp_0",
+        headers=headers,
+    )
+    assert [(i["entity_id"], i["name"], i["spend"]) for i in response.json()["items"]] == [
+        ("adset_1", "Adset 1", 10.0),
+        ("adset_0", "Adset 0", 2.0),
+    ]
+    response = client.get(
+        f"{summary}/hierarchy?since=2024-01-01&until=2024-01-02&level=adset&group_by=ad", headers=headers
+    )
+    assert response.status_code == 400
+    response = client.get(f"{summary}/entities?since=2024-01-01&until=2024-01-02&level=ad&limit=1", headers=headers)
+    assert response.json()["items"][0]["name"] == "Ad 3"
+
+    response = client.get("/facebook/act/act_123456789/entities?level=ad&parent_id=adset_1", headers=headers)
+    assert [(i["entity_id"], i["name"]) for i in response.json()["items"]] == [("ad_1", "Ad 1"), ("ad_2", "Ad 2")]
+
+    # A refresh adds delivery status and entities without insights, keeping the insight dates
+    fake_graph.add_entities(
+        "act_123456789",
+        "campaigns",
+        [{"id": "camp_0", "name": "Campaign 0", "effective_status": "ACTIVE"}],
+    )
+    fake_graph.add_entities(
+        "act_123456789",
+        "ads",
+        [
+            {"id": "ad_0", "name": "Ad zero", "effective_status": "PAUSED", "adset_id": "adset_0"},
+            {"id": "ad_9", "name": "New ad", "effective_status": "IN_REVIEW", "adset_id": "adset_1"},
+        ],
+    )
+    response = client.post("/facebook/act/act_123456789/entities/refresh", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["entities"] == {"campaign": 1, "adset": 0, "ad": 2}
+    db = TestingSessionLocal()
+    ad = db.query(Entity).filter_by(level="ad", entity_id="ad_0").one()
+    assert (ad.name, ad.status, ad.last_seen) == ("Ad zero", "PAUSED", date(2024, 1, 2))
+    new_ad = db.query(Entity).filter_by(level="ad", entity_id="ad_9").one()
+    assert (new_ad.parent_id, new_ad.status, new_ad.last_seen) == ("adset_1", "IN_REVIEW", None)
+    db.close()
+
+
+def test_fetch_insights_failed_report_job(test_user_and_token, fake_graph):
+    """Test that a failed report job surfaces as an error."""
+    _make_fb_account(test_user_and_token["user"].id)
+    fake_graph.fail_reports = True
+
+    response = client.post(
+        "/facebook/act/act_123456789/fetch_insights?since=2024-01-01&until=2024-01-05&level=ad&mode=async_job",
+        headers={"Authorization": f"Bearer {test_user_and_token['token']}"},
+    )
+    assert response.status_code == 500
+    assert "Job Failed" in response.json()["detail"]
+
+
+def test_throttler_slows_down_on_high_usage():
+    """Test that usage headers scale down the per-account token bucket."""
+    throttler = UsageThrottler(rate=10.0, burst=1.0)
+    keys = keys_for_url("https://graph.facebook.com/v19.0/act_42/insights")
+    assert keys == ["app", account_key("act_42")]
+
+    throttler.observe(keys, {"x-ad-account-usage": json.dumps({"acc_id_util_pct": 90, "reset_time_duration": 0})})
+    metrics = throttler.metrics()
+    assert metrics["keys"][account_key("act_42")]["usage_pct"] == 90
+    assert metrics["keys"][account_key("act_42")]["rate_per_sec"] == 4.0  # 10 * (100 - 90) / (100 - 75)
+
+    assert throttler.reserve(keys) == 0.0  # burst token
+    assert throttler.reserve(keys) == pytest.approx(0.25, abs=0.01)  # next token at 4/s
+
+
+def test_throttle_metrics_only_show_the_callers_accounts(test_user_and_token, monkeypatch):
+    """Test that /throttle/metrics leaves out other users' ad accounts and business use cases."""
+    _make_fb_account(test_user_and_token["user"].id)
+    throttler = UsageThrottler()
+    monkeypatch.setattr(facebook_router.fb_client, "throttler", throttler)
+    for ad_account_id, business_id in (("act_123456789", "biz_own"), ("act_999", "biz_other")):
+        usage = {business_id: [{"call_count": 50, "total_cputime": 1, "total_time": 1}]}
+        keys = keys_for_url(f"https://graph.facebook.com/v19.0/{ad_account_id}/insights")
+        throttler.reserve(keys)
+        throttler.observe(keys, {"x-business-use-case-usage": json.dumps(usage)})
+
+    response = client.get(
+        "/facebook/throttle/metrics", headers={"Authorization": f"Bearer {test_user_and_token['token']}"}
+    )
+    assert response.status_code == 200
+    metrics = response.json()
+    assert set(metrics["keys"]) == {"app", account_key("act_123456789")}
+    assert set(metrics["business_use_case_usage"]) == {"biz_own"}
+    assert set(throttler.metrics()["keys"]) == {"app", account_key("act_123456789"), account_key("act_999")}
+
+
+def test_throttler_honors_regain_access_time():
+    """Test that estimated_time_to_regain_access blocks the account."""
+    throttler = UsageThrottler()
+    keys = keys_for_url("https://graph.facebook.com/v19.0/act_42/insights")
+    header = {"123": [{"type": "ads_insights", "call_count": 100, "estimated_time_to_regain_access": 2}]}
+    throttler.observe(keys, {"x-business-use-case-usage": json.dumps(header)})
+
+    assert 119 < throttler.blocked_for(keys) <= 120
+    assert 119 < throttler.retry_delay(keys, attempt=0) <= 120
+    assert throttler.reserve(["app"]) == 0.0  # other accounts are unaffected
+    with pytest.raises(ThrottledError):
+        throttler.reserve(keys, max_wait=60)
+
+
+def test_async_client_retries_graph_throttling_errors(monkeypatch):
+    """Test that Graph API throttling error codes are retried and counted."""
+    responses = [
+        httpx.Response(400, json={"error": {"code": 80000, "message": "too many calls"}}),
+        httpx.Response(200, json={"data": []}, headers={"x-app-usage": json.dumps({"call_count": 80})}),
+    ]
+
+    async def fake_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    throttler = UsageThrottler()
+    fb = AsyncFacebookGraphAPIClient(transport=httpx.MockTransport(lambda request: responses.pop(0)), throttler=throttler)
+    assert asyncio.run(fb.get_ad_accounts("token")) == []
+    metrics = throttler.metrics()
+    assert metrics["rate_limited"] == 1
+    assert metrics["keys"]["app"]["usage_pct"] == 80
+
+
+def test_compute_sync_window():
+    """Test the incremental window around the watermark."""
+    until = date(2024, 3, 31)
+    assert compute_sync_window(None, until, lookback_days=7, initial_days=90) == (date(2024, 1, 2), until)
+    assert compute_sync_window(date(2024, 3, 20), until, lookback_days=7) == (date(2024, 3, 14), until)
+    since, _ = compute_sync_window(until, until, lookback_days=0)
+    assert since > until  # nothing new to fetch
+
+
+def test_sync_uses_watermark_and_lookback(test_user_and_token, fake_graph):
+    """Test that /sync backfills once, then only refetches the lookback window."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    yesterday = last_complete_date()
+    for d in range(30):
+        day = (yesterday - timedelta(days=d)).isoformat()
+        fake_graph.add_insights("act_123456789", [_campaign_insight(day)])
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+
+    response = client.post("/facebook/act/act_123456789/sync?level=campaign&initial_days=10", headers=headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["rows_inserted"] == 10
+    assert data["since"] == (yesterday - timedelta(days=9)).isoformat()
+    assert data["watermark"] == yesterday.isoformat()
+
+    response = client.post("/facebook/act/act_123456789/sync?level=campaign&lookback_days=3", headers=headers)
+    data = response.json()
+    assert data["since"] == (yesterday - timedelta(days=2)).isoformat()
+    assert data["rows_unchanged"] == 3
+    assert data["rows_inserted"] == 0
+
+    response = client.post("/facebook/act/act_123456789/sync?level=campaign&lookback_days=0", headers=headers)
+    assert response.json()["status"] == "up_to_date"
+
+    db = TestingSessionLocal()
+    state = db.query(SyncState).filter(SyncState.facebook_account_id == fb_account.id).one()
+    assert state.level == "campaign"
+    assert state.last_complete_date == yesterday
+    db.close()
+
+
+def _job_client_factory(fake):
+    return lambda: AsyncFacebookGraphAPIClient(transport=fake.transport(), throttler=UsageThrottler())
+
+
+def test_ingestion_job_runs_and_reports_progress(test_user_and_token):
+    """Test that a queued job is deduplicated, then run by a worker with counts."""
+    _make_fb_account(test_user_and_token["user"].id)
+    fake = FakeGraphAPI(page_size=25)
+    fake.add_insights("act_123456789", _ad_insights(days=5, ads_per_day=30))
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+    body = {
+        "ad_account_id": "act_123456789",
+        "kind": "fetch_insights",
+        "level": "ad",
+        "since": "2024-01-01",
+        "until": "2024-01-05",
+        "mode": "sync",
+    }
+
+    response = client.post("/jobs", json=body, headers=headers)
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status"] == "queued"
+
+    response = client.post("/jobs", json=body, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["id"] == job["id"]
+    assert response.json()["deduplicated"] is True
+
+    assert process_next_job(TestingSessionLocal, client_factory=_job_client_factory(fake)) == job["id"]
+    assert process_next_job(TestingSessionLocal, client_factory=_job_client_factory(fake)) is None
+
+    data = client.get(f"/jobs/{job['id']}", headers=headers).json()
+    assert data["status"] == "succeeded"
+    assert data["pages_fetched"] == 2
+    assert data["rows_inserted"] == 150
+    assert data["result"]["status"] == "success"
+
+    # Finished jobs no longer deduplicate
+    assert client.post("/jobs", json=body, headers=headers).status_code == 202
+
+
+def test_ingestion_job_cancel_and_validation(test_user_and_token):
+    """Test cancelling a queued job and rejecting bad requests."""
+    _make_fb_account(test_user_and_token["user"].id)
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+
+    response = client.post("/jobs", json={"ad_account_id": "act_123456789", "kind": "fetch_insights"}, headers=headers)
+    assert response.status_code == 400
+
+    response = client.post("/jobs", json={"ad_account_id": "act_999", "kind": "sync"}, headers=headers)
+    assert response.status_code == 404
+
+    job = client.post("/jobs", json={"ad_account_id": "act_123456789", "kind": "sync"}, headers=headers).json()
+    response = client.post(f"/jobs/{job['id']}/cancel", headers=headers)
+    assert response.json()["status"] == "cancelled"
+    assert process_next_job(TestingSessionLocal, client_factory=_job_client_factory(FakeGraphAPI())) is None
+    assert [j["id"] for j in client.get("/jobs", headers=headers).json()] == [job["id"]]
+    assert client.get("/jobs?limit=0", headers=headers).status_code == 422
+    assert client.get("/jobs?limit=201", headers=headers).status_code == 422
+
+
+def test_stale_jobs_are_requeued_until_max_attempts(test_user_and_token):
+    """Test that a job whose worker keeps dying is requeued, then failed after max_attempts runs."""
+    _make_fb_account(test_user_and_token["user"].id)
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+    job = client.post("/jobs", json={"ad_account_id": "act_123456789", "kind": "sync"}, headers=headers).json()
+    stale_after = timedelta(seconds=-1)  # every running job counts as stale
+
+    db = TestingSessionLocal()
+    for attempt in (1, 2):
+        assert claim_next_job(db, f"worker-{attempt}").id == job["id"]  # ... which then crashes
+        assert requeue_stale_jobs(db, stale_after, max_attempts=2) == (1 if attempt == 1 else 0)
+    db.close()
+
+    data = client.get(f"/jobs/{job['id']}", headers=headers).json()
+    assert (data["status"], data["attempts"]) == ("failed", 2)
+    assert "heartbeating" in data["error"] and data["finished_at"] is not None
+
+
+def test_cover_range_prefers_whole_months():
+    """Test that ranges are split into whole months, whole weeks and edge days."""
+    months, weeks, days = cover_range(date(2024, 1, 3), date(2024, 4, 10))
+    assert months == [date(2024, 2, 1), date(2024, 3, 1)]
+    assert weeks == [date(2024, 1, 8), date(2024, 1, 15), date(2024, 1, 22), date(2024, 4, 1)]
+    assert days == [
+        (date(2024, 1, 3), date(2024, 1, 7)),
+        (date(2024, 1, 29), date(2024, 1, 31)),
+        (date(2024, 4, 8), date(2024, 4, 10)),
+    ]
+
+
+def test_rollups_track_upserts(test_user_and_token):
+    """Test that rollups follow inserts and updates and match the raw snapshots."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    start = date(2024, 1, 1)
+    insights = [
+        _campaign_insight((start + timedelta(days=d)).isoformat(), campaign_id=f"camp_{c}", impressions=1000 + d)
+        for d in range(75)
+        for c in range(3)
+    ]
+    revised = [
+        _campaign_insight("2024-02-10", campaign_id="camp_1", impressions=5000, clicks=80, spend="150.00"),
+        _campaign_insight("2024-03-14", campaign_id="camp_2", impressions=10, clicks=1, spend="1.00"),
+    ]
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", insights)
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", revised)  # as a lookback refetch would
+
+    february = db.query(MetricSnapshot).filter(MetricSnapshot.ts.between(date(2024, 2, 1), date(2024, 2, 29))).all()
+    month = db.query(MetricRollup).filter_by(grain="month", entity_id="*", period_start=date(2024, 2, 1)).one()
+    assert month.impressions == sum(r.impressions for r in february)
+    assert month.row_count == len(february) == 29 * 3
+
+    since, until = date(2024, 1, 3), date(2024, 3, 14)
+    raw = db.query(MetricSnapshot).filter(MetricSnapshot.ts.between(since, until)).all()
+    totals = {e["entity_id"]: e for e in entity_totals(db, fb_account.id, "campaign", since, until)}
+    for campaign_id in ("camp_0", "camp_1", "camp_2"):
+        expected = [r for r in raw if r.entity_id == campaign_id]
+        assert totals[campaign_id]["impressions"] == sum(r.impressions for r in expected)
+        assert totals[campaign_id]["spend"] == pytest.approx(sum(r.spend for r in expected))
+
+    def snapshot():
+        return sorted((r.grain, r.period_start, r.entity_id, r.impressions, r.row_count) for r in db.query(MetricRollup))
+
+    incremental = snapshot()
+    assert rebuild_rollups(db, fb_account.id) == 225
+    assert snapshot() == incremental
+    db.close()
+
+
+def test_concurrent_upserts_of_a_key_apply_its_rollup_delta_once(test_user_and_token, monkeypatch):
+    """Test that a writer racing another one's pre-read waits for it instead of applying a stale delta."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    existing_metrics = ingest_module._existing_metrics
+    racers = []
+
+    def existing_with_a_racer(db, facebook_account_id, rows):
+        existing = existing_metrics(db, facebook_account_id, rows)
+        if not racers:  # after the first writer's pre-read, a second writer upserts the same key
+            def write():
+                with TestingSessionLocal() as other:
+                    insight = _campaign_insight("2024-01-01")
+                    ingest_insights(other, fb_account.id, "act_123456789", "campaign", [insight])
+
+            racers.append(threading.Thread(target=write))
+            racers[0].start()
+            racers[0].join(timeout=0.5)  # finishes here only if the pre-read took no lock
+        return existing
+
+    monkeypatch.setattr(ingest_module, "_existing_metrics", existing_with_a_racer)
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", [_campaign_insight("2024-01-01", clicks=60)])
+    racers[0].join()
+
+    snapshot = db.query(MetricSnapshot).one()
+    for rollup in db.query(MetricRollup):
+        assert (rollup.row_count, rollup.clicks) == (1, snapshot.clicks)
+    db.close()
+
+
+def test_summary_endpoints_serve_rollups(test_user_and_token):
+    """Test the summary and per-entity endpoints, including SQL-computed CTR/ROAS."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    insights = [
+        _campaign_insight(f"2024-01-0{d}", campaign_id=f"camp_{c}", clicks=10 * (c + 1), spend="100.00")
+        for d in range(1, 8)
+        for c in range(2)
+    ]
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", insights)
+    db.close()
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+
+    response = client.get(
+        "/facebook/act/act_123456789/summary?since=2024-01-02&until=2024-01-04&level=campaign", headers=headers
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["totals"]["impressions"] == 6000
+    assert data["totals"]["clicks"] == 90
+    assert data["totals"]["ctr"] == 1.5
+    assert [point["period_start"] for point in data["series"]] == ["2024-01-02", "2024-01-03", "2024-01-04"]
+
+    response = client.get(
+        "/facebook/act/act_123456789/summary/entities?since=2024-01-01&until=2024-01-07&order_by=clicks",
+        headers=headers,
+    )
+    items = response.json()["items"]
+    assert [item["entity_id"] for item in items] == ["camp_1", "camp_0"]
+    assert items[0]["clicks"] == 140
+    assert items[0]["spend"] == 700.0
+
+    response = client.get(
+        "/facebook/act/act_123456789/summary?since=2024-01-01&until=2024-01-07&grain=year", headers=headers
+    )
+    assert response.status_code == 400
+
+
+def test_analytics_returns_columns(test_user_and_token):
+    """Test the column-oriented analytics endpoint and its field projection."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    insights = [
+        _campaign_insight("2024-01-02", clicks=20),
+        _campaign_insight("2024-01-01", campaign_id="camp_2", impressions=0, clicks=0, spend="0"),
+        _campaign_insight("2024-01-03", clicks=25),
+    ]
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", insights)
+    db.close()
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+
+    response = client.get(
+        "/facebook/act/act_123456789/analytics?fields=ts,entity_id,ctr,roas&until=2024-01-02", headers=headers
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["fields"] == ["ts", "entity_id", "ctr", "roas"]
+    assert data["row_count"] == 2
+    assert data["columns"] == {
+        "ts": ["2024-01-01", "2024-01-02"],
+        "entity_id": ["camp_2", "camp_1"],
+        "ctr": [0.0, 2.0],
+        "roas": [0.0, 5.0],
+    }
+
+    response = client.get("/facebook/act/act_123456789/analytics?fields=spend,raw", headers=headers)
+    assert response.status_code == 400
+
+
+def test_insights_from_db_keyset_pagination(test_user_and_token):
+    """Test walking insights_from_db with next_cursor."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    insights = [
+        _campaign_insight(f"2024-01-{d:02d}", campaign_id=f"camp_{c}") for d in range(1, 11) for c in range(3)
+    ]
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", insights)
+    db.close()
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+    url = "/facebook/act/act_123456789/insights_from_db?level=campaign&limit=7"
+
+    data = client.get(url, headers=headers).json()
+    assert data["total"] == 30
+    seen = [(item["ts"], item["id"]) for item in data["items"]]
+    while data["next_cursor"]:
+        data = client.get(f"{url}&cursor={data['next_cursor']}", headers=headers).json()
+        assert data["total"] is None  # not recounted on every page
+        seen += [(item["ts"], item["id"]) for item in data["items"]]
+    assert len(seen) == len(set(seen)) == 30
+    assert seen == sorted(seen, reverse=True)
+
+    data = client.get(f"{url}&total=estimate&since=2024-01-05", headers=headers).json()
+    assert (data["total"], data["total_is_estimate"]) == (18, True)
+
+    assert client.get(f"{url}&cursor=not-a-cursor", headers=headers).status_code == 400
+
+
+def test_insights_responses_are_cached_until_the_data_changes(test_user_and_token, monkeypatch):
+    """Test ETags and 304s on insights_from_db and the account list, and invalidation by ingestion."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", [_campaign_insight("2024-01-01")])
+    db.close()
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+    url = "/facebook/act/act_123456789/insights_from_db?level=campaign&since=2024-01-01"
+
+    first = client.get(url, headers=headers)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "private, no-cache"
+    revalidated = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert (revalidated.status_code, revalidated.content, revalidated.headers["etag"]) == (304, b"", etag)
+    since = client.get(url, headers={**headers, "If-Modified-Since": first.headers["last-modified"]})
+    assert since.status_code == 304
+
+    # Same parsed parameters in another spelling: same entry, served without querying the snapshots
+    monkeypatch.setattr(facebook_router, "MetricSnapshotResponse", None)
+    same = client.get(
+        "/facebook/act/act_123456789/insights_from_db?since=2024-1-01&level=campaign&limit=50", headers=headers
+    )
+    assert (same.status_code, same.headers["etag"], same.json()) == (200, etag, first.json())
+    monkeypatch.undo()
+
+    # Ingestion bumps the account's data version: new ETag, fresh body
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", [_campaign_insight("2024-01-02")])
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", [_campaign_insight("2024-01-02")])
+    assert db.get(FacebookAccount, fb_account.id).data_version == 2  # the unchanged refetch did not bump it
+    db.close()
+    changed = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert changed.json()["total"] == 2
+
+    other_level = client.get(url.replace("campaign&", "ad&"), headers=headers)
+    assert other_level.headers["etag"] != changed.headers["etag"]
+
+    # Another account at the same data version (e.g. just linked) never matches this account's ETag
+    _make_fb_account(test_user_and_token["user"].id, ad_account_id="act_555")
+    empty = client.get(url.replace("act_123456789", "act_555"), headers=headers)
+    first_empty = client.get(
+        url.replace("act_123456789", "act_555"), headers={**headers, "If-None-Match": empty.headers["etag"]}
+    )
+    assert first_empty.status_code == 304
+    db = TestingSessionLocal()
+    db.query(FacebookAccount).filter_by(ad_account_id="act_123456789").update({"data_version": None})
+    db.commit()
+    db.close()
+    reset = client.get(url, headers={**headers, "If-None-Match": empty.headers["etag"]})
+    assert reset.status_code == 200 and reset.json()["total"] == 2
+
+    accounts = client.get("/facebook/accounts", headers=headers)
+    assert accounts.status_code == 200 and accounts.json()[0]["ad_account_id"] == "act_123456789"
+    revalidated = client.get("/facebook/accounts", headers={**headers, "If-None-Match": accounts.headers["etag"]})
+    assert revalidated.status_code == 304
+
+
+def test_export_streams_ndjson_and_csv(test_user_and_token):
+    """Test the streaming export in both formats, with raw JSON and gzip."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    insights = [_campaign_insight(f"2024-01-{d:02d}", campaign_id=f"camp_{c}") for d in range(1, 8) for c in range(2)]
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", insights)
+    db.close()
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+    url = "/facebook/act/act_123456789/export"
+
+    response = client.get(f"{url}?since=2024-01-03&include_raw=true", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 10
+    assert lines[0]["ts"] == "2024-01-03"
+    assert lines[0]["ctr"] == 5.0
+    assert lines[0]["raw"]["campaign_id"] in ("camp_0", "camp_1")
+
+    response = client.get(f"{url}?format=csv&gzip=true", headers=headers)
+    assert response.headers["content-disposition"].endswith('.csv.gz"')
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.content).decode())))
+    assert len(rows) == 14
+    assert rows[-1]["ts"] == "2024-01-07"
+    assert float(rows[-1]["roas"]) == 5.0
+
+    response = client.get(f"{url}?format=csv&level=ad", headers=headers)
+    assert response.text.splitlines() == ["id,ts,level,entity_id,impressions,clicks,spend,conversions,revenue,ctr,roas"]
+    assert client.get(f"{url}?format=xml", headers=headers).status_code == 400
+
+
+def test_action_breakdowns_and_conversion_types(test_user_and_token):
+    """Test that action breakdowns are stored, summed, and drive configurable conversions."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    insights = []
+    for d in range(1, 4):
+        insight = _campaign_insight(f"2024-01-0{d}")
+        insight["actions"] += [
+            {"action_type": "add_to_cart", "value": "20"},
+            {"action_type": "link_click", "value": "40"},
+        ]
+        insight["action_values"].append({"action_type": "add_to_cart", "value": "900.00"})
+        insights.append(insight)
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", insights)
+    assert db.query(MetricAction).count() == 9
+
+    # A change confined to the breakdown is still written
+    insights[0]["actions"][2]["value"] = "41"
+    result = ingest_insights(db, fb_account.id, "act_123456789", "campaign", insights)
+    assert (result.updated, result.unchanged) == (1, 2)
+    assert db.query(MetricAction).filter(MetricAction.action_type == "link_click").count() == 3
+    snapshot = db.query(MetricSnapshot).filter(MetricSnapshot.ts == date(2024, 1, 1)).one()
+    assert json.loads(decode_raw(snapshot.raw, snapshot.raw_blob))["actions"][2]["value"] == "41"  # raw agrees
+    db.close()
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+    url = "/facebook/act/act_123456789"
+
+    response = client.get(f"{url}/actions?action_types=add_to_cart,link_click", headers=headers)
+    assert response.status_code == 200
+    actions = {item["action_type"]: item for item in response.json()["actions"]}
+    assert actions["link_click"]["count"] == 121
+    assert actions["add_to_cart"] == {"action_type": "add_to_cart", "count": 60, "value": 2700.0, "entities": 1}
+    assert "purchase" not in actions
+
+    assert client.get(f"{url}/conversion_actions", headers=headers).json()["action_types"] == [
+        "purchase",
+        "offsite_conversion.fb_pixel_purchase",
+    ]
+    response = client.put(f"{url}/conversion_actions", json={"action_types": ["add_to_cart"]}, headers=headers)
+    assert response.json() == {"action_types": ["add_to_cart"], "snapshots_updated": 3}
+
+    response = client.get(f"{url}/summary?since=2024-01-01&until=2024-01-03", headers=headers)
+    assert response.json()["totals"]["conversions"] == 60
+    assert response.json()["totals"]["revenue"] == 2700.0
+
+    # New rows use the account's types too
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", [insights[0] | {"date_start": "2024-01-04"}])
+    assert db.query(MetricSnapshot).filter(MetricSnapshot.ts == date(2024, 1, 4)).one().conversions == 20
+    db.close()
+
+
+def test_sqlite_engine_profile_waits_instead_of_locking(tmp_path):
+    """Test the SQLite pragmas, and that a second writer waits for the first instead of failing."""
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'profile.sqlite'}")
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() > 0
+        conn.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+        conn.commit()
+
+    writer = engine.connect()
+    writer.exec_driver_sql("BEGIN IMMEDIATE")
+    writer.exec_driver_sql("INSERT INTO t VALUES (1)")
+    with engine.connect() as reader:  # WAL: readers are not blocked by the open write
+        assert reader.exec_driver_sql("SELECT count(*) FROM t").scalar() == 0
+
+    def second_writer():
+        with engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO t VALUES (2)")
+
+    thread = threading.Thread(target=second_writer)
+    thread.start()
+    time.sleep(0.2)
+    writer.commit()
+    writer.close()
+    thread.join(timeout=10)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT count(*) FROM t").scalar() == 2
+    engine.dispose()
+
+
+def test_migrations_upgrade_old_schema_and_check_mode(tmp_path):
+    """Test versioned migrations on a pre-migrations database, idempotence, and the startup modes."""
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'migrate.sqlite'}")
+    with engine.begin() as conn:  # metric_snapshots as created before raw_blob and the keyset index
+        conn.exec_driver_sql(
+            "CREATE TABLE metric_snapshots (id INTEGER PRIMARY KEY, facebook_account_id INTEGER NOT NULL, "
+            "ts DATE NOT NULL, level VARCHAR(20) NOT NULL, entity_id VARCHAR(50) NOT NULL, "
+            "impressions INTEGER NOT NULL, clicks INTEGER NOT NULL, spend FLOAT NOT NULL, "
+            "conversions INTEGER NOT NULL, revenue FLOAT NOT NULL, raw TEXT, legacy TEXT, created_at DATETIME NOT NULL)"
+        )
+        conn.exec_driver_sql("CREATE INDEX ix_metric_snapshots_ts ON metric_snapshots (ts)")
+        conn.exec_driver_sql(
+            "INSERT INTO metric_snapshots VALUES (1, 1, '2024-01-01', 'ad', 'ad_1', 10, 1, 2.0, 0, 0.0, '{}', 'x', "
+            "'2024-01-02 00:00:00')"
+        )
+
+    with pytest.raises(migrations.PendingMigrationsError):
+        migrations.prepare_schema(engine, mode="check")
+    migrations.prepare_schema(engine, mode="skip")
+    assert migrations.current_version(engine) == 0
+
+    assert migrations.upgrade(engine) == list(range(1, migrations.latest_version() + 1))
+    assert migrations.current_version(engine) == migrations.latest_version()
+    columns = {column["name"] for column in inspect(engine).get_columns("metric_snapshots")}
+    assert {"raw_blob", "legacy"} <= columns
+    indexes = {index["name"] for index in inspect(engine).get_indexes("metric_snapshots")}
+    assert "idx_metric_account_level_ts_id" in indexes and "ix_metric_snapshots_ts" not in indexes
+    assert inspect(engine).has_table("metric_actions")
+    assert migrations.upgrade(engine) == []
+    migrations.prepare_schema(engine, mode="check")
+
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT entity_id, impressions FROM metric_snapshots").all() == [("ad_1", 10)]
+    engine.dispose()
+
+    # Replaying the history on a new database gives exactly the schema of the models
+    def schema(engine):
+        found = inspect(engine)
+        return {
+            table: (
+                sorted((c["name"], str(c["type"]), c["nullable"]) for c in found.get_columns(table)),
+                sorted((i["name"], i["column_names"], bool(i["unique"])) for i in found.get_indexes(table)),
+                sorted((k["referred_table"], k["constrained_columns"]) for k in found.get_foreign_keys(table)),
+            )
+            for table in found.get_table_names()
+            if table != "schema_migrations"
+        }
+
+    migrated = create_db_engine(f"sqlite:///{tmp_path / 'fresh.sqlite'}")
+    from_models = create_db_engine(f"sqlite:///{tmp_path / 'models.sqlite'}")
+    migrations.upgrade(migrated)
+    Base.metadata.create_all(bind=from_models)
+    assert schema(migrated) == schema(from_models)
+    migrated.dispose()
+    from_models.dispose()
+
+
+def test_retention_archives_old_months_and_restores_them(test_user_and_token, tmp_path, monkeypatch):
+    """Test archiving expired months to files, reading them back, the ingest guard, and restore."""
+    monkeypatch.setattr(retention, "ARCHIVE_DIR", str(tmp_path))
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    days = ["2024-01-30", "2024-01-31", "2024-02-01", "2024-03-15"]
+    insights = [_campaign_insight(day, campaign_id=f"camp_{c}") for day in days for c in range(2)]
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", insights)
+    assert retention.retention_cutoff(2, today=date(2024, 3, 20)) == date(2024, 2, 1)
+
+    archived = retention.archive_expired(db, retention_months=2, today=date(2024, 3, 20))
+    assert archived == [(fb_account.id, date(2024, 1, 1), 4)]
+    assert db.query(MetricSnapshot).count() == 4
+    assert db.query(MetricAction).count() == 4
+    catalog = db.query(MetricArchive).one()
+    assert (catalog.month, catalog.row_count) == (date(2024, 1, 1), 4)
+    assert catalog.path == str(tmp_path / str(fb_account.id) / "2024-01.ndjson.gz")
+    assert retention.archive_month(db, fb_account.id, date(2024, 1, 15)) == 0  # already archived
+
+    # Rows of an archived month are skipped instead of being counted twice in the rollups
+    result = ingest_insights(db, fb_account.id, "act_123456789", "campaign", [_campaign_insight("2024-01-31")])
+    assert (result.inserted, result.skipped) == (0, 1)
+    records = list(retention.iter_archived_rows(db, fb_account.id, since=date(2024, 1, 31)))
+    assert [(r["ts"], r["entity_id"]) for r in records] == [(date(2024, 1, 31), "camp_0"), (date(2024, 1, 31), "camp_1")]
+    assert records[0]["raw"]["campaign_id"] == "camp_0"
+    db.close()
+
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+    response = client.get(
+        "/facebook/act/act_123456789/summary?since=2024-01-01&until=2024-03-31&level=campaign", headers=headers
+    )
+    assert response.json()["totals"]["impressions"] == 8000  # rollups keep archived months
+    # Reads of raw snapshots flag the archived days they are missing
+    response = client.get("/facebook/act/act_123456789/insights_from_db", headers=headers)
+    assert response.json()["total"] == 4 and response.json()["archived_before"] == "2024-02-01"
+    response = client.get("/facebook/act/act_123456789/insights_from_db?total=estimate", headers=headers)
+    assert response.json()["total"] == 4  # the estimate counts hot rows only, like exact
+    response = client.get("/facebook/act/act_123456789/analytics?since=2024-01-15", headers=headers)
+    assert response.json()["archived_before"] == "2024-02-01"
+    response = client.get("/facebook/act/act_123456789/actions?since=2024-02-01", headers=headers)
+    assert response.json()["archived_before"] is None
+    summary_url = "/facebook/act/act_123456789/summary/entities?level=campaign"
+    response = client.get(f"{summary_url}&since=2024-01-15&until=2024-03-31", headers=headers)
+    assert response.json()["archived_before"] == "2024-02-01"
+    response = client.get(f"{summary_url}&since=2024-01-01&until=2024-03-31", headers=headers)
+    assert response.json()["archived_before"] is None  # January comes whole from the rollups
+    url = "/facebook/act/act_123456789/export?format=csv"
+    assert len(client.get(url, headers=headers).text.splitlines()) == 5
+    response = client.get(f"{url}&include_archived=true&until=2024-02-29", headers=headers)
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["ts"] for row in rows] == ["2024-01-30"] * 2 + ["2024-01-31"] * 2 + ["2024-02-01"] * 2
+    assert float(rows[0]["ctr"]) == 5.0
+    response = client.get(f"{url.replace('csv', 'ndjson')}&include_archived=true&include_raw=true", headers=headers)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 8 and lines[0]["raw"]["date_start"] == "2024-01-30"
+
+    db = TestingSessionLocal()
+    assert retention.restore_month(db, fb_account.id, date(2024, 1, 1)) == 4
+    assert db.query(MetricSnapshot).count() == 8
+    assert db.query(MetricAction).count() == 8
+    assert db.query(MetricArchive).count() == 0
+    assert not (tmp_path / str(fb_account.id) / "2024-01.ndjson.gz").exists()
+    restored = db.query(MetricSnapshot).filter(MetricSnapshot.ts == date(2024, 1, 30)).first()
+    assert json.loads(decode_raw(restored.raw, restored.raw_blob))["date_start"] == "2024-01-30"
+    db.close()
+
+
+def test_rebuilding_rollups_keeps_archived_months(test_user_and_token, tmp_path, monkeypatch):
+    """Test that a rollup rebuild (also run by a conversion types change) reads archived months back."""
+    monkeypatch.setattr(retention, "ARCHIVE_DIR", str(tmp_path))
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    days = ["2024-01-31", "2024-03-15"]
+    insights = [_campaign_insight(day, campaign_id=f"camp_{c}") for day in days for c in range(2)]
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", insights)
+    assert retention.archive_month(db, fb_account.id, date(2024, 1, 1)) == 2
+
+    def rollups():
+        rows = db.query(MetricRollup)
+        return sorted((r.grain, r.period_start, r.entity_id, r.impressions, r.row_count) for r in rows)
+
+    before = rollups()
+    assert rebuild_rollups(db, fb_account.id) == 4
+    assert rollups() == before
+    db.close()
+
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+    url = "/facebook/act/act_123456789"
+    summary = f"{url}/summary?since=2024-01-01&until=2024-03-31&level=campaign"
+    assert client.get(summary, headers=headers).json()["totals"]["impressions"] == 4000
+    response = client.put(f"{url}/conversion_actions", json={"action_types": ["add_to_cart"]}, headers=headers)
+    assert response.status_code == 200
+    assert client.get(summary, headers=headers).json()["totals"]["impressions"] == 4000
+
+
+def test_query_plans_use_indexes(test_user_and_token):
+    """Test that every router query on the metric tables is index-driven and every index is used."""
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+    with capture_statements(engine, async_engine.sync_engine) as statements:
+        db = TestingSessionLocal()
+        ingest_insights(db, fb_account.id, "act_123456789", "ad", make_insights(900), chunk_size=300)
+        db.close()
+        run_workload(client, "act_123456789", headers)
+
+    report = audit(engine, statements)
+    assert report.ok, format_report(report)
+    assert any("metric_snapshots" in plan.statement for plan in report.plans)
+    # The ingest lookup seeks to the chunk's dates instead of reading the whole account
+    lookup = next(plan for plan in report.plans if "metric_snapshots.ts BETWEEN" in plan.statement)
+    assert "ts>?" in lookup.plan[0], lookup.plan
+
+
+def test_raw_json_is_compressed_deferred_and_migratable(test_user_and_token):
+    """Test raw storage encoding, deferred loading and migration of legacy text rows."""
+    document = json.dumps({"campaign_id": "camp_1", "actions": [{"action_type": "purchase", "value": "1"}] * 20})
+    for mode in ("zlib", "text", "none"):
+        values = encode_raw(document, mode)
+        assert decode_raw(values["raw"], values["raw_blob"]) == (None if mode == "none" else document)
+    assert len(encode_raw(document, "zlib")["raw_blob"]) < len(document)
+
+    fb_account = _make_fb_account(test_user_and_token["user"].id)
+    db = TestingSessionLocal()
+    ingest_insights(db, fb_account.id, "act_123456789", "campaign", [_campaign_insight("2024-01-01")])
+    snapshot = db.query(MetricSnapshot).one()
+    assert "raw_blob" in inspect(snapshot).unloaded
+    assert snapshot.raw is None
+    assert json.loads(decode_raw(snapshot.raw, snapshot.raw_blob))["campaign_id"] == "camp_1"
+
+    # A row written before compression existed is rewritten in place
+    db.query(MetricSnapshot).update({"raw": document, "raw_blob": None})
+    db.commit()
+    assert migrate_raw_storage(db, "zlib", batch_size=1) == 1
+    assert migrate_raw_storage(db, "zlib") == 0
+    db.expire_all()
+    snapshot = db.query(MetricSnapshot).one()
+    assert snapshot.raw is None
+    assert decode_raw(snapshot.raw, snapshot.raw_blob) == document
+    db.close()
+
+
+ADS_MANAGER_CSV = """\ufeffReporting starts,Reporting ends,Campaign name,Campaign ID,Day,Impressions,Clicks (all),Amount spent (USD),Purchases,Purchases conversion value
+2024-01-01,2024-01-02,Spring,111,2024-01-01,"1,200",30,45.50,2,120.00
+2024-01-01,2024-01-02,Spring,111,2024-01-02,800,10,20.00,,
+2024-01-01,2024-01-02,Summer,222,2024-01-01,500,5,10.25,1,40.00
+,,,,,"2,500",45,75.75,3,160.00
+"""
+
+
+def test_csv_upload_is_ingested_by_a_job(test_user_and_token, tmp_path, monkeypatch):
+    """Test that an Ads Manager CSV upload is queued, parsed and upserted."""
+    monkeypatch.setattr(pages_routes, "UPLOAD_DIR", str(tmp_path))
+    _make_fb_account(test_user_and_token["user"].id)
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+
+    response = client.post(
+        "/reports/upload",
+        data={"ad_account_id": "act_123456789"},
+        files={"file": ("report.csv", ADS_MANAGER_CSV.encode(), "text/csv")},
+        headers=headers,
+    )
+    assert response.status_code == 202
+    job = response.json()
+    assert job["kind"] == "csv_upload"
+
+    assert process_next_job(TestingSessionLocal, client_factory=_job_client_factory(FakeGraphAPI())) == job["id"]
+    data = client.get(f"/jobs/{job['id']}", headers=headers).json()
+    assert data["status"] == "succeeded"
+    assert data["progress"] == 1.0
+    assert (data["rows_inserted"], data["rows_skipped"]) == (3, 1)  # the totals row has no ID
+    assert list(tmp_path.iterdir()) == []  # upload removed once ingested
+
+    db = TestingSessionLocal()
+    rows = db.query(MetricSnapshot).order_by(MetricSnapshot.entity_id, MetricSnapshot.ts).all()
+    assert [(r.level, r.entity_id, r.ts.isoformat()) for r in rows] == [
+        ("campaign", "111", "2024-01-01"),
+        ("campaign", "111", "2024-01-02"),
+        ("campaign", "222", "2024-01-01"),
+    ]
+    assert (rows[0].impressions, rows[0].clicks, rows[0].spend, rows[0].conversions, rows[0].revenue) == (
+        1200, 30, 45.5, 2, 120.0
+    )
+    db.close()
+
+    response = client.post(
+        "/reports/upload",
+        data={"ad_account_id": "act_123456789"},
+        files={"file": ("other.csv", b"Name,Value\nfoo,1\n", "text/csv")},
+        headers=headers,
+    )
+    assert response.status_code == 400
+    assert client.post("/reports/upload", files={"file": ("report.csv", b"", "text/csv")}).status_code == 401
+
+
+def test_csv_upload_dates_and_file_cleanup(test_user_and_token, tmp_path, monkeypatch):
+    """Test that day/month dates need date_order and that cancelled uploads are deleted."""
+    monkeypatch.setattr(pages_routes, "UPLOAD_DIR", str(tmp_path))
+    _make_fb_account(test_user_and_token["user"].id)
+    headers = {"Authorization": f"Bearer {test_user_and_token['token']}"}
+
+    def upload(body: str, **form):
+        return client.post(
+            "/reports/upload",
+            data={"ad_account_id": "act_123456789", **form},
+            files={"file": ("report.csv", body.encode(), "text/csv")},
+            headers=headers,
+        )
+
+    body = "Campaign ID,Day,Impressions\n111,02/01/2024,100\n111,13/01/2024,100\n"
+    response = upload(body)
+    assert response.status_code == 400 and "date_order" in response.json()["detail"]
+    assert upload(body, date_order="ymd").status_code == 400
+    # Without a Day column each row must cover a single day, not the report's whole range
+    response = upload("Campaign ID,Reporting starts,Reporting ends,Impressions\n111,2024-01-01,2024-01-31,3100\n")
+    assert response.status_code == 400 and "daily breakdown" in response.json()["detail"]
+    assert list(tmp_path.iterdir()) == []
+
+    job = upload(body, date_order="dmy").json()
+    assert process_next_job(TestingSessionLocal, client_factory=_job_client_factory(FakeGraphAPI())) == job["id"]
+    db = TestingSessionLocal()
+    assert sorted(r.ts.isoformat() for r in db.query(MetricSnapshot)) == ["2024-01-02", "2024-01-13"]
+    db.close()
+
+    # Cancelling a queued upload deletes the file no worker will read
+    job = upload(body.replace("100", "200"), date_order="dmy").json()
+    assert len(list(tmp_path.iterdir())) == 1
+    assert client.post(f"/jobs/{job['id']}/cancel", headers=headers).json()["status"] == "cancelled"
+    assert list(tmp_path.iterdir()) == []
+
+    # So does the final status of a job claimed by a worker that then crashed
+    job = upload(body.replace("100", "300"), date_order="dmy").json()
+    db = TestingSessionLocal()
+    assert claim_next_job(db, "crashed").id == job["id"]
+    db.close()
+    client.post(f"/jobs/{job['id']}/cancel", headers=headers)
+    assert run_job(job["id"], TestingSessionLocal, _job_client_factory(FakeGraphAPI())) == "cancelled"
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,69 @@
+"""
+Shared workloads for the tests and the benchmarks: synthetic Graph API
+insight rows and requests covering every access path of the insights
+routers.
+"""
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+
+
+def make_insights(n_rows: int):
+    """Ad-level rows spread over 90 days, ads spread over 10 adsets in 3 campaigns."""
+    ads_per_day = max(1, n_rows // 90)
+    start = date(2024, 1, 1)
+    insights = []
+    for i in range(n_rows):
+        day = start + timedelta(days=i // ads_per_day)
+        ad, adset, campaign = i % ads_per_day, i % ads_per_day % 10, i % ads_per_day % 10 % 3
+        insights.append(
+            {
+                "date_start": day.isoformat(),
+                "date_stop": day.isoformat(),
+                "ad_id": f"ad_{ad}",
+                "ad_name": f"Ad {ad}",
+                "adset_id": f"adset_{adset}",
+                "adset_name": f"Adset {adset}",
+                "campaign_id": f"camp_{campaign}",
+                "campaign_name": f"Campaign {campaign}",
+                "impressions": str(1000 + i),
+                "clicks": str(i % 97),
+                "spend": f"{(i % 500) / 10:.2f}",
+                "actions": [{"action_type": "purchase", "value": str(i % 3)}],
+                "action_values": [{"action_type": "purchase", "value": f"{i % 300:.2f}"}],
+            }
+        )
+    return insights
+
+
+# Requests covering every access path of the insights routers
+ROUTER_REQUESTS = [
+    ("GET", "/facebook/accounts"),
+    ("GET", "/facebook/act/act_1/insights_from_db?level=ad&limit=50"),
+    ("GET", "/facebook/act/act_1/insights_from_db?limit=50&since=2024-01-15&until=2024-02-15"),
+    ("GET", "/facebook/act/act_1/analytics?level=ad&since=2024-01-01&until=2024-01-31"),
+    ("GET", "/facebook/act/act_1/export?level=ad&since=2024-03-01"),
+    ("GET", "/facebook/act/act_1/summary?level=ad&since=2024-01-01&until=2024-03-31&grain=week"),
+    ("GET", "/facebook/act/act_1/summary/entities?level=ad&since=2024-01-03&until=2024-03-20"),
+    ("GET", "/facebook/act/act_1/summary/hierarchy?level=ad&group_by=campaign&since=2024-01-03&until=2024-03-20"),
+    ("GET", "/facebook/act/act_1/summary/hierarchy?level=ad&group_by=adset&campaign_id=camp_1&since=2024-01-01"
+            "&until=2024-01-31"),
+    ("GET", "/facebook/act/act_1/entities?level=campaign"),
+    ("GET", "/facebook/act/act_1/entities?level=ad&parent_id=adset_1"),
+    ("GET", "/facebook/act/act_1/actions?level=ad&since=2024-01-01"),
+    ("GET", "/facebook/act/act_1/actions?level=ad&action_types=purchase"),
+    ("GET", "/facebook/act/act_1/conversion_actions"),
+    ("PUT", "/facebook/act/act_1/conversion_actions"),
+]
+
+
+def run_workload(client: TestClient, ad_account_id: str = "act_1", headers=None) -> None:
+    """Issue every request of ``ROUTER_REQUESTS`` (and the next page of the first listing)."""
+    for method, url in ROUTER_REQUESTS:
+        url = url.replace("act_1", ad_account_id)
+        body = {"action_types": ["purchase"]} if method == "PUT" else None
+        response = client.request(method, url, headers=headers, json=body)
+        assert response.status_code == 200, f"{method} {url}: {response.status_code} {response.text}"
+        cursor = response.json().get("next_cursor") if "insights_from_db" in url else None
+        if cursor:
+            assert client.get(f"{url}&cursor={cursor}", headers=headers).status_code == 200
\ No newline at end of file